@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure the cost of parsing a METS and merging the output of a processor
+into it, depending on the size of the METS.
+
+    python benchmarks/mets.py [pages ...]
+
+Every METS has 8 file groups with one file per page. The merge adds a new
+file group with one file per page, once with `merge_file_groups` and once
+file by file with `OcrdMets.add_file` (only up to 1000 pages, it grows
+quadratically).
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from ocrd_models.ocrd_mets import OcrdMets
+
+from ocrd_butler.execution.mets import (
+    merge_file_groups,
+    prune_pages
+)
+
+
+FILE_GRPS = 8
+ADD_FILE_MAX_PAGES = 1000
+
+
+def mets_xml(pages, file_grps):
+    """ Create the XML of a METS with one file per page and group. """
+    files = []
+    for grp in range(file_grps):
+        files.append('<mets:fileGrp USE="GRP_{0}">'.format(grp))
+        for page in range(pages):
+            files.append(
+                '<mets:file ID="FILE_{0}_{1:05d}" MIMETYPE="image/tiff">'
+                '<mets:FLocat LOCTYPE="OTHER" OTHERLOCTYPE="FILE" '
+                'xlink:href="GRP_{0}/FILE_{0}_{1:05d}.tif"/></mets:file>'.format(grp, page))
+        files.append("</mets:fileGrp>")
+    divs = []
+    for page in range(pages):
+        divs.append('<mets:div TYPE="page" ID="PHYS_{0:05d}">'.format(page))
+        for grp in range(file_grps):
+            divs.append('<mets:fptr FILEID="FILE_{0}_{1:05d}"/>'.format(grp, page))
+        divs.append("</mets:div>")
+    return (
+        '<mets:mets xmlns:mets="http://www.loc.gov/METS/" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink">'
+        '<mets:metsHdr/><mets:fileSec>{0}</mets:fileSec>'
+        '<mets:structMap TYPE="PHYSICAL">'
+        '<mets:div TYPE="physSequence">{1}</mets:div>'
+        '</mets:structMap></mets:mets>'.format("".join(files), "".join(divs))
+    ).encode("utf-8")
+
+
+def timed(function, *args, **kwargs):
+    """ Call the function, return the seconds it took. """
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def add_files(mets, pages):
+    """ Add the output group file by file, like ocrd does. """
+    for page in range(pages):
+        mets.add_file(
+            "OCR-D-OUT", ID="OUT_{0:05d}".format(page), mimetype="text/xml",
+            url="OCR-D-OUT/OUT_{0:05d}.xml".format(page),
+            pageId="PHYS_{0:05d}".format(page))
+
+
+def benchmark(pages, directory):
+    """ Measure the METS operations for the number of pages. """
+    path = os.path.join(directory, "mets-{0}.xml".format(pages))
+    with open(path, "wb") as fh:
+        fh.write(mets_xml(pages, FILE_GRPS))
+
+    result = {
+        "pages": pages,
+        "files": pages * FILE_GRPS,
+        "size": os.path.getsize(path),
+        "parse": timed(OcrdMets, filename=path),
+    }
+
+    # The METS written by a processor, with one more group.
+    source = OcrdMets(content=mets_xml(pages, FILE_GRPS + 1))
+    result["merge"] = timed(merge_file_groups, OcrdMets(filename=path),
+                            source, ["GRP_{0}".format(FILE_GRPS)])
+    if pages <= ADD_FILE_MAX_PAGES:
+        result["add_file"] = timed(add_files, OcrdMets(filename=path), pages)
+    result["prune"] = timed(prune_pages, OcrdMets(filename=path),
+                            ["PHYS_00000"])
+    return result
+
+
+def main(sizes):
+    """ Print the measurements as a table. """
+    print("{0:>7} {1:>7} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}".format(
+        "pages", "files", "bytes", "parse", "prune", "merge", "add_file"))
+    with tempfile.TemporaryDirectory() as directory:
+        for pages in sizes:
+            result = benchmark(pages, directory)
+            print("{pages:>7} {files:>7} {size:>10} {parse:>9.4f} "
+                  "{prune:>9.4f} {merge:>9.4f} {0:>9}".format(
+                      "{0:.4f}".format(result["add_file"]) if "add_file" in result else "-",
+                      **result))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10, 100, 500, 1000, 5000])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure the time and memory needed to find the processors, by importing
+the processor packages like the butler did before and with the registry,
+once without and once with its cache.
+
+    python benchmarks/startup.py [package ...]
+
+Every measurement runs in a fresh Python process, the memory is its
+maximal resident set size. The packages are the `PROCESSOR_PACKAGES` of
+the config if none are given, the scripts are left out.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from ocrd_butler.config import Config
+
+
+MEASURE = """
+import json, resource, sys, time
+started = time.perf_counter()
+from ocrd_butler import registry
+mode, packages, cache = sys.argv[1], sys.argv[2].split(","), sys.argv[3]
+if mode == "import":
+    for package in packages:
+        __import__(package, fromlist=["config", "cli"])
+    processors = registry.load_config(registry.tool_files([], packages))
+else:
+    processors = registry.ProcessorRegistry([], packages, cache=cache).config()
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "processors": len(processors),
+}))
+"""
+
+
+def measure(mode, packages, cache):
+    """ Find the processors in a new process, return its measurements. """
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE, mode, ",".join(packages), cache],
+        check=True, stdout=subprocess.PIPE,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).stdout
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def main(packages):
+    """ Print the measurements as a table. """
+    print("{0:>10} {1:>10} {2:>10} {3:>10}".format(
+        "mode", "seconds", "rss (MB)", "processors"))
+    with tempfile.TemporaryDirectory() as directory:
+        cache = os.path.join(directory, "processors.json")
+        # The first registry run writes the cache the second one reads.
+        for mode, label in (("import", "import"), ("registry", "discover"),
+                            ("registry", "cached")):
+            result = measure(mode, packages, cache)
+            print("{0:>10} {seconds:>10.3f} {1:>10.1f} {processors:>10}".format(
+                label, result["rss"] / 1024.0, **result))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or Config.PROCESSOR_PACKAGES)
@@ -7,6 +7,7 @@ __email__ = 'marco.scheidhuber@sbb.spk-berlin.de'
 __version__ = '0.1.0'
 
 from celery import Celery
+from ocrd_butler.celery_utils import BROKER_TRANSPORT_OPTIONS
 from ocrd_butler.config import DevelopmentConfig
 from ocrd_butler.config import ProductionConfig
 from ocrd_butler.config import TestingConfig
@@ -24,9 +25,11 @@ def make_celery(app_name=__name__, config=None):
     if config is None:
         config = DevelopmentConfig()
 
-    return Celery(app_name,
-                  backend=config.CELERY_RESULT_BACKEND_URL,
-                  broker=config.CELERY_BROKER_URL)
+    celery = Celery(app_name,
+                    backend=config.CELERY_RESULT_BACKEND_URL,
+                    broker=config.CELERY_BROKER_URL)
+    celery.conf.update(broker_transport_options=BROKER_TRANSPORT_OPTIONS)
+    return celery
 
 # The base celery object of the app.
 celery = make_celery()
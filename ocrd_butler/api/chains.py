@@ -3,6 +3,7 @@
 
 """ Chain api implementation.
 """
+import copy
 import json
 
 from flask import (
@@ -14,16 +15,19 @@ from flask_restx import (
     Resource,
     marshal
 )
-from ocrd_validators import ParameterValidator
+from flask_restx.fields import MarshallingError
 
 from ocrd_butler.api.restx import api
 from ocrd_butler.api.models import chain_model
-from ocrd_butler.api.processors import (
-    PROCESSOR_NAMES,
-    PROCESSORS_CONFIG
-)
+from ocrd_butler.api.processors import PROCESSOR_NAMES
 from ocrd_butler.database import db
 from ocrd_butler.database.models import Chain as db_model_Chain
+from ocrd_butler.execution.costs import estimate_chain
+from ocrd_butler.execution.plans import (
+    chain_plan,
+    compile_plan,
+    processor_validator
+)
 
 chain_namespace = api.namespace("chains", description="Manage OCR-D processor chains")
 
@@ -33,11 +37,25 @@ class ChainBase(Resource):
 
     def chain_data(self, json_data):
         """ Validate and prepare chain input. """
-        data = marshal(data=json_data, fields=chain_model, skip_none=False)
+        try:
+            data = marshal(data=json_data, fields=chain_model, skip_none=False)
+        except MarshallingError as exc:
+            chain_namespace.abort(400, "Wrong parameter.",
+                                  status=str(exc), statusCode="400")
 
         if data["parameters"] is None:
             data["parameters"] = {}
 
+        if data["shard_size"] is not None and data["shard_size"] < 0:
+            chain_namespace.abort(
+                400, "Wrong parameter.",
+                status="Shard size \"{0}\" is negative.".format(
+                    data["shard_size"]),
+                statusCode="400")
+
+        if data["nodes"] is not None:
+            data["processors"] = self.node_processors(data["nodes"])
+
         # Should some checks be in the model itself?
         if data["processors"] is None:
             chain_namespace.abort(400, "Wrong parameter.",
@@ -54,8 +72,7 @@ class ChainBase(Resource):
             # The OCR-D validator updates all parameters with default values.
             if processor not in data["parameters"].keys():
                 data["parameters"][processor] = {}
-            validator = ParameterValidator(PROCESSORS_CONFIG[processor])
-            report = validator.validate(data["parameters"][processor])
+            report = processor_validator(processor).validate(data["parameters"][processor])
             if not report.is_valid:
                 chain_namespace.abort(
                     400, "Wrong parameter.",
@@ -66,8 +83,42 @@ class ChainBase(Resource):
                                 str(report.errors)),
                     statusCode="400")
 
+        for node in data["nodes"] or []:
+            if not node.get("parameters"):
+                continue
+            # Validate a copy, the defaults are the ones of the chain.
+            parameters = copy.deepcopy(data["parameters"][node["processor"]])
+            parameters.update(node["parameters"])
+            report = processor_validator(node["processor"]).validate(parameters)
+            if not report.is_valid:
+                chain_namespace.abort(
+                    400, "Wrong parameter.",
+                    status="Error while validating parameters \"{0}\""
+                           "for node \"{1}\" -> \"{2}\".".format(
+                                node["parameters"],
+                                node["processor"],
+                                str(report.errors)),
+                    statusCode="400")
+
+        try:
+            compile_plan(data["processors"], data["parameters"], data["nodes"])
+        except ValueError as exc:
+            chain_namespace.abort(400, "Wrong parameter.",
+                                  status=str(exc), statusCode="400")
+
         return data
 
+    def node_processors(self, nodes):
+        """ The processors of the nodes of a graph. """
+        if not isinstance(nodes, list) or not nodes or not all(
+                isinstance(node, dict) and node.get("processor")
+                for node in nodes):
+            chain_namespace.abort(
+                400, "Wrong parameter.",
+                status="Every node needs a processor.",
+                statusCode="400")
+        return [node["processor"] for node in nodes]
+
 @chain_namespace.route("")
 class Chains(ChainBase):
     """ Add chains and list all of it. """
@@ -79,6 +130,7 @@ class Chains(ChainBase):
 
         data = self.chain_data(request.json)
         chain = db_model_Chain(**data)
+        chain_plan(chain)
         db.session.add(chain)
         db.session.commit()
 
@@ -124,10 +176,27 @@ class Chain(ChainBase):
                     chain_id),
                 statusCode="404")
 
-        fields = chain.to_json().keys()
+        # The plan is compiled from the other fields.
+        fields = set(chain.to_json().keys()) - {"plan", "plan_version"}
         for field in fields:
             if field in request.json:
                 setattr(chain, field, request.json[field])
+        if request.json.get("nodes"):
+            chain.processors = self.node_processors(chain.nodes)
+        if {"processors", "parameters", "nodes"} & set(request.json):
+            chain.plan = None
+        try:
+            chain_plan(chain)
+        except KeyError as exc:
+            db.session.rollback()
+            chain_namespace.abort(
+                400, "Wrong parameter.",
+                status="Unknown processor {0}.".format(exc),
+                statusCode="400")
+        except ValueError as exc:
+            db.session.rollback()
+            chain_namespace.abort(
+                400, "Wrong parameter.", status=str(exc), statusCode="400")
         db.session.commit()
 
         return jsonify({
@@ -154,3 +223,42 @@ class Chain(ChainBase):
         return jsonify({
             "message": message
         })
+
+
+@chain_namespace.route("/<string:chain_id>/estimate")
+class ChainEstimate(ChainBase):
+    """Estimate the runtime of a chain."""
+
+    @api.doc(params={"pages": "Number of pages of the work.",
+                     "megapixels": "Megapixels of all images, if known."},
+             responses={200: "Found", 400: "Wrong parameter",
+                        404: "Not known chain id."})
+    def get(self, chain_id):
+        """
+        Estimate the seconds the chain takes for a work from the cost of
+        its processors in the finished tasks. Processors which never ran
+        are listed as unknown, without them there is no total.
+        """
+        chain = db_model_Chain.query.filter_by(id=chain_id).first()
+        if chain is None:
+            chain_namespace.abort(
+                404, "Wrong parameter",
+                status="Can't find a chain with the id \"{0}\".".format(chain_id),
+                statusCode="404")
+
+        try:
+            pages = int(request.args["pages"])
+            megapixels = request.args.get("megapixels")
+            megapixels = float(megapixels) if megapixels else None
+        except (KeyError, ValueError):
+            chain_namespace.abort(
+                400, "Wrong parameter",
+                status="Give the number of pages and optionally the megapixels.",
+                statusCode="400")
+        if pages < 1:
+            chain_namespace.abort(
+                400, "Wrong parameter",
+                status="The number of pages has to be positive.",
+                statusCode="400")
+
+        return jsonify(estimate_chain(chain, pages, megapixels))
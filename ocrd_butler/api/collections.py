@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-member
+
+""" Collection api implementation.
+"""
+from datetime import datetime
+import json
+import uuid
+
+from flask import (
+    current_app,
+    make_response,
+    jsonify,
+    request
+)
+from flask_restx import (
+    Resource,
+    marshal
+)
+from flask_restx.fields import MarshallingError
+
+from ocrd_butler.api.restx import api
+from ocrd_butler.api.models import collection_model
+from ocrd_butler.database import db
+from ocrd_butler.database.models import Chain as db_model_Chain
+from ocrd_butler.database.models import Collection as db_model_Collection
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.dispatcher import (
+    collection_progress,
+    dispatch_collections
+)
+from ocrd_butler.execution.plans import (
+    chain_plan,
+    processor_validator,
+    task_fingerprint
+)
+
+collection_namespace = api.namespace(
+    "collections", description="Process many works with the same chain")
+
+
+class CollectionBase(Resource):
+    """Base methods for collections."""
+
+    def __init__(self, api=None, *args, **kwargs):
+        super().__init__(api, *args, **kwargs)
+        self.post_actions = ("start", "pause", "resume")
+
+    def collection_data(self, json_data):
+        """ Validate and prepare collection input. """
+        try:
+            data = marshal(data=json_data, fields=collection_model, skip_none=False)
+        except MarshallingError as exc:
+            collection_namespace.abort(400, "Wrong parameter.",
+                                       status=str(exc), statusCode="400")
+
+        if data["parameters"] is None:
+            data["parameters"] = {}
+        if not data["sources"]:
+            collection_namespace.abort(
+                400, "Wrong parameter.",
+                status="Missing sources for collection.",
+                statusCode="400")
+        if data["max_in_flight"] is None:
+            data["max_in_flight"] = current_app.config["COLLECTION_MAX_IN_FLIGHT"]
+        if data["max_in_flight"] < 1:
+            collection_namespace.abort(
+                400, "Wrong parameter.",
+                status="At least one task has to be in flight.",
+                statusCode="400")
+
+        if data["priority"] is None:
+            data["priority"] = current_app.config["TASK_DEFAULT_PRIORITY"]
+        if data["priority"] not in range(10):
+            collection_namespace.abort(
+                400, "Wrong parameter.",
+                status="Priority \"{0}\" is not a number from 0 to 9.".format(
+                    data["priority"]),
+                statusCode="400")
+
+        chain = db_model_Chain.query.filter_by(id=data["chain_id"]).first()
+        if chain is None:
+            collection_namespace.abort(
+                400, "Wrong parameter.",
+                status="Unknown chain with id {}.".format(data["chain_id"]),
+                statusCode="400")
+        chain_plan(chain)
+
+        # The parameters are the same for all tasks, validate them once.
+        for processor in data["parameters"].keys():
+            report = processor_validator(processor).validate(data["parameters"][processor])
+            if not report.is_valid:
+                collection_namespace.abort(
+                    400, "Wrong parameter.",
+                    status="Unknown parameter \"{0}\" for processor \"{1}\".".format(
+                        data["parameters"][processor], processor),
+                    statusCode="400")
+
+        return data
+
+    def get_collection(self, collection_id):
+        collection = db_model_Collection.query.filter_by(id=collection_id).first()
+        if collection is None:
+            collection_namespace.abort(
+                404, "Wrong parameter",
+                status="Can't find a collection with the id \"{0}\".".format(
+                    collection_id),
+                statusCode="404")
+        return collection
+
+
+@collection_namespace.route("")
+class Collections(CollectionBase):
+    """ Add collections and list all of it. """
+
+    @api.doc(responses={201: "Created", 400: "Wrong parameter."})
+    @api.expect(collection_model)
+    def post(self):
+        """ Add a new collection with a task for every source. """
+        data = self.collection_data(request.json)
+        sources = data.pop("sources")
+
+        collection = db_model_Collection(created=datetime.now(), **data)
+        db.session.add(collection)
+        db.session.flush()
+        parameters = json.dumps(data["parameters"])
+        chain = collection.chain.to_json()
+        db.session.add_all([
+            db_model_Task(
+                uid=uuid.uuid4().__str__(),
+                src=src,
+                chain_id=collection.chain_id,
+                parameters=parameters,
+                description="{0} ({1}/{2})".format(
+                    collection.name, number, len(sources)),
+                default_file_grp=collection.default_file_grp,
+                collection_id=collection.id,
+                priority=collection.priority,
+                submitter=collection.submitter,
+                fingerprint=task_fingerprint({
+                    "src": src,
+                    "default_file_grp": collection.default_file_grp,
+                    "parameters": data["parameters"],
+                    "chain": chain,
+                }))
+            for number, src in enumerate(sources, 1)])
+        db.session.commit()
+
+        return make_response({
+            "message": "Collection created.",
+            "id": collection.id,
+        }, 201)
+
+    @api.doc(responses={200: "Found"})
+    def get(self):
+        """ Get all collections. """
+        collections = db_model_Collection.query.all()
+        return jsonify([collection.to_json() for collection in collections])
+
+
+@collection_namespace.route("/<string:collection_id>")
+class Collection(CollectionBase):
+    """Getter and remover for collections."""
+
+    @api.doc(responses={200: "Found", 404: "Not known collection id."})
+    def get(self, collection_id):
+        """ Get the collection with its progress. """
+        collection = self.get_collection(collection_id)
+        result = collection.to_json()
+        result["progress"] = collection_progress(collection)
+        return jsonify(result)
+
+    @api.doc(responses={200: "Deleted", 400: "Still running",
+                        404: "Unknown collection."})
+    def delete(self, collection_id):
+        """ Delete the collection, its tasks are kept. """
+        collection = self.get_collection(collection_id)
+        if collection.status == "RUNNING":
+            collection_namespace.abort(
+                400, "Wrong parameter",
+                status="Pause the collection \"{0}\" first.".format(
+                    collection_id),
+                statusCode="400")
+        collection.tasks.update({"collection_id": None},
+                                synchronize_session=False)
+        db.session.delete(collection)
+        db.session.commit()
+
+        return jsonify({
+            "message": "Collection deleted.",
+            "id": int(collection_id),
+        })
+
+
+@collection_namespace.route("/<string:collection_id>/<string:action>")
+class CollectionActions(CollectionBase):
+    """Start, pause and resume the collection."""
+
+    @api.doc(responses={200: "OK", 400: "Unknown action",
+                        404: "Unknown collection"})
+    def post(self, collection_id, action):
+        """ Execute the given action for the collection. """
+        collection = self.get_collection(collection_id)
+
+        if action not in self.post_actions:
+            collection_namespace.abort(
+                400, "Unknown action.",
+                status="Unknown action \"{0}\".".format(action),
+                statusCode="400")
+
+        return getattr(self, action)(collection)
+
+    def start(self, collection):
+        """ Start dispatching the tasks of the collection. """
+        if collection.status == "FINISHED":
+            collection_namespace.abort(
+                400, "Wrong parameter",
+                status="The collection \"{0}\" is finished.".format(
+                    collection.id),
+                statusCode="400")
+        collection.status = "RUNNING"
+        if collection.started is None:
+            collection.started = datetime.now()
+        db.session.commit()
+        dispatched = dispatch_collections()
+
+        return jsonify({
+            "message": "Collection running.",
+            "id": collection.id,
+            "dispatched": dispatched,
+        })
+
+    def pause(self, collection):
+        """
+        Stop dispatching the tasks of the collection. The tasks in flight
+        are finished.
+        """
+        collection.status = "PAUSED"
+        db.session.commit()
+
+        return jsonify({
+            "message": "Collection paused.",
+            "id": collection.id,
+        })
+
+    def resume(self, collection):
+        """ Continue with the task after the cursor. """
+        return self.start(collection)
@@ -50,6 +50,26 @@ task_model = api.model("Task Model", {
         required=False,
         description="Results of a processed task.",
         default={}),
+    "shard_size": fields.Integer(
+        title="Shard size",
+        required=False,
+        description="Run the chain in parallel on shards of this many pages, "
+                    "0 runs it on all pages at once.",
+        help="Overwrites the shard size of the chain, 0 disables sharding."),
+    "priority": fields.Integer(
+        title="Priority",
+        required=False,
+        description="From 0 to 9, tasks with a higher priority are processed first.",
+        help="Defaults to TASK_DEFAULT_PRIORITY of the config."),
+    "submitter": fields.String(
+        title="Submitter",
+        required=False,
+        description="Who submitted the task, queued tasks are shared fairly between submitters."),
+    "force": fields.String(
+        title="Force",
+        required=False,
+        description="Create the task even if the same one is finished or running.",
+        help="Defaults to false."),
 })
 
 
@@ -72,6 +92,15 @@ class ChainParametersField(fields.Raw):
         return value
 
 
+class ChainNodesField(fields.Raw):
+    __schema_type__ = 'list'
+    __schema_format__ = 'JSON'
+    __schema_example__ = '[{"processor": "processor-1", "input_file_grp": ["GRP-1"], "output_file_grp": "GRP-2", "parameters": {...}}, ...]'
+
+    def format(self, value):
+        return value
+
+
 chain_model = api.model("Chain Model", {
     "name": fields.String(
         title="Name",
@@ -98,4 +127,64 @@ chain_model = api.model("Chain Model", {
         default={},
         description="The default parameters for the processors.",
         help="The parameters will be use while running the processor. Can be overwritten in a task."),
+    "shard_size": fields.Integer(
+        title="Shard size",
+        required=False,
+        description="Run the chain in parallel on shards of this many pages, "
+                    "0 runs it on all pages at once.",
+        help="Can be overwritten in a task, 0 disables sharding."),
+    "nodes": ChainNodesField(
+        title="Nodes",
+        required=False,
+        description="The processors as graph, instead of the processors.",
+        help="A node reads the output of the nodes writing its input file "
+             "groups, or the file group of the task. Nodes which don't "
+             "depend on each other run in parallel."),
+})
+
+
+collection_model = api.model("Collection Model", {
+    "name": fields.String(
+        title="Name",
+        required=True,
+        description="A name for the collection."),
+    "description": fields.String(
+        title="Description",
+        required=False,
+        description="Some more information about the collection."),
+    "chain_id": fields.Integer(
+        title="Processor chain",
+        required=True,
+        description="The chain of processors used for all sources."),
+    "sources": fields.List(
+        fields.String,
+        title="Sources",
+        required=True,
+        min_items=1,
+        description="URLs of the METS files of the works.",
+        help="Every source becomes a task, they run in the given order."),
+    "default_file_grp": fields.String(
+        title="Default file group",
+        required=False,
+        description="The file group in the METS files to start the chain with.",
+        default="DEFAULT"),
+    "parameters": ChainParametersField(
+        title="Parameters",
+        required=False,
+        default={},
+        description="Parameters for the processors of all tasks."),
+    "max_in_flight": fields.Integer(
+        title="Tasks in flight",
+        required=False,
+        description="Number of tasks of the collection in the queues at most.",
+        help="Defaults to COLLECTION_MAX_IN_FLIGHT of the config."),
+    "priority": fields.Integer(
+        title="Priority",
+        required=False,
+        description="From 0 to 9, the priority of the tasks of the collection.",
+        help="Defaults to TASK_DEFAULT_PRIORITY of the config."),
+    "submitter": fields.String(
+        title="Submitter",
+        required=False,
+        description="Who submitted the collection, the places in the queues are shared fairly between submitters."),
 })
@@ -1,33 +1,61 @@
 # -*- coding: utf-8 -*-
 
 """Restx task routes."""
+from collections import Counter
+from datetime import datetime
 import json
+import shutil
 import uuid
 
 from flask import (
+    current_app,
     make_response,
     jsonify,
-    request
+    request,
+    Response
 )
 from flask_restx import (
     Resource,
     marshal
 )
+from flask_restx.fields import MarshallingError
 
 from celery.signals import task_success
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.exceptions import HTTPException
 
-from ocrd_validators import ParameterValidator
 
 from ocrd_butler.api.restx import api
 from ocrd_butler.api.models import task_model
-from ocrd_butler.api.processors import PROCESSORS_CONFIG
 
 from ocrd_butler.database import db
 from ocrd_butler.database.models import Chain as db_model_Chain
 from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
 
-from ocrd_butler.execution.tasks import run_task
+from ocrd_butler.execution.admission import (
+    admission,
+    queue_pressure
+)
+from ocrd_butler.execution.costs import task_eta
+from ocrd_butler.execution.plans import (
+    chain_plan,
+    processor_validator,
+    task_fingerprint,
+    task_steps
+)
+from ocrd_butler.execution.status import (
+    existing_task,
+    task_state,
+    wait_for_tasks
+)
+from ocrd_butler.execution.storage import workspace_directories
+from ocrd_butler.execution.tasks import (
+    run_task,
+    run_tasks,
+    stop_task
+)
 from ocrd_butler.util import to_json
 
 task_namespace = api.namespace("tasks", description="Manage OCR-D Tasks")
@@ -59,12 +87,24 @@ class TasksBase(Resource):
 
     def __init__(self, api=None, *args, **kwargs):
         super().__init__(api, *args, **kwargs)
-        self.get_actions = ("status", "results")
+        self.get_actions = ("status", "results", "steps", "nodes", "wait")
         self.post_actions = ("run", "rerun", "stop")
 
-    def task_data(self, json_data):
-        """ Validate and prepare task input. """
-        data = marshal(data=json_data, fields=task_model, skip_none=False)
+    def task_data(self, json_data, chains=None, validated=None):
+        """
+        Validate and prepare task input.
+
+        Many tasks can share `chains`, the known chains by id, and
+        `validated`, the already validated parameters by processor.
+        The plan of the chain is compiled again if it's outdated.
+        """
+        chains = {} if chains is None else chains
+        validated = {} if validated is None else validated
+        try:
+            data = marshal(data=json_data, fields=task_model, skip_none=False)
+        except MarshallingError as exc:
+            task_namespace.abort(400, "Wrong parameter.",
+                                 status=str(exc), statusCode="400")
 
         if "parameters" not in data or data["parameters"] is None:
             data["parameters"] = {}
@@ -75,40 +115,146 @@ class TasksBase(Resource):
                                  status="Missing chain for task.",
                                  statusCode="400")
         else:
-            chain = db_model_Chain.query.filter_by(id=data["chain_id"]).first()
-            if chain is None:
+            if data["chain_id"] not in chains:
+                chain = db_model_Chain.query.filter_by(
+                    id=data["chain_id"]).first()
+                if chain is not None:
+                    # Committed with the task.
+                    chain_plan(chain)
+                chains[data["chain_id"]] = chain
+            if chains[data["chain_id"]] is None:
                 task_namespace.abort(400, "Wrong parameter.",
                                      status="Unknown chain with id {}.".format(
                                          data["chain_id"]),
                                      statusCode="400")
 
         for processor in data["parameters"].keys():
-            validator = ParameterValidator(PROCESSORS_CONFIG[processor])
-            report = validator.validate(data["parameters"][processor])
-            if not report.is_valid:
+            parameters = json.dumps(data["parameters"][processor], sort_keys=True)
+            if processor not in validated:
+                validated[processor] = {
+                    "validator": processor_validator(processor),
+                    "valid": {},
+                }
+            valid = validated[processor]["valid"]
+            if parameters not in valid:
+                # The validator fills in the defaults.
+                report = validated[processor]["validator"].validate(
+                    data["parameters"][processor])
+                if report.is_valid:
+                    valid[parameters] = json.dumps(data["parameters"][processor])
+            if parameters in valid:
+                data["parameters"][processor] = json.loads(valid[parameters])
+            else:
                 task_namespace.abort(
                     400, "Wrong parameter.",
                     status="Unknown parameter \"{0}\" for processor \"{1}\".".format(
                         data["parameters"][processor], processor),
                     statusCode="400")
 
+        if data["shard_size"] is not None and data["shard_size"] < 0:
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status="Shard size \"{0}\" is negative.".format(
+                    data["shard_size"]),
+                statusCode="400")
+
+        if data["priority"] is None:
+            data["priority"] = current_app.config["TASK_DEFAULT_PRIORITY"]
+        if data["priority"] not in range(10):
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status="Priority \"{0}\" is not a number from 0 to 9.".format(
+                    data["priority"]),
+                statusCode="400")
+
+        data["force"] = flag(data["force"])
+        data["fingerprint"] = task_fingerprint({
+            "src": data["src"],
+            "default_file_grp": data["default_file_grp"],
+            "parameters": data["parameters"],
+            "chain": chains[data["chain_id"]].to_json(),
+        })
         data["parameters"] = json.dumps(data["parameters"])
         data["uid"] = uuid.uuid4().__str__()
 
         return data
 
+    def idempotent_task(self, key, fingerprint):
+        """
+        The task created before with the `Idempotency-Key`, which has to
+        be for the same task.
+        """
+        if not key:
+            return None
+        task = db_model_Task.query.filter_by(idempotency_key=key).first()
+        if task is not None and task.fingerprint != fingerprint:
+            task_namespace.abort(
+                422, "Wrong parameter.",
+                status="The Idempotency-Key \"{0}\" was used for another task.".format(key),
+                statusCode="422")
+        return task
+
+    def admit(self, tasks=1, submitter=None, submitters=None):
+        """
+        Abort with 429 and the seconds to wait as `Retry-After` if the
+        tasks of the submitter aren't admitted, see `admission`.
+        """
+        refused = admission(tasks, submitter, submitters)
+        if refused is None:
+            return
+        reason, retry_after = refused
+        try:
+            task_namespace.abort(429, "Too many tasks.", status=reason,
+                                 retryAfter=retry_after, statusCode="429")
+        except HTTPException as exc:
+            exc.retry_after = retry_after
+            raise
+
 
 @task_namespace.route("")
 class Task(TasksBase):
 
-    @api.doc(responses={201: "Created", 400: "Missing parameter"})
+    @api.doc(responses={200: "The same task exists", 201: "Created",
+                        400: "Missing parameter",
+                        422: "Idempotency-Key used for another task",
+                        429: "Too many tasks, see Retry-After"})
     @api.expect(task_model)
     def post(self):
+        """
+        Create a task. If the same task is finished or running, it's
+        returned instead, unless `force` is set. A request with the
+        `Idempotency-Key` header of a former one returns the task it
+        created. New tasks are refused while the queues or the disk are
+        full.
+        """
         data = self.task_data(request.json)
-
-        task = db_model_Task(**data)
+        force = data.pop("force")
+        key = request.headers.get("Idempotency-Key")
+
+        task = self.idempotent_task(key, data["fingerprint"])
+        if task is not None:
+            return make_response({
+                "message": "Task created.",
+                "id": task.id,
+            }, 201)
+
+        existing = None if force else existing_task(data["fingerprint"])
+        if existing is not None:
+            return make_response({
+                "message": "Task exists.",
+                "id": existing.id,
+                "status": existing.status,
+            }, 200)
+
+        self.admit(submitter=data["submitter"])
+        task = db_model_Task(idempotency_key=key, **data)
         db.session.add(task)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A retry of the request was faster.
+            db.session.rollback()
+            task = self.idempotent_task(key, data["fingerprint"])
 
         headers = dict(Location="/tasks/{0}".format(task.id))
 
@@ -118,12 +264,255 @@ class Task(TasksBase):
         }, 201)
 
 
+@task_namespace.route("/bulk")
+class TasksBulk(TasksBase):
+    """Create and run many tasks at once."""
+
+    @api.doc(params={"run": "Run the created tasks, default: false."},
+             responses={201: "Created, the ids as JSON lines",
+                        400: "Wrong parameter",
+                        429: "Too many tasks, see Retry-After"})
+    @api.expect([task_model])
+    def post(self):
+        """
+        Create the tasks given as JSON array or as JSON lines in one
+        transaction and run them with one Celery group if `run` is set.
+        """
+        items = self.bulk_items(request.get_data(as_text=True))
+        key = request.headers.get("Idempotency-Key")
+        chains = {}
+        validated = {}
+        tasks = []
+        # Existing tasks by position, the new tasks by fingerprint.
+        existing = {}
+        fingerprints = {}
+        for number, item in enumerate(items, 1):
+            try:
+                data = self.task_data(item, chains=chains, validated=validated)
+                force = data.pop("force")
+                # Every task of the request has its own key.
+                data["idempotency_key"] = key and "{0}/{1}".format(key, number)
+                task = self.idempotent_task(data["idempotency_key"],
+                                            data["fingerprint"])
+            except HTTPException as exc:
+                task_namespace.abort(
+                    exc.code, "Wrong parameter in task {0}.".format(number),
+                    status=getattr(exc, "data", {}).get("status", str(exc)),
+                    statusCode=str(exc.code))
+            if task is None and not force:
+                task = fingerprints.get(data["fingerprint"]) \
+                    or existing_task(data["fingerprint"])
+            if task is not None:
+                existing[number - 1] = task
+                continue
+            task = db_model_Task(**data)
+            fingerprints[data["fingerprint"]] = task
+            tasks.append(task)
+
+        if tasks:
+            self.admit(len(tasks), submitters=Counter(
+                task.submitter for task in tasks))
+
+        run = flag(request.args.get("run"))
+        if run:
+            received = datetime.now()
+            for task in tasks:
+                task.status = "PENDING"
+                task.received = received
+        db.session.add_all(tasks)
+        db.session.flush()
+        # Serialize before the commit expires the tasks.
+        tasks = [task.to_json() for task in tasks]
+        db.session.commit()
+
+        created = [{"id": task["id"], "worker_task_id": None} for task in tasks]
+        if run and tasks:
+            worker_tasks = run_tasks(tasks)
+            for task, worker_task in zip(created, worker_tasks):
+                task["worker_task_id"] = worker_task.id
+            db.session.bulk_update_mappings(db_model_Task, [
+                {"id": task["id"], "worker_task_id": task["worker_task_id"]}
+                for task in created])
+            db.session.commit()
+
+        # In the order of the request, existing tasks aren't run again.
+        for position in sorted(existing):
+            created.insert(position, {
+                "id": existing[position].id,
+                "worker_task_id": existing[position].worker_task_id,
+                "existing": True,
+            })
+
+        def lines():
+            for task in created:
+                yield json.dumps(task) + "\n"
+
+        return Response(lines(), status=201, mimetype="application/x-ndjson")
+
+    def bulk_items(self, body):
+        """ The tasks of a JSON array or of JSON lines. """
+        try:
+            if body.lstrip().startswith("["):
+                return json.loads(body)
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError as exc:
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status="Tasks are neither a JSON array nor JSON lines: {0}".format(exc),
+                statusCode="400")
+
+
+def flag(value):
+    """ Whether the flag given as argument or field is set. """
+    return str(value or "").lower() in ("1", "true", "yes")
+
+
+def task_ids_arg():
+    """ The task ids given as comma separated `ids` argument. """
+    try:
+        return [int(task_id) for task_id in request.args.get("ids", "").split(",")]
+    except ValueError:
+        task_namespace.abort(
+            400, "Wrong parameter.",
+            status="Task ids \"{0}\" are not numbers.".format(
+                request.args.get("ids")),
+            statusCode="400")
+
+
+def wait_args():
+    """
+    The states to wait for, given as comma separated `until` argument, and
+    the `timeout` in seconds, at most `TASK_WAIT_TIMEOUT`.
+    """
+    until = None
+    if request.args.get("until"):
+        until = set(request.args["until"].upper().split(","))
+    try:
+        timeout = float(request.args.get("timeout", 60))
+    except ValueError:
+        task_namespace.abort(
+            400, "Wrong parameter.",
+            status="Timeout \"{0}\" is not a number.".format(
+                request.args.get("timeout")),
+            statusCode="400")
+    return until, max(0.0, min(timeout, current_app.config["TASK_WAIT_TIMEOUT"]))
+
+
+def server_sent_event(number, kind, data):
+    """ Format a change of a task as server-sent event. """
+    return "id: {0}\nevent: {1}\ndata: {2}\n\n".format(
+        number, kind, json.dumps(data))
+
+
+@task_namespace.route("/stream")
+class TaskStream(Resource):
+    """Stream the status, progress and log lines of tasks."""
+
+    @api.doc(params={"ids": "Comma separated ids of the tasks, all if not given."},
+             responses={200: "Stream of server-sent events", 400: "Wrong ids"})
+    def get(self):
+        """
+        Push the changes of the tasks as server-sent events `status`,
+        `progress` and `log`. A reconnecting client gets the changes it
+        missed, as far as they are still known.
+        """
+        store = current_app.extensions["task_events"]
+        task_ids = None
+        if request.args.get("ids"):
+            task_ids = set(task_ids_arg())
+
+        initial = []
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id and last_event_id.isdigit():
+            since = int(last_event_id)
+        else:
+            since = store.sequence
+            if task_ids is not None:
+                for task in db_model_Task.query.filter(db_model_Task.id.in_(task_ids)):
+                    data = task_state(task, store)
+                    data["task_id"] = task.id
+                    initial.append(server_sent_event(since, "status", data))
+                    lines = store.log(task.id)
+                    if lines:
+                        initial.append(server_sent_event(
+                            since, "log", {"task_id": task.id, "lines": lines}))
+        keepalive = current_app.config["TASK_STREAM_KEEPALIVE"]
+
+        def events():
+            number = since
+            for event in initial:
+                yield event
+            while True:
+                changes, number = store.changes(number, task_ids, timeout=keepalive)
+                if not changes:
+                    yield ": keepalive\n\n"
+                for change_number, task_id, kind, data in changes:
+                    data = dict(data, task_id=task_id)
+                    yield server_sent_event(change_number, kind, data)
+
+        return Response(events(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
+
+@task_namespace.route("/pressure")
+class TasksPressure(Resource):
+    """The usage of the limits of the admission control."""
+
+    @api.doc(responses={200: "OK"})
+    def get(self):
+        """
+        Get the tasks in the queues, the free disk for the results and the
+        tasks finished per hour with their limits. `pressure` is the
+        highest usage of a limit from 0 to 1.
+        """
+        return jsonify(queue_pressure())
+
+
+@task_namespace.route("/wait")
+class TasksWait(Resource):
+    """Wait for the first of some tasks to finish."""
+
+    @api.doc(params={
+        "ids": "Comma separated ids of the tasks.",
+        "until": "Comma separated states to wait for, default: SUCCESS,FAILURE.",
+        "timeout": "Seconds to wait at most, default: 60."},
+             responses={200: "OK", 400: "Wrong parameter", 404: "Unknown task"})
+    def get(self):
+        """
+        Hold the request until one of the tasks reaches one of the states
+        or the timeout expires. Returns the states of all tasks and the ids
+        of the ones which are done.
+        """
+        task_ids = task_ids_arg()
+        until, timeout = wait_args()
+        tasks = db_model_Task.query.filter(db_model_Task.id.in_(task_ids)).all()
+        unknown = set(task_ids) - set(task.id for task in tasks)
+        if unknown:
+            task_namespace.abort(
+                404, "Unknown task.",
+                status="Unknown tasks for ids \"{0}\".".format(
+                    ",".join(str(task_id) for task_id in sorted(unknown))),
+                statusCode="404")
+
+        states, done = wait_for_tasks(
+            current_app.extensions["task_events"], tasks,
+            until=until or {"SUCCESS", "FAILURE"}, timeout=timeout)
+        return jsonify({
+            "tasks": {str(task_id): state for task_id, state in states.items()},
+            "done": done,
+        })
+
+
 @task_namespace.route("/<string:task_id>/<string:action>")
 class TaskActions(TasksBase):
     """Run actions on the task, e.g. run, rerun, stop."""
 
     @api.doc(responses={200: "OK", 400: "Unknown action",
-                        404: "Unknown task", 500: "Error"})
+                        404: "Unknown task",
+                        429: "Too many tasks, see Retry-After",
+                        500: "Error"})
     def post(self, task_id, action):
         """ Execute the given action for the task. """
         # TODO: Return the actions as OPTIONS.
@@ -143,6 +532,8 @@ class TaskActions(TasksBase):
         action = getattr(self, action)
         try:
             return action(task)
+        except HTTPException:
+            raise
         except Exception as exc:
             task_namespace.abort(
                 500, "Error.",
@@ -170,20 +561,45 @@ class TaskActions(TasksBase):
         action = getattr(self, action)
         try:
             return action(task)
+        except HTTPException:
+            raise
         except Exception as exc:
             task_namespace.abort(
                 500, "Error.",
                 status="Unexpected error \"{0}\".".format(exc.__str__()),
                 statusCode="400")
 
-    def run(self, task):
-        """ Run this task. """
-        # worker_task = run_task.apply_async(args=[task.to_json()],
-        #                                    countdown=20)
-        # worker_task = run_task(task.to_json())
-        worker_task = run_task.delay(task.to_json())
+    def dispatch(self, task, resume=False):
+        """ Queue the chain of the task for the workers. """
+        task.status = "PENDING"
+        task.received = datetime.now()
+        task.started = None
+        task.finished = None
+        db.session.commit()
+
+        worker_task = run_task(task.to_json(), resume=resume)
         task.worker_task_id = worker_task.id
         db.session.commit()
+        return worker_task
+
+    def run(self, task):
+        """
+        Run this task. If the same task is finished or running, its
+        worker task is returned instead, unless `force` is set.
+        Refused while the queues or the disk are full.
+        """
+        existing = None
+        if not flag(request.args.get("force")) and task.fingerprint:
+            existing = existing_task(task.fingerprint, exclude=task.id)
+        if existing is not None:
+            return jsonify({
+                "worker_task_id": existing.worker_task_id,
+                "status": existing.status,
+                "existing": existing.id,
+            })
+
+        self.admit(submitter=task.submitter)
+        worker_task = self.dispatch(task)
 
         result = {
             "worker_task_id": worker_task.id,
@@ -197,21 +613,113 @@ class TaskActions(TasksBase):
 
         return jsonify(result)
 
-    def re_run(self, task):
-        """ Run this task once again. """
-        # Basically delete all and run again.
-        pass
+    def rerun(self, task):
+        """
+        Run this task once again. Steps with still valid results in the
+        workspace are skipped.
+        """
+        self.admit(submitter=task.submitter)
+        worker_task = self.dispatch(task, resume=True)
 
-    def status(self, task):
-        """ Run this task. """
         return jsonify({
-            "status": task.status
+            "worker_task_id": worker_task.id,
+            "status": worker_task.status,
+            "traceback": worker_task.traceback,
         })
 
+    def stop(self, task):
+        """
+        Stop the running task: revoke its Celery tasks, terminate the
+        running one with its processors and mark the unfinished steps.
+        With `clean` the workspace of the task is removed.
+        """
+        if task.status not in ("PENDING", "STARTED", "RETRY"):
+            task_namespace.abort(
+                400, "Wrong parameter.",
+                status="Task \"{0}\" is not running.".format(task.id),
+                statusCode="400")
+
+        revoked = stop_task(task.to_json())
+        stopped = datetime.now()
+        for step in task.steps.filter_by(status="RUNNING"):
+            step.status = "STOPPED"
+            step.finished = stopped
+        task.status = "REVOKED"
+        task.finished = stopped
+        db.session.commit()
+
+        cleaned = flag(request.args.get("clean"))
+        if cleaned:
+            for directory in workspace_directories(task.to_json(),
+                                                   current_app.config):
+                shutil.rmtree(directory, ignore_errors=True)
+
+        return jsonify({
+            "status": task.status,
+            "revoked": revoked,
+            "cleaned": cleaned,
+        })
+
+    def status(self, task):
+        """ Get the state of this task, as far as the events tell. """
+        state = task_state(task, current_app.extensions.get("task_events"))
+        eta = task_eta(task)
+        state["eta"] = eta and eta.isoformat()
+        return jsonify(state)
+
+    def wait(self, task):
+        """
+        Hold the request until the task reaches one of the states given by
+        `until` or, without it, changes its state, at most `timeout` seconds.
+        """
+        until, timeout = wait_args()
+        states, done = wait_for_tasks(
+            current_app.extensions["task_events"], [task],
+            until=until, timeout=timeout)
+        state = states[task.id]
+        state["done"] = bool(done)
+        return jsonify(state)
+
     def results(self, task):
         """ Run this task. """
         return jsonify(task.results)
 
+    def steps(self, task):
+        """ Get the recorded steps of the task. """
+        steps = task.steps.order_by(db_model_TaskStep.id)
+        return jsonify([step.to_json() for step in steps])
+
+    def nodes(self, task):
+        """
+        Get the steps of the chain of the task with the nodes they need
+        and the state of their last run, WAITING if they didn't start yet.
+        """
+        recorded = {}
+        if task.started is not None:
+            for step in task.steps.filter(
+                    db_model_TaskStep.started >= task.started).order_by(
+                        db_model_TaskStep.id):
+                recorded[step.index] = step
+
+        nodes = []
+        for step in task_steps(task.to_json()):
+            task_step = recorded.get(step["index"])
+            nodes.append({
+                "index": step["index"],
+                "processor": step["processor"],
+                "input_file_grp": step["input_file_grp"],
+                "output_file_grp": step["output_file_grp"],
+                "needs": step["needs"],
+                "level": step["level"],
+                "status": task_step.status if task_step is not None
+                          else "WAITING",
+                "started": task_step and task_step.started
+                           and task_step.started.isoformat(),
+                "finished": task_step and task_step.finished
+                            and task_step.finished.isoformat(),
+            })
+        return jsonify(nodes)
+
     def download_page(self, task):
         """ Download the results of the task as PAGE XML. """
         pass
@@ -240,7 +748,10 @@ class Task(TasksBase):
                     task_id),
                 statusCode="404")
 
-        return jsonify(task.to_json())
+        result = task.to_json()
+        eta = task_eta(task)
+        result["eta"] = eta and eta.isoformat()
+        return jsonify(result)
 
     @api.doc(responses={200: "OK", 404: "Unknown task id"})
     def put(self, task_id):
@@ -277,6 +788,7 @@ class Task(TasksBase):
                 statusCode="404")
 
         message = "Task \"{0}\" deleted.".format(task.id)
+        db_model_TaskStep.query.filter_by(task_id=task.id).delete()
         res.delete()
         db.session.commit()
 
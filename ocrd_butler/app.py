@@ -6,15 +6,17 @@ import os
 import logging.config
 
 from ocrd_butler import (
-    factory,
-    make_celery
+    celery,
+    factory
 )
 from ocrd_butler.config import DevelopmentConfig
 
 
 config = DevelopmentConfig()
+# The tasks are bound to the global celery app, the producers in the app
+# and the workers have to share its configuration.
 flask_app = factory.create_app(
-    celery=make_celery(config=config),
+    celery=celery,
     config=config)
 
 
@@ -24,11 +26,22 @@ logging.config.fileConfig(logging_conf_path)
 log = logging.getLogger(__name__)
 
 
+def serve(debug=False, **kwargs):
+    """
+    Run the app with the threads following the task events and dispatching
+    the collections, which the workers importing this module don't start.
+    """
+    # With the reloader only its child process serves the requests.
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        factory.start_background(flask_app)
+    flask_app.run(debug=debug, **kwargs)
+
+
 def main():
     """What should I do, when I'm called directly?"""
     log.info("> Starting development server at http://%s/api/ <<<<<" %
              flask_app.config['SERVER_NAME'])
-    flask_app.run(host="0.0.0.0", debug=True)
+    serve(host="0.0.0.0", debug=True)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,13 @@
 
 """Utils for celery."""
 
+# Ten priority levels in Redis, see `celery_priority`. Producers and workers
+# have to use the same ones, else the messages go to other lists.
+BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "queue_order_strategy": "priority",
+}
+
 def init_celery(celery, app):
 
     celery.conf.update(app.config)
@@ -10,7 +17,13 @@ def init_celery(celery, app):
         accept_content=['json'],  # Ignore other content
         result_serializer='json',
         timezone='Europe/Berlin',
-        enable_utc=True
+        enable_utc=True,
+        # The app follows the state of the tasks with the events.
+        worker_send_task_events=True,
+        broker_transport_options=BROKER_TRANSPORT_OPTIONS,
+        # Take one message at a time, otherwise the worker holds back
+        # prefetched messages of a low priority.
+        worker_prefetch_multiplier=1
     )
 
     TaskBase = celery.Task
@@ -19,4 +32,8 @@ def init_celery(celery, app):
         def __call__(self, *args, **kwargs):
             with app.app_context():
                 return TaskBase.__call__(self, *args, **kwargs)
+
+        def app_context(self):
+            """ For the signal handlers, they run outside of `__call__`. """
+            return app.app_context()
     celery.Task = ContextTask
@@ -3,7 +3,7 @@
 """Console script for ocrd_butler."""
 import sys
 import click
-from ocrd_butler.app import flask_app, log
+from ocrd_butler.app import flask_app, log, serve
 
 
 @click.command('start')
@@ -15,7 +15,7 @@ def main(debug=False, args=None):
         flask_app.config['SERVER_NAME']))
     # flask_app.run(debug=settings.FLASK_DEBUG)
     # flask_app.run(debug=config_json["FLASK_DEBUG"])
-    flask_app.run(debug=debug)
+    serve(debug=debug)
     return 0
 
 if __name__ == "__main__":
@@ -2,6 +2,17 @@
     https://flask.palletsprojects.com/en/1.1.x/config/
 """
 
+import json
+import os
+
+
+def json_from_env(name, default):
+    """ Load a setting from the JSON file given in the environment variable. """
+    if not os.environ.get(name):
+        return default
+    with open(os.environ[name]) as fh:
+        return json.load(fh)
+
 
 class Config(object):
     """Base config, uses staging database server."""
@@ -10,6 +21,107 @@ class Config(object):
     CELERY_RESULT_BACKEND_URL = "redis://localhost:6379"
     CELERY_BROKER_URL = "redis://localhost:6379"
     OCRD_BUTLER_RESULTS = "/tmp/ocrd_butler_results"
+    # A workspace is placed on the root with the most free space after the
+    # estimated footprint of the task, OCRD_BUTLER_RESULTS if none are
+    # given. A task that doesn't fit anywhere waits in the queue and is
+    # tried again every STORAGE_RETRY_INTERVAL seconds.
+    OCRD_BUTLER_STORAGE_ROOTS = []
+    STORAGE_HEADROOM = 2 * 1024 ** 3
+    STORAGE_RETRY_INTERVAL = 5 * 60
+    # Size of an image until the size of the images of the tasks is known.
+    STORAGE_DEFAULT_IMAGE_SIZE = 5 * 1024 ** 2
+    # Fast local directory the steps run in, the workspace is moved to its
+    # root when the task is finished. All workers of a task have to share
+    # it, None disables it.
+    OCRD_BUTLER_SCRATCH = None
+    # Run the chain on shards of this many pages in parallel, 0 disables it.
+    # Can be overwritten per chain or task.
+    TASK_SHARD_SIZE = 0
+    TASK_SHARD_WORKERS = os.cpu_count() or 1
+    # Download of the images before the chain runs.
+    DOWNLOAD_WORKERS = 8
+    DOWNLOAD_HOST_CONCURRENCY = 4
+    DOWNLOAD_RETRIES = 3
+    DOWNLOAD_BACKOFF = 1.0
+    DOWNLOAD_TIMEOUT = 60
+    # Downloaded files are shared between the workspaces, None disables it.
+    BLOB_CACHE_DIR = "/tmp/ocrd_butler_cache"
+    BLOB_CACHE_MAX_SIZE = 20 * 1024 ** 3
+    BLOB_CACHE_MAX_AGE = 24 * 60 * 60
+    # Reuse the output of processor calls with the same input and
+    # parameters, None disables it.
+    STEP_CACHE_DIR = "/tmp/ocrd_butler_step_cache"
+    STEP_CACHE_MAX_SIZE = 50 * 1024 ** 3
+    STEP_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+    # Processors kept running with their models loaded instead of starting
+    # the CLI for every step, executable -> "module:ProcessorClass".
+    PROCESSOR_DAEMONS = {
+        "ocrd-calamari-recognize": "ocrd_calamari.recognize:CalamariRecognize",
+        "ocrd-keraslm-rate": "ocrd_keraslm.wrapper.rate:KerasRate",
+    }
+    PROCESSOR_DAEMON_SOCKETS = "/tmp/ocrd_butler_daemons"
+    PROCESSOR_DAEMON_POOL_SIZE = 1
+    PROCESSOR_DAEMON_IDLE_TIMEOUT = 600
+    PROCESSOR_DAEMON_MAX_REQUESTS = 100
+    # Processor instances (one per parameter set) kept by a daemon.
+    PROCESSOR_DAEMON_INSTANCES = 2
+    # Every step of a chain runs as its own Celery task in the queue found
+    # here by processor name, package name or category of the processor,
+    # e.g. to run recognition on a few workers with much memory. The
+    # mapping can be replaced by a JSON file given in OCRD_BUTLER_QUEUES.
+    PROCESSOR_QUEUES = json_from_env("OCRD_BUTLER_QUEUES", {
+        "ocrd_calamari": "recognition",
+        "ocrd_keraslm": "recognition",
+    })
+    PROCESSOR_DEFAULT_QUEUE = "celery"
+    # Seconds of finished tasks to compute the pages per minute for /metrics.
+    METRICS_PAGES_WINDOW = 15 * 60
+    # Steps running longer than this many seconds are taken as abandoned,
+    # e.g. by a killed worker, and are not waited for by the histogram of
+    # the step durations in /metrics.
+    METRICS_STEP_ABANDONED = 24 * 60 * 60
+    # Follow the Celery events of the workers in the app and write the
+    # state changes of the tasks to the database every few seconds.
+    TASK_EVENTS = True
+    TASK_EVENTS_FLUSH_INTERVAL = 2.0
+    # The workers send the output of the processors every few seconds,
+    # the app keeps the last lines of every task for the stream.
+    TASK_LOG_INTERVAL = 1.0
+    TASK_LOG_LINES = 200
+    # Seconds between keep-alive comments of /api/tasks/stream.
+    TASK_STREAM_KEEPALIVE = 15
+    # Longest time in seconds a request to /api/tasks/.../wait is held open.
+    TASK_WAIT_TIMEOUT = 300
+    # Dispatch the tasks of running collections in the app, at most
+    # COLLECTION_MAX_IN_FLIGHT of each in the queues if the collection
+    # doesn't say otherwise.
+    COLLECTION_DISPATCH = True
+    COLLECTION_DISPATCH_INTERVAL = 10
+    COLLECTION_MAX_IN_FLIGHT = 10
+    # Tasks of all collections in the queues at most, None for no limit.
+    # The free places go to the collections with the highest priority,
+    # within the same priority to the submitters with the fewest tasks in
+    # flight.
+    DISPATCH_MAX_IN_FLIGHT = 50
+    # Priority of the tasks from 0 to 9 if none is given.
+    TASK_DEFAULT_PRIORITY = 5
+    # A new task with the same source, chain and parameters as a finished
+    # or running one returns that one, unless it's forced.
+    TASK_DEDUPLICATE = True
+    # Refuse new and started tasks with 429 if the results have less free
+    # disk, the queues more tasks or the submitter more tasks in flight
+    # than given here, None disables a limit. Retry-After is computed from
+    # the tasks finished within ADMISSION_WINDOW seconds.
+    ADMISSION_CONTROL = True
+    ADMISSION_MIN_FREE_DISK = 5 * 1024 ** 3
+    ADMISSION_MAX_IN_FLIGHT = 1000
+    ADMISSION_MAX_IN_FLIGHT_PER_SUBMITTER = 200
+    ADMISSION_WINDOW = 15 * 60
+    ADMISSION_RETRY_AFTER_MIN = 5
+    ADMISSION_RETRY_AFTER_MAX = 15 * 60
+    # The processors found in the `ocrd-tool.json` files of the scripts and
+    # packages are cached here until a package changes, None disables it.
+    PROCESSORS_CACHE = "/tmp/ocrd_butler_processors.json"
     DIRECT_PROCESSOR_SCRIPTS = [
         "/srv/ocrd_all/ocrd_olena",
         "/srv/ocrd_all/dinglehopper",
@@ -36,4 +148,10 @@ class TestingConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     OCRD_BUTLER_RESULTS = "/tmp/ocrd_butler_results_testing"
+    BLOB_CACHE_DIR = "/tmp/ocrd_butler_cache_testing"
+    STEP_CACHE_DIR = "/tmp/ocrd_butler_step_cache_testing"
+    PROCESSORS_CACHE = None
+    ADMISSION_MIN_FREE_DISK = None
+    TASK_EVENTS = False
+    COLLECTION_DISPATCH = False
 
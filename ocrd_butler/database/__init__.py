@@ -5,6 +5,6 @@ db = SQLAlchemy()
 
 def reset_database():
     """ Renew the database. """
-    from ocrd_butler.database.models import Task, Chain
+    from ocrd_butler.database.models import Task, TaskStep, Chain
     db.drop_all()
     db.create_all()
@@ -18,15 +18,40 @@ class Task(db.Model):
     default_file_grp = db.Column(db.String(64))
     worker_task_id = db.Column(db.String(64))
     status = db.Column(db.String(64))
+    shard_size = db.Column(db.Integer)
+    collection_id = db.Column(db.Integer, db.ForeignKey('collections.id'))
+    # From 0 to 9, tasks with a higher priority are processed first.
+    priority = db.Column(db.Integer)
+    submitter = db.Column(db.String(64))
+    # Size of the work, known when the workspace is prepared.
+    pages = db.Column(db.Integer)
+    megapixels = db.Column(db.Float)
+    image_bytes = db.Column(db.BigInteger)
+    # Estimated size of the workspace and where it's placed, see
+    # `execution.storage`. With `scratch` the steps run in the scratch
+    # directory.
+    footprint = db.Column(db.BigInteger)
+    storage_root = db.Column(db.String(255))
+    scratch = db.Column(db.Boolean, default=False)
+    # Same for tasks with the same source, steps and parameters.
+    fingerprint = db.Column(db.String(64), index=True)
+    # Given by the client, a retried request doesn't create another task.
+    idempotency_key = db.Column(db.String(255), unique=True)
     # Change this "results" to postres specific JSON, if we switch.
     results = db.Column(db.JSON)
+    # State of the worker task, kept up to date by the workers.
+    received = db.Column(db.DateTime)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
 
     chain = db.relationship("Chain",
                             backref=db.backref("chains", lazy="dynamic"))
 
     def __init__(self, uid, src, chain_id, parameters={}, description="",
                  default_file_grp="DEFAULT", worker_task_id=None,
-                 status="CREATED", results={}):
+                 status="CREATED", results={}, shard_size=None,
+                 collection_id=None, priority=None, submitter=None,
+                 fingerprint=None, idempotency_key=None):
         self.uid = uid
         self.src = src
         self.chain_id = chain_id
@@ -36,6 +61,12 @@ class Task(db.Model):
         self.worker_task_id = worker_task_id
         self.status = status
         self.results = results
+        self.shard_size = shard_size
+        self.collection_id = collection_id
+        self.priority = priority
+        self.submitter = submitter
+        self.fingerprint = fingerprint
+        self.idempotency_key = idempotency_key
 
     def to_json(self):
         return {
@@ -49,6 +80,15 @@ class Task(db.Model):
             "worker_task_id": self.worker_task_id,
             "status": self.status,
             "results": self.results,
+            "shard_size": self.shard_size,
+            "collection_id": self.collection_id,
+            "priority": self.priority,
+            "submitter": self.submitter,
+            "pages": self.pages,
+            "megapixels": self.megapixels,
+            "footprint": self.footprint,
+            "storage_root": self.storage_root,
+            "fingerprint": self.fingerprint,
         }
 
     def __repr__(self):
@@ -60,6 +100,72 @@ class Task(db.Model):
             # self.uid, self.src, self.chain.name, desc)
 
 
+class TaskStep(db.Model):
+    """ Database model for the processed steps of a task. """
+    __tablename__ = "task_steps"
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'))
+    index = db.Column(db.Integer)
+    processor = db.Column(db.String(128))
+    input_file_grp = db.Column(db.String(64))
+    output_file_grp = db.Column(db.String(64))
+    parameter = db.Column(db.JSON)
+    status = db.Column(db.String(64))
+    cached = db.Column(db.Boolean, default=False)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    # Resources used by the processor: seconds and peak RSS in bytes.
+    wall_time = db.Column(db.Float)
+    user_time = db.Column(db.Float)
+    system_time = db.Column(db.Float)
+    max_rss = db.Column(db.BigInteger)
+
+    task = db.relationship("Task",
+                           backref=db.backref("steps", lazy="dynamic"))
+
+    def __init__(self, task_id, index, processor, input_file_grp,
+                 output_file_grp, parameter={}, status="RUNNING",
+                 cached=False, started=None, finished=None, wall_time=None,
+                 user_time=None, system_time=None, max_rss=None):
+        self.task_id = task_id
+        self.index = index
+        self.processor = processor
+        self.input_file_grp = input_file_grp
+        self.output_file_grp = output_file_grp
+        self.parameter = parameter
+        self.status = status
+        self.cached = cached
+        self.started = started
+        self.finished = finished
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "task_id": self.task_id,
+            "index": self.index,
+            "processor": self.processor,
+            "input_file_grp": self.input_file_grp,
+            "output_file_grp": self.output_file_grp,
+            "parameter": self.parameter,
+            "status": self.status,
+            "cached": self.cached,
+            "started": self.started and self.started.isoformat(),
+            "finished": self.finished and self.finished.isoformat(),
+            "wall_time": self.wall_time,
+            "user_time": self.user_time,
+            "system_time": self.system_time,
+            "max_rss": self.max_rss,
+        }
+
+    def __repr__(self):
+        return "Step {0} of task {1} - {2} ({3})".format(
+            self.index, self.task_id, self.processor, self.status)
+
+
 class Chain(db.Model):
     """ Database model for our chains. """
     __tablename__ = "chains"
@@ -68,12 +174,22 @@ class Chain(db.Model):
     description = db.Column(db.String(1024))
     processors = db.Column(db.JSON)
     parameters = db.Column(db.JSON)
+    shard_size = db.Column(db.Integer)
+    # The processors as graph with the file groups of every node, the
+    # processors are the ones of the nodes then.
+    nodes = db.Column(db.JSON)
+    # The compiled steps, see `ocrd_butler.execution.plans`.
+    plan = db.Column(db.JSON)
+    plan_version = db.Column(db.Integer)
 
-    def __init__(self, name, description, processors, parameters=None):
+    def __init__(self, name, description, processors, parameters=None,
+                 shard_size=None, nodes=None):
         self.name = name
         self.description = description
         self.processors = processors
         self.parameters = parameters
+        self.shard_size = shard_size
+        self.nodes = nodes
 
     def to_json(self):
         return {
@@ -82,7 +198,125 @@ class Chain(db.Model):
             "description": self.description,
             "processors": self.processors,
             "parameters": self.parameters,
+            "shard_size": self.shard_size,
+            "nodes": self.nodes,
+            "plan": self.plan,
+            "plan_version": self.plan_version,
             }
 
     def __repr__(self):
         return "Chain {0} ({1})".format(self.name, self.description)
+
+
+class Collection(db.Model):
+    """
+    Database model for collections, many sources processed with the same
+    chain. Each source is a task of the collection, the tasks run in the
+    order of their ids, `cursor` is the id of the last one dispatched.
+    """
+    __tablename__ = "collections"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64))
+    description = db.Column(db.String(1024))
+    chain_id = db.Column(db.Integer, db.ForeignKey('chains.id'))
+    default_file_grp = db.Column(db.String(64))
+    parameters = db.Column(db.JSON)
+    max_in_flight = db.Column(db.Integer)
+    priority = db.Column(db.Integer)
+    submitter = db.Column(db.String(64))
+    status = db.Column(db.String(64))
+    cursor = db.Column(db.Integer, default=0)
+    created = db.Column(db.DateTime)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+
+    chain = db.relationship("Chain")
+    tasks = db.relationship("Task", lazy="dynamic",
+                            backref=db.backref("collection"))
+
+    def __init__(self, name, chain_id, max_in_flight, description="",
+                 default_file_grp="DEFAULT", parameters=None, priority=None,
+                 submitter=None, status="CREATED", cursor=0, created=None):
+        self.name = name
+        self.chain_id = chain_id
+        self.max_in_flight = max_in_flight
+        self.description = description
+        self.default_file_grp = default_file_grp
+        self.parameters = parameters or {}
+        self.priority = priority
+        self.submitter = submitter
+        self.status = status
+        self.cursor = cursor
+        self.created = created
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "chain_id": self.chain_id,
+            "default_file_grp": self.default_file_grp,
+            "parameters": self.parameters,
+            "max_in_flight": self.max_in_flight,
+            "priority": self.priority,
+            "submitter": self.submitter,
+            "status": self.status,
+            "cursor": self.cursor,
+            "created": self.created and self.created.isoformat(),
+            "started": self.started and self.started.isoformat(),
+            "finished": self.finished and self.finished.isoformat(),
+        }
+
+    def __repr__(self):
+        return "Collection {0} ({1})".format(self.name, self.status)
+
+
+class ProcessorCost(db.Model):
+    """
+    Database model for the cost of a processor, summed up over all steps
+    it ran. The seconds are the ones of one process, i.e. the wall time of
+    a sharded step times the shards run in parallel.
+    """
+    __tablename__ = "processor_costs"
+    id = db.Column(db.Integer, primary_key=True)
+    processor = db.Column(db.String(128), unique=True)
+    steps = db.Column(db.Integer)
+    pages = db.Column(db.Integer)
+    seconds = db.Column(db.Float)
+    # Only of the steps with known image sizes.
+    megapixels = db.Column(db.Float)
+    megapixel_seconds = db.Column(db.Float)
+    # Size of the output, only of the steps where it was measured.
+    output_pages = db.Column(db.Integer)
+    output_bytes = db.Column(db.BigInteger)
+    updated = db.Column(db.DateTime)
+
+    def __init__(self, processor, steps=0, pages=0, seconds=0.0,
+                 megapixels=0.0, megapixel_seconds=0.0, output_pages=0,
+                 output_bytes=0, updated=None):
+        self.processor = processor
+        self.steps = steps
+        self.pages = pages
+        self.seconds = seconds
+        self.megapixels = megapixels
+        self.megapixel_seconds = megapixel_seconds
+        self.output_pages = output_pages
+        self.output_bytes = output_bytes
+        self.updated = updated
+
+    def to_json(self):
+        return {
+            "processor": self.processor,
+            "steps": self.steps,
+            "pages": self.pages,
+            "seconds": self.seconds,
+            "seconds_per_page": self.seconds / self.pages if self.pages else None,
+            "seconds_per_megapixel": self.megapixel_seconds / self.megapixels
+                                     if self.megapixels else None,
+            "bytes_per_page": self.output_bytes / self.output_pages
+                              if self.output_pages else None,
+            "updated": self.updated and self.updated.isoformat(),
+        }
+
+    def __repr__(self):
+        return "Cost of {0} ({1} steps)".format(self.processor, self.steps)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Measure the time and memory the processors of a chain use."""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from ocrd_butler.execution import processes
+
+
+def usage(wall_time=0.0, user_time=0.0, system_time=0.0, max_rss=0):
+    """ Resource usage of a step, times in seconds and peak RSS in bytes. """
+    return {
+        "wall_time": wall_time,
+        "user_time": user_time,
+        "system_time": system_time,
+        "max_rss": max_rss,
+    }
+
+
+def rusage_delta(before, after, wall_time):
+    """ The usage between two `resource.getrusage` results. """
+    return usage(
+        wall_time=wall_time,
+        user_time=after.ru_utime - before.ru_utime,
+        system_time=after.ru_stime - before.ru_stime,
+        # ru_maxrss is a high-water mark in kilobytes, not a counter.
+        max_rss=after.ru_maxrss * 1024)
+
+
+def combine_parallel(usages):
+    """
+    Sum up the usage of steps which ran in parallel: the CPU times add up,
+    the wall time and the peak RSS are the maximum of all.
+    """
+    usages = list(usages)
+    return usage(
+        wall_time=max([u["wall_time"] for u in usages] or [0.0]),
+        user_time=sum(u["user_time"] for u in usages),
+        system_time=sum(u["system_time"] for u in usages),
+        max_rss=max([u["max_rss"] for u in usages] or [0]))
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_processor_cli(executable, mets_url, working_dir, page_id=None,
+                      log_level=None, input_file_grp=None,
+                      output_file_grp=None, parameter=None, log=None):
+    """
+    Run the processor CLI like `ocrd.processor.base.run_cli`, but wait for
+    it with `os.wait4` to get the resources of exactly this process and its
+    children, even with other processors running in parallel threads.
+
+    With a `log` callback every output line of the processor is passed to
+    it as well.
+
+    Returns the exit code and the usage.
+    """
+    args = [executable, "--working-dir", working_dir, "--mets", mets_url]
+    if log_level:
+        args += ["--log-level", log_level]
+    if page_id:
+        args += ["--page-id", page_id]
+    if input_file_grp:
+        args += ["--input-file-grp", input_file_grp]
+    if output_file_grp:
+        args += ["--output-file-grp", output_file_grp]
+    if parameter:
+        args += ["--parameter", parameter]
+
+    started = time.time()
+    # In its own process group, to kill the processor with all its children
+    # when the task is stopped.
+    if log is None:
+        process = subprocess.Popen(args, start_new_session=True)
+    else:
+        process = subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, errors="replace", start_new_session=True)
+    processes.started(process.pid, group=True)
+    try:
+        if log is not None:
+            for line in process.stdout:
+                sys.stdout.write(line)
+                log(line.rstrip("\n"))
+            process.stdout.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+    finally:
+        processes.finished(process.pid)
+    wall_time = time.time() - started
+    # The process is reaped already, tell Popen about it.
+    process.returncode = _exit_code(status)
+
+    return process.returncode, usage(
+        wall_time=wall_time,
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss * 1024)
+
+
+def self_usage():
+    """ The current `resource.getrusage` of this process. """
+    return resource.getrusage(resource.RUSAGE_SELF)
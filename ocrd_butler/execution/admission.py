@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Admission control of the tasks to create or run.
+
+A task is refused while the disks of the storage roots are almost full,
+too many tasks are in the queues or its submitter has too many tasks in
+flight. The client is told when to try again, computed from the number of
+tasks finished within the last `ADMISSION_WINDOW` seconds.
+"""
+
+from datetime import (
+    datetime,
+    timedelta
+)
+import math
+
+from flask import current_app
+
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.status import (
+    DONE,
+    IN_FLIGHT
+)
+from ocrd_butler.execution.storage import (
+    most_free_disk,
+    storage_roots
+)
+
+
+def submitted_by(query, submitter):
+    """ Only the tasks of the submitter, the ones without one are shared. """
+    if submitter is None:
+        return query.filter(db_model_Task.submitter.is_(None))
+    return query.filter(db_model_Task.submitter == submitter)
+
+
+def in_flight(submitter=None, anyone=True):
+    """ The number of tasks in the queues, of the submitter if not `anyone`. """
+    query = db_model_Task.query.filter(db_model_Task.status.in_(IN_FLIGHT))
+    if not anyone:
+        query = submitted_by(query, submitter)
+    return query.count()
+
+
+def throughput(window, submitter=None, anyone=True):
+    """ Tasks finished per second within the last `window` seconds. """
+    query = db_model_Task.query.filter(
+        db_model_Task.status.in_(DONE),
+        db_model_Task.finished >= datetime.now() - timedelta(seconds=window))
+    if not anyone:
+        query = submitted_by(query, submitter)
+    return query.count() / float(window)
+
+
+def retry_after(excess, rate):
+    """
+    Seconds until `excess` tasks are done at `rate` tasks per second,
+    within `ADMISSION_RETRY_AFTER_MIN` and `ADMISSION_RETRY_AFTER_MAX`.
+    """
+    config = current_app.config
+    if rate <= 0:
+        return config["ADMISSION_RETRY_AFTER_MAX"]
+    return int(min(config["ADMISSION_RETRY_AFTER_MAX"],
+                   max(config["ADMISSION_RETRY_AFTER_MIN"],
+                       math.ceil(excess / rate))))
+
+
+def admission(tasks=1, submitter=None, submitters=None):
+    """
+    Whether `tasks` more tasks of the submitter are admitted, or of many
+    submitters given as the number of their tasks by `submitters`.
+    Returns None if so, else the reason and the seconds to wait before
+    trying again.
+    """
+    config = current_app.config
+    if not config["ADMISSION_CONTROL"]:
+        return None
+    window = config["ADMISSION_WINDOW"]
+
+    min_free = config["ADMISSION_MIN_FREE_DISK"]
+    if min_free is not None:
+        free = most_free_disk(storage_roots(config))
+        if free is not None and free < min_free:
+            # Space is freed by cleaning up, not by finished tasks.
+            return ("Only {0} bytes free for the results, {1} needed.".format(
+                free, min_free), config["ADMISSION_RETRY_AFTER_MAX"])
+
+    limit = config["ADMISSION_MAX_IN_FLIGHT"]
+    if limit is not None:
+        excess = in_flight() + tasks - limit
+        if excess > 0:
+            return ("At most {0} tasks in the queues.".format(limit),
+                    retry_after(excess, throughput(window)))
+
+    limit = config["ADMISSION_MAX_IN_FLIGHT_PER_SUBMITTER"]
+    if limit is not None:
+        for submitter, count in (submitters or {submitter: tasks}).items():
+            excess = in_flight(submitter, anyone=False) + count - limit
+            if excess > 0:
+                return ("At most {0} tasks of submitter \"{1}\" in the queues.".format(
+                    limit, submitter or ""),
+                        retry_after(excess, throughput(window, submitter, anyone=False)))
+    return None
+
+
+def queue_pressure():
+    """
+    The usage of the limits, `pressure` is the highest one from 0 to 1 or
+    None without limits.
+    """
+    config = current_app.config
+    pressure = {
+        "in_flight": in_flight(),
+        "max_in_flight": config["ADMISSION_MAX_IN_FLIGHT"],
+        "free_disk": most_free_disk(storage_roots(config)),
+        "min_free_disk": config["ADMISSION_MIN_FREE_DISK"],
+        "throughput": throughput(config["ADMISSION_WINDOW"]) * 3600.0,
+        "pressure": None,
+    }
+    usage = []
+    if pressure["max_in_flight"]:
+        usage.append(pressure["in_flight"] / float(pressure["max_in_flight"]))
+    if pressure["min_free_disk"] and pressure["free_disk"] is not None:
+        usage.append(pressure["min_free_disk"] / float(
+            max(pressure["free_disk"], 1)))
+    if usage:
+        pressure["pressure"] = min(1.0, max(usage))
+    return pressure
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""Content addressed cache for downloaded METS files and images."""
+
+from contextlib import contextmanager
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+class BlobCache():
+    """
+    A local cache of downloaded files shared between all workspaces.
+
+    Every file is stored once under its SHA-256 and linked into the
+    workspaces. An index (SQLite, as the cache is shared between the
+    worker processes) maps the URL with its ETag/Last-Modified to the blob.
+    Entries younger than `max_age` seconds are used without asking the
+    server, older ones are revalidated with a conditional request.
+    The least recently used blobs are evicted if the cache grows over
+    `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size, max_age=86400):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.index_path = os.path.join(directory, "index.sqlite")
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        with self._index() as index:
+            index.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    url TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    checked REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL);
+            """)
+
+    @classmethod
+    def from_config(cls, config):
+        """ Create the cache from the app config, None if it is disabled. """
+        if not config.get("BLOB_CACHE_DIR"):
+            return None
+        return cls(config["BLOB_CACHE_DIR"],
+                   max_size=config["BLOB_CACHE_MAX_SIZE"],
+                   max_age=config["BLOB_CACHE_MAX_AGE"])
+
+    @contextmanager
+    def _index(self):
+        # One connection per call, the cache is used from several threads.
+        connection = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def blob_path(self, sha256):
+        """ Path of the blob with the given hash. """
+        return os.path.join(self.directory, "blobs", sha256[:2], sha256)
+
+    def _count(self, index, name, value=1):
+        index.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+        index.execute("UPDATE counters SET value = value + ? WHERE name = ?",
+                      (value, name))
+
+    def lookup(self, url):
+        """
+        Get the cache entry for the url or None if the url is unknown or
+        its blob is gone.
+        """
+        with self._index() as index:
+            row = index.execute(
+                "SELECT e.sha256, e.etag, e.last_modified, e.checked, b.size "
+                "FROM entries e JOIN blobs b ON e.sha256 = b.sha256 "
+                "WHERE e.url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self.blob_path(row[0])):
+            return None
+        return {
+            "url": url,
+            "sha256": row[0],
+            "etag": row[1],
+            "last_modified": row[2],
+            "size": row[4],
+            "fresh": time.time() - row[3] < self.max_age,
+        }
+
+    @staticmethod
+    def conditional_headers(entry):
+        """ Headers to revalidate the entry with the server. """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def hit(self, entry, path, copy=False, revalidated=False):
+        """
+        Serve the cached entry to the path. Only an entry `revalidated`
+        with the server is fresh again.
+        """
+        with self._index() as index:
+            now = time.time()
+            if revalidated:
+                index.execute("UPDATE entries SET checked = ? WHERE url = ?",
+                              (now, entry["url"]))
+            index.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?",
+                          (now, entry["sha256"]))
+            self._count(index, "hits")
+        self.link(entry["sha256"], path, copy=copy)
+
+    def store(self, url, chunks, etag=None, last_modified=None):
+        """
+        Store the downloaded chunks for the url and return the new entry.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(tmp_fd, "wb") as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            blob_path = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        now = time.time()
+        with self._index() as index:
+            index.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)",
+                          (digest, size, now))
+            index.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                          (url, digest, etag, last_modified, now))
+            self._count(index, "misses")
+            self._count(index, "bytes_stored", size)
+
+        self.evict()
+
+        return {
+            "url": url,
+            "sha256": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+            "fresh": True,
+        }
+
+    def link(self, sha256, path, copy=False):
+        """
+        Hardlink the blob to the path, copy it if a link is not possible
+        or if the file will be changed in place (e.g. the METS).
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{0}.part".format(path)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        if copy:
+            shutil.copyfile(self.blob_path(sha256), tmp_path)
+        else:
+            try:
+                os.link(self.blob_path(sha256), tmp_path)
+            except OSError:
+                shutil.copyfile(self.blob_path(sha256), tmp_path)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """ Remove the least recently used blobs above the maximal size. """
+        with self._index() as index:
+            total = index.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_size:
+                return
+            for sha256, size in index.execute(
+                    "SELECT sha256, size FROM blobs ORDER BY last_access").fetchall():
+                if total <= self.max_size:
+                    break
+                index.execute("DELETE FROM entries WHERE sha256 = ?", (sha256,))
+                index.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                # Workspaces keep their hardlinks to the file.
+                if os.path.exists(self.blob_path(sha256)):
+                    os.unlink(self.blob_path(sha256))
+                self._count(index, "evictions")
+                total -= size
+
+    def stats(self):
+        """ Counters and size of the cache. """
+        with self._index() as index:
+            stats = dict(index.execute("SELECT name, value FROM counters"))
+            count, size = index.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        for name in ("hits", "misses", "bytes_stored", "evictions"):
+            stats.setdefault(name, 0)
+        stats["blobs"] = count
+        stats["size"] = size
+        stats["max_size"] = self.max_size
+        return stats
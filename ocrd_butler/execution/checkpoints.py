@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Record the processed steps of a task to be able to resume it."""
+
+from datetime import datetime
+import json
+import os
+
+from ocrd_butler.database import db
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
+
+
+def output_is_valid(workspace, file_grp):
+    """ Check if the file group has files which all exist locally. """
+    files = workspace.mets.find_files(fileGrp=file_grp)
+    if not files:
+        return False
+    for ocrd_file in files:
+        if not ocrd_file.local_filename:
+            return False
+        if not os.path.exists(os.path.join(workspace.directory,
+                                           ocrd_file.local_filename)):
+            return False
+    return True
+
+
+def valid_steps(task_id, steps, workspace):
+    """
+    Count the steps from the start of the chain which are already done,
+    i.e. were finished with the same processor and parameters before and
+    whose output is still in the workspace.
+    """
+    finished = {}
+    for task_step in db_model_TaskStep.query.filter_by(
+            task_id=task_id, status="SUCCESS").order_by(db_model_TaskStep.id):
+        finished[task_step.index] = task_step
+
+    count = 0
+    for step in steps:
+        task_step = finished.get(step["index"])
+        if task_step is None \
+                or task_step.processor != step["processor"] \
+                or task_step.parameter != json.loads(step["parameter"]) \
+                or task_step.output_file_grp != step["output_file_grp"] \
+                or not output_is_valid(workspace, step["output_file_grp"]):
+            break
+        count += 1
+    return count
+
+
+def start_step(task_id, step):
+    """ Record the start of the step. """
+    task_step = db_model_TaskStep(
+        task_id=task_id,
+        index=step["index"],
+        processor=step["processor"],
+        input_file_grp=step["input_file_grp"],
+        output_file_grp=step["output_file_grp"],
+        parameter=json.loads(step["parameter"]),
+        started=datetime.now())
+    db.session.add(task_step)
+    db.session.commit()
+    return task_step
+
+
+def finish_step(task_step, status="SUCCESS", cached=False, step_usage=None):
+    """ Record the end of the step and the resources it used. """
+    task_step.status = status
+    task_step.cached = cached
+    task_step.finished = datetime.now()
+    if step_usage is not None:
+        task_step.wall_time = step_usage["wall_time"]
+        task_step.user_time = step_usage["user_time"]
+        task_step.system_time = step_usage["system_time"]
+        task_step.max_rss = step_usage["max_rss"]
+    db.session.commit()
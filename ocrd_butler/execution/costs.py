@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Learn the cost of the processors from the finished steps and estimate the
+runtime of chains and tasks with it.
+
+The statistics are sums per processor, one row each in `processor_costs`,
+so the estimates don't need to look at the steps.
+"""
+
+from datetime import (
+    datetime,
+    timedelta
+)
+import math
+import os
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from ocrd_butler.database import db
+from ocrd_butler.database.models import ProcessorCost as db_model_ProcessorCost
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
+
+
+def image_megapixels(workspace, files):
+    """
+    The megapixels of the local images, None if one can't be read.
+    Only the headers of the images are read.
+    """
+    from PIL import Image
+
+    megapixels = 0.0
+    for ocrd_file in files:
+        if not ocrd_file.local_filename:
+            return None
+        try:
+            with Image.open(os.path.join(
+                    workspace.directory, ocrd_file.local_filename)) as image:
+                width, height = image.size
+        except (IOError, OSError):
+            return None
+        megapixels += width * height / 1000000.0
+    return megapixels
+
+
+def parallel_shards(pages, shard_size):
+    """ The number of shards of a step running at the same time. """
+    if not shard_size or not pages:
+        return 1
+    return max(1, min(math.ceil(pages / shard_size),
+                      current_app.config["TASK_SHARD_WORKERS"]))
+
+
+def record_step_cost(processor, wall_time, pages, megapixels=None, parallel=1,
+                     output_bytes=None):
+    """
+    Add a finished step to the cost of its processor, with the bytes of
+    its output if they are measured.
+    """
+    if not pages or wall_time is None:
+        return
+    seconds = wall_time * parallel
+    values = {
+        db_model_ProcessorCost.steps: db_model_ProcessorCost.steps + 1,
+        db_model_ProcessorCost.pages: db_model_ProcessorCost.pages + pages,
+        db_model_ProcessorCost.seconds: db_model_ProcessorCost.seconds + seconds,
+        db_model_ProcessorCost.updated: datetime.now(),
+    }
+    if megapixels:
+        values.update({
+            db_model_ProcessorCost.megapixels:
+                db_model_ProcessorCost.megapixels + megapixels,
+            db_model_ProcessorCost.megapixel_seconds:
+                db_model_ProcessorCost.megapixel_seconds + seconds,
+        })
+    if output_bytes is not None:
+        values.update({
+            db_model_ProcessorCost.output_pages:
+                db_model_ProcessorCost.output_pages + pages,
+            db_model_ProcessorCost.output_bytes:
+                db_model_ProcessorCost.output_bytes + output_bytes,
+        })
+
+    # Add up in the database, other workers record steps at the same time.
+    for _ in range(2):
+        query = db_model_ProcessorCost.query.filter_by(processor=processor)
+        if query.update(values, synchronize_session=False):
+            db.session.commit()
+            return
+        try:
+            db.session.add(db_model_ProcessorCost(processor))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker added it.
+            db.session.rollback()
+
+
+def estimate_steps(processors, pages, megapixels=None, parallel=1):
+    """
+    Estimate the seconds of every processor for a work with the given
+    number of pages or megapixels, by the megapixels if the cost of the
+    processor per megapixel is known. The seconds are None for a processor
+    without any finished step yet.
+    """
+    costs = {cost.processor: cost for cost in db_model_ProcessorCost.query.filter(
+        db_model_ProcessorCost.processor.in_(processors))}
+    estimates = []
+    for processor in processors:
+        cost = costs.get(processor)
+        seconds = None
+        if cost is not None and megapixels and cost.megapixels:
+            seconds = cost.megapixel_seconds / cost.megapixels * megapixels
+        elif cost is not None and cost.pages:
+            seconds = cost.seconds / cost.pages * pages
+        estimates.append({
+            "processor": processor,
+            "seconds": seconds / parallel if seconds is not None else None,
+            "steps": cost.steps if cost is not None else 0,
+        })
+    return estimates
+
+
+def estimate_chain(chain, pages, megapixels=None, shard_size=None):
+    """ Estimate the runtime of the chain for a work. """
+    # Like `task_shard_size`.
+    shard_size = shard_size or chain.shard_size \
+        or current_app.config["TASK_SHARD_SIZE"]
+    estimates = estimate_steps(chain.processors, pages, megapixels,
+                               parallel_shards(pages, shard_size))
+    unknown = [estimate["processor"] for estimate in estimates
+               if estimate["seconds"] is None]
+    return {
+        "pages": pages,
+        "megapixels": megapixels,
+        "seconds": None if unknown else sum(
+            estimate["seconds"] for estimate in estimates),
+        "processors": estimates,
+        "unknown": unknown,
+    }
+
+
+def average_pages(processor):
+    """ The average number of pages of the works the processor ran on. """
+    cost = db_model_ProcessorCost.query.filter_by(processor=processor).first()
+    if cost is None or not cost.steps:
+        return None
+    return int(round(cost.pages / cost.steps))
+
+
+def task_eta(task, now=None):
+    """
+    Estimate when the queued or running task will be done, None if the
+    cost of one of its processors is unknown. The pages of a task which
+    isn't prepared yet are the average ones of the first processor.
+    """
+    if task.status not in ("PENDING", "STARTED", "RETRY"):
+        return None
+    now = now or datetime.now()
+    processors = task.chain.processors
+    pages = task.pages or average_pages(processors[0])
+    if not pages:
+        return None
+    estimate = estimate_chain(task.chain, pages, task.megapixels,
+                              shard_size=task.shard_size)
+    if estimate["seconds"] is None:
+        return None
+
+    remaining = estimate["seconds"]
+    if task.status == "STARTED" and task.started is not None:
+        # Subtract the steps of this run which are done or running.
+        steps = task.steps.filter(db_model_TaskStep.started >= task.started)
+        for step in steps:
+            seconds = estimate["processors"][step.index]["seconds"] \
+                if step.index < len(processors) else 0
+            if step.status == "RUNNING":
+                seconds = min(seconds, (now - step.started).total_seconds())
+            elif step.status != "SUCCESS":
+                continue
+            remaining -= seconds
+    return now + timedelta(seconds=max(0.0, remaining))
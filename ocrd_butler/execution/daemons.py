@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""
+Long-living processor servers that keep their imports and models loaded.
+
+Every daemon serves one processor class over a local unix socket and is
+started as `python -m ocrd_butler.execution.daemons <module:Class> <socket>`.
+The worker keeps a small pool of daemons per executable, started lazily on
+the first request. A daemon quits after being idle for a while or after a
+maximal number of requests, the pool starts a new one on demand.
+"""
+
+import atexit
+from collections import OrderedDict
+import importlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from ocrd_butler.execution import processes
+from ocrd_butler.execution.accounting import (
+    rusage_delta,
+    self_usage,
+    usage
+)
+
+
+def _load_class(class_path):
+    module_name, class_name = class_path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _process(processor_class, instances, max_instances, request):
+    """
+    Run the processor for the request like ocrd's run_processor.
+    Returns the resources used by the daemon meanwhile.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ocrd.resolver import Resolver
+    from ocrd_utils import setOverrideLogLevel
+
+    started = time.time()
+    before = self_usage()
+
+    if request.get("log_level"):
+        setOverrideLogLevel(request["log_level"])
+
+    workspace = Resolver().workspace_from_url(
+        request["mets_url"], dst_dir=request["working_dir"])
+    os.chdir(workspace.directory)
+
+    parameter = json.loads(request["parameter"] or "{}")
+    key = json.dumps(parameter, sort_keys=True)
+    processor = instances.pop(key, None)
+    if processor is None:
+        processor = processor_class(
+            workspace,
+            page_id=request["page_id"],
+            input_file_grp=request["input_file_grp"],
+            output_file_grp=request["output_file_grp"],
+            parameter=parameter)
+    else:
+        processor.workspace = workspace
+        processor.page_id = request["page_id"] or None
+        processor.input_file_grp = request["input_file_grp"]
+        processor.output_file_grp = request["output_file_grp"]
+    instances[key] = processor
+    while len(instances) > max_instances:
+        instances.popitem(last=False)
+
+    try:
+        processor.process()
+    except Exception:
+        # Don't keep an instance in an unknown state.
+        del instances[key]
+        raise
+
+    workspace.mets.add_agent(
+        name="{0} v{1}".format(processor.ocrd_tool["executable"], processor.version),
+        _type="OTHER",
+        othertype="SOFTWARE",
+        role="OTHER",
+        otherrole=processor.ocrd_tool["steps"][0])
+    workspace.save_mets()
+
+    return rusage_delta(before, self_usage(), time.time() - started)
+
+
+def serve(class_path, socket_path, idle_timeout=600, max_requests=100,
+          max_instances=2):
+    """ Serve requests for the processor class on the socket. """
+    processor_class = _load_class(class_path)
+    instances = OrderedDict()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    server.settimeout(idle_timeout)
+
+    handled = 0
+    try:
+        while max_requests <= 0 or handled < max_requests:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            with connection:
+                connection.settimeout(None)
+                request = json.loads(connection.makefile("rb").readline())
+                try:
+                    response = {
+                        "returncode": 0,
+                        "usage": _process(processor_class, instances,
+                                          max_instances, request),
+                    }
+                except Exception:  # pylint: disable=broad-except
+                    response = {"returncode": 1,
+                                "error": traceback.format_exc()}
+                handled += 1
+                # Let the client know this server quits, so it doesn't
+                # connect to it while it shuts down.
+                response["last"] = 0 < max_requests <= handled
+                connection.sendall("{0}\n".format(json.dumps(response)).encode("utf-8"))
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+class ProcessorDaemon():
+    """ Client side of one processor server process. """
+
+    def __init__(self, executable, class_path, socket_dir, idle_timeout,
+                 max_requests, max_instances, start_timeout=120):
+        self.executable = executable
+        self.class_path = class_path
+        self.socket_dir = socket_dir
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.max_instances = max_instances
+        self.start_timeout = start_timeout
+        self.socket_path = None
+        self.process = None
+
+    def alive(self):
+        """ Check if the server process is still running. """
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """ Start the server process and wait for its socket. """
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.socket_path = os.path.join(self.socket_dir, "{0}-{1}.sock".format(
+            self.executable, uuid.uuid4().hex[:8]))
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "ocrd_butler.execution.daemons",
+            self.class_path, self.socket_path, str(self.idle_timeout),
+            str(self.max_requests), str(self.max_instances)])
+
+        started = time.time()
+        while not os.path.exists(self.socket_path):
+            if not self.alive():
+                raise Exception("Processor daemon for {0} quit on start.".format(
+                    self.executable))
+            if time.time() - started > self.start_timeout:
+                self.stop()
+                raise Exception("Processor daemon for {0} didn't start.".format(
+                    self.executable))
+            time.sleep(0.1)
+
+    def stop(self):
+        """ Terminate the server process. """
+        if self.alive():
+            self.process.terminate()
+            self.process.wait()
+
+    def _connect(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.socket_path)
+        except OSError:
+            client.close()
+            raise
+        return client
+
+    def request(self, request):
+        """
+        Let the server process the request, (re)start it if necessary.
+        """
+        if not self.alive():
+            self.start()
+        try:
+            client = self._connect()
+        except (ConnectionError, FileNotFoundError):
+            # The server quit after its last request or idle timeout.
+            self.stop()
+            self.start()
+            client = self._connect()
+
+        # The daemon is busy with our task, stop it with the task.
+        processes.started(self.process.pid)
+        try:
+            with client:
+                client.sendall("{0}\n".format(json.dumps(request)).encode("utf-8"))
+                response = client.makefile("rb").readline()
+        finally:
+            processes.finished(self.process.pid)
+        if not response:
+            raise Exception("Processor daemon for {0} quit while processing.".format(
+                self.executable))
+        response = json.loads(response)
+        if response.get("last"):
+            self.process.wait()
+        return response
+
+
+class DaemonPool():
+    """ Processor daemons of one worker process, grouped by executable. """
+
+    def __init__(self, classes, socket_dir, pool_size=1, idle_timeout=600,
+                 max_requests=100, max_instances=2):
+        self.classes = classes
+        self.socket_dir = socket_dir
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.max_instances = max_instances
+        self.pid = os.getpid()
+        self._idle = {}
+        self._count = {}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Create the pool with the settings of the app config. """
+        return cls(config["PROCESSOR_DAEMONS"],
+                   config["PROCESSOR_DAEMON_SOCKETS"],
+                   pool_size=config["PROCESSOR_DAEMON_POOL_SIZE"],
+                   idle_timeout=config["PROCESSOR_DAEMON_IDLE_TIMEOUT"],
+                   max_requests=config["PROCESSOR_DAEMON_MAX_REQUESTS"],
+                   max_instances=config["PROCESSOR_DAEMON_INSTANCES"])
+
+    def supports(self, executable):
+        """ Check if the executable is served by daemons. """
+        return executable in self.classes
+
+    def _acquire(self, executable):
+        with self._condition:
+            while True:
+                if self._idle.get(executable):
+                    return self._idle[executable].pop()
+                if self._count.get(executable, 0) < self.pool_size:
+                    self._count[executable] = self._count.get(executable, 0) + 1
+                    return ProcessorDaemon(
+                        executable, self.classes[executable], self.socket_dir,
+                        self.idle_timeout, self.max_requests, self.max_instances)
+                self._condition.wait()
+
+    def _release(self, daemon):
+        with self._condition:
+            self._idle.setdefault(daemon.executable, []).append(daemon)
+            self._condition.notify()
+
+    def run(self, executable, mets_url, working_dir, page_id=None,
+            log_level=None, input_file_grp=None, output_file_grp=None,
+            parameter=None):
+        """
+        Process the workspace with a daemon of the executable, the same
+        arguments as for `run_cli`. Returns the exit code, 0 on success, and
+        the resources the daemon used. Its peak RSS includes the loaded
+        models.
+        """
+        daemon = self._acquire(executable)
+        try:
+            response = daemon.request({
+                "mets_url": mets_url,
+                "working_dir": working_dir,
+                "page_id": page_id,
+                "log_level": log_level,
+                "input_file_grp": input_file_grp,
+                "output_file_grp": output_file_grp,
+                "parameter": parameter,
+            })
+        finally:
+            self._release(daemon)
+
+        if response["returncode"] != 0:
+            sys.stderr.write(response.get("error", ""))
+        return response["returncode"], response.get("usage", usage())
+
+    def shutdown(self):
+        """ Stop all daemons of the pool. """
+        with self._condition:
+            for daemons in self._idle.values():
+                for daemon in daemons:
+                    daemon.stop()
+
+
+_POOL = None
+
+
+def daemon_pool(config):
+    """ Get the daemon pool of the current process, None if disabled. """
+    global _POOL  # pylint: disable=global-statement
+    if not config.get("PROCESSOR_DAEMONS"):
+        return None
+    if _POOL is None or _POOL.pid != os.getpid():
+        _POOL = DaemonPool.from_config(config)
+        atexit.register(_POOL.shutdown)
+    return _POOL
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], idle_timeout=int(sys.argv[3]),
+          max_requests=int(sys.argv[4]), max_instances=int(sys.argv[5]))
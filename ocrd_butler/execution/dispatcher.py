@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+Dispatch the tasks of collections in portions.
+
+Only a few tasks of a running collection are in the queues at any time,
+the next ones are dispatched when the former ones are done. The id of the
+last dispatched task is stored as cursor of the collection, so the
+dispatching continues where it stopped after a pause or a restart.
+"""
+
+from datetime import (
+    datetime,
+    timedelta
+)
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from ocrd_butler.database import db
+from ocrd_butler.database.models import Collection as db_model_Collection
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.status import (
+    DONE,
+    existing_task,
+    IN_FLIGHT
+)
+from ocrd_butler.execution.tasks import run_tasks
+
+
+def in_flight(collection):
+    """ The number of dispatched tasks of the collection not done yet. """
+    return collection.tasks.filter(db_model_Task.status.in_(IN_FLIGHT)).count()
+
+
+def waiting(collection):
+    """ The number of tasks of the collection not dispatched yet. """
+    return collection.tasks.filter(
+        db_model_Task.id > (collection.cursor or 0)).count()
+
+
+def fair_shares(collections, free=None):
+    """
+    Share the `free` places in the queues, no limit if None, between the
+    collections, given as dicts with `id`, `submitter`, `priority`,
+    `in_flight` and `capacity`, the number of tasks the collection could
+    dispatch now. One place after the other goes to the collection with
+    the highest priority, the submitter with the fewest tasks in flight
+    and the collection with the fewest tasks in flight.
+    Returns the number of tasks to dispatch by collection id.
+    """
+    shares = {collection["id"]: 0 for collection in collections}
+    load = {}
+    for collection in collections:
+        submitter = collection["submitter"] or collection["id"]
+        load[submitter] = load.get(submitter, 0) + collection["in_flight"]
+
+    def rank(collection):
+        return (-collection["priority"],
+                load[collection["submitter"] or collection["id"]],
+                collection["in_flight"] + shares[collection["id"]],
+                collection["id"])
+
+    while free is None or free > 0:
+        candidates = [collection for collection in collections
+                      if shares[collection["id"]] < collection["capacity"]]
+        if not candidates:
+            break
+        collection = min(candidates, key=rank)
+        shares[collection["id"]] += 1
+        load[collection["submitter"] or collection["id"]] += 1
+        if free is not None:
+            free -= 1
+    return shares
+
+
+def attach_task(task, existing):
+    """ Take over the workspace and the state of the existing task. """
+    for name in ("uid", "worker_task_id", "status", "results", "pages",
+                 "megapixels", "image_bytes", "footprint", "storage_root",
+                 "received", "started", "finished"):
+        setattr(task, name, getattr(existing, name))
+
+
+def dispatch_collection(collection, limit=None):
+    """
+    Dispatch the next tasks of a running collection, up to its
+    `max_in_flight` tasks in the queues and at most `limit` tasks.
+    A task with the same fingerprint as a succeeded one isn't run, it's
+    attached to that one. A finished collection is marked.
+    Returns the number of dispatched or attached tasks.
+    """
+    if collection.status != "RUNNING":
+        return 0
+
+    running = in_flight(collection)
+    free = collection.max_in_flight - running
+    if limit is not None:
+        free = min(free, limit)
+    if free <= 0:
+        return 0
+
+    cursor = collection.cursor or 0
+    tasks = collection.tasks.filter(db_model_Task.id > cursor).order_by(
+        db_model_Task.id).limit(free).all()
+    if not tasks:
+        if running == 0:
+            collection.status = "FINISHED"
+            collection.finished = datetime.now()
+            db.session.commit()
+        return 0
+
+    # Claim the tasks by moving the cursor, only one dispatcher wins.
+    claimed = db_model_Collection.query.filter_by(
+        id=collection.id, cursor=collection.cursor).update(
+            {"cursor": tasks[-1].id}, synchronize_session=False)
+    if not claimed:
+        db.session.rollback()
+        return 0
+
+    received = datetime.now()
+    dispatched = []
+    for task in tasks:
+        # Only succeeded tasks, the events of a running one don't
+        # update this one.
+        existing = task.fingerprint and existing_task(
+            task.fingerprint, exclude=task.id, statuses=("SUCCESS",))
+        if existing:
+            attach_task(task, existing)
+            continue
+        task.status = "PENDING"
+        task.received = received
+        dispatched.append(task)
+    # Serialize before the commit expires the tasks.
+    task_jsons = [task.to_json() for task in dispatched]
+    db.session.commit()
+    if not task_jsons:
+        return len(tasks)
+
+    worker_tasks = run_tasks(task_jsons)
+    db.session.bulk_update_mappings(db_model_Task, [
+        {"id": task["id"], "worker_task_id": worker_task.id}
+        for task, worker_task in zip(task_jsons, worker_tasks)])
+    db.session.commit()
+    return len(tasks)
+
+
+def dispatch_collections():
+    """
+    Dispatch the next tasks of all running collections, the places left by
+    `DISPATCH_MAX_IN_FLIGHT` are shared fairly, see `fair_shares`.
+    """
+    collections = db_model_Collection.query.filter_by(status="RUNNING").all()
+    if not collections:
+        return 0
+
+    free = current_app.config["DISPATCH_MAX_IN_FLIGHT"]
+    if free is not None:
+        free -= db_model_Task.query.filter(
+            db_model_Task.status.in_(IN_FLIGHT)).count()
+
+    candidates = []
+    for collection in collections:
+        running = in_flight(collection)
+        left = waiting(collection)
+        if left == 0:
+            # Nothing to share, but maybe finished.
+            dispatch_collection(collection)
+            continue
+        candidates.append({
+            "id": collection.id,
+            "submitter": collection.submitter,
+            "priority": collection.priority or 0,
+            "in_flight": running,
+            "capacity": min(collection.max_in_flight - running, left),
+        })
+
+    shares = fair_shares(candidates, free)
+    dispatched = 0
+    for collection in collections:
+        if shares.get(collection.id):
+            dispatched += dispatch_collection(
+                collection, limit=shares[collection.id])
+    return dispatched
+
+
+def collection_progress(collection, window=3600):
+    """
+    The number of tasks of the collection per state, the throughput in
+    tasks per hour within the last `window` seconds and the estimated
+    seconds until all tasks are done.
+    """
+    counts = dict(db.session.query(
+        db_model_Task.status, func.count(db_model_Task.id)).filter(
+            db_model_Task.collection_id == collection.id).group_by(
+                db_model_Task.status))
+    total = sum(counts.values())
+    done = sum(counts.get(status, 0) for status in DONE)
+    progress = {
+        "total": total,
+        "succeeded": counts.get("SUCCESS", 0),
+        "failed": counts.get("FAILURE", 0),
+        "in_flight": sum(counts.get(status, 0) for status in IN_FLIGHT),
+        "waiting": total - done - sum(counts.get(status, 0) for status in IN_FLIGHT),
+        "throughput": None,
+        "eta": None,
+    }
+
+    if collection.started is not None:
+        now = datetime.now()
+        window = min(window, (now - collection.started).total_seconds())
+        if window > 0:
+            finished = collection.tasks.filter(
+                db_model_Task.status.in_(DONE),
+                db_model_Task.finished >= now - timedelta(seconds=window)).count()
+            progress["throughput"] = finished * 3600.0 / window
+            if finished:
+                progress["eta"] = (total - done) * window / finished
+    return progress
+
+
+class CollectionDispatcher():
+    """
+    Dispatch the running collections in a thread of the app, whenever a
+    task changes its state or at least every `COLLECTION_DISPATCH_INTERVAL`
+    seconds.
+    """
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="collection-dispatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        interval = self.app.config["COLLECTION_DISPATCH_INTERVAL"]
+        since = self.store.sequence
+        dispatched = 0
+        while not self.stopped.is_set():
+            changes, since = self.store.changes(since, timeout=interval)
+            # Progress and log lines don't free any place in the queues.
+            if time.monotonic() - dispatched < interval and not any(
+                    kind == "status" for _, _, kind, _ in changes):
+                continue
+            dispatched = time.monotonic()
+            try:
+                with self.app.app_context():
+                    # The finished tasks have to be in the database first.
+                    self.store.flush()
+                    dispatch_collections()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.app.logger.error(
+                    "Can't dispatch the collections: {0}".format(exc))
+
+
+def start_dispatcher(app):
+    """ Dispatch the collections in the app if `COLLECTION_DISPATCH` is set. """
+    if not app.config.get("COLLECTION_DISPATCH"):
+        return None
+    dispatcher = CollectionDispatcher(app, app.extensions["task_events"])
+    dispatcher.start()
+    return dispatcher
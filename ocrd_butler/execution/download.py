@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent download of the files of a workspace."""
+
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed
+)
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from ocrd_utils import (
+    MIME_TO_EXT,
+    is_local_filename
+)
+
+from ocrd_butler.execution.blob_cache import BlobCache
+
+
+class WorkspaceDownloader():
+    """
+    Download the files of a workspace with a bounded thread pool.
+
+    The number of parallel requests per host is limited and failed
+    requests are retried with an exponential backoff. Only the HTTP
+    requests run in the threads, the METS is updated in the calling thread.
+    If a `BlobCache` is given, the files are served from it if possible.
+    """
+
+    def __init__(self, workers=8, host_concurrency=4, retries=3,
+                 backoff=1.0, timeout=60, cache=None):
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Create the downloader with the settings of the app config. """
+        return cls(workers=config["DOWNLOAD_WORKERS"],
+                   host_concurrency=config["DOWNLOAD_HOST_CONCURRENCY"],
+                   retries=config["DOWNLOAD_RETRIES"],
+                   backoff=config["DOWNLOAD_BACKOFF"],
+                   timeout=config["DOWNLOAD_TIMEOUT"],
+                   cache=BlobCache.from_config(config))
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(
+                    self.host_concurrency)
+            return self._host_limits[host]
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def fetch(self, url, path, copy=False):
+        """
+        Download the url to the given path. Returns the size of the file
+        and if it was served from the cache.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.lookup(url)
+            if entry is not None and entry["fresh"]:
+                self.cache.hit(entry, path, copy=copy)
+                return entry["size"], True
+        headers = BlobCache.conditional_headers(entry)
+
+        attempt = 0
+        while True:
+            try:
+                with self._host_limit(url):
+                    response = self._session().get(
+                        url, headers=headers, stream=True, timeout=self.timeout)
+                    if response.status_code == 304 and entry is not None:
+                        self.cache.hit(entry, path, copy=copy, revalidated=True)
+                        return entry["size"], True
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise requests.exceptions.HTTPError(
+                            "HTTP request failed: {0} (HTTP {1})".format(
+                                url, response.status_code))
+                    if response.status_code != 200:
+                        # Retrying won't help here.
+                        raise Exception("HTTP request failed: {0} (HTTP {1})".format(
+                            url, response.status_code))
+                    chunks = response.iter_content(chunk_size=65536)
+                    if self.cache is not None:
+                        entry = self.cache.store(
+                            url, chunks,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"))
+                        self.cache.link(entry["sha256"], path, copy=copy)
+                        return entry["size"], False
+                    tmp_path = "{0}.part".format(path)
+                    size = 0
+                    try:
+                        with open(tmp_path, "wb") as fh:
+                            for chunk in chunks:
+                                fh.write(chunk)
+                                size += len(chunk)
+                    except BaseException:
+                        if os.path.exists(tmp_path):
+                            os.unlink(tmp_path)
+                        raise
+                os.replace(tmp_path, path)
+                return size, False
+            except requests.exceptions.RequestException:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def download(self, workspace, files, progress=None):
+        """
+        Download the given files of the workspace and register the local
+        files in its METS.
+
+        `progress` is called with the number of finished files, the number
+        of all files and the bytes downloaded so far.
+        """
+        started = time.time()
+        stats = {"pages": 0, "pages_total": len(files), "bytes": 0,
+                 "cache_hits": 0}
+
+        remote_files = []
+        for ocrd_file in files:
+            if is_local_filename(ocrd_file.url):
+                workspace.download_file(ocrd_file)
+                stats["pages"] += 1
+            else:
+                remote_files.append(ocrd_file)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for ocrd_file in remote_files:
+                basename = "{0}{1}".format(
+                    ocrd_file.ID, MIME_TO_EXT.get(ocrd_file.mimetype, ""))
+                local_filename = os.path.join(ocrd_file.fileGrp, basename)
+                future = executor.submit(
+                    self.fetch, ocrd_file.url,
+                    os.path.join(workspace.directory, local_filename))
+                futures[future] = (ocrd_file, local_filename)
+
+            for future in as_completed(futures):
+                ocrd_file, local_filename = futures[future]
+                try:
+                    size, cached = future.result()
+                except BaseException:
+                    # The workspace is given up, don't start the others.
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                stats["bytes"] += size
+                stats["cache_hits"] += int(cached)
+                stats["pages"] += 1
+                ocrd_file.url = local_filename
+                ocrd_file.local_filename = local_filename
+                if progress is not None:
+                    progress(stats["pages"], stats["pages_total"], stats["bytes"])
+
+        stats["seconds"] = round(time.time() - started, 3)
+        return stats
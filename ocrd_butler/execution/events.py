@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+Follow the Celery events of the workers in the app process.
+
+A receiver thread feeds the events into a `TaskStateStore`, a second
+thread writes the changed states to the database in batches.
+"""
+
+import threading
+
+from ocrd_butler import celery
+from ocrd_butler.execution.status import TaskStateStore
+
+
+class TaskEventConsumer():
+    """ Receive the task events of the workers and store their state. """
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or TaskStateStore()
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """ Start the receiver and the flusher thread. """
+        for target, name in ((self.receive, "task-events"),
+                             (self.flush, "task-events-flush")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+
+    def receive(self):
+        """ Capture the events, reconnect if the broker goes away. """
+        while not self.stopped.is_set():
+            try:
+                with celery.connection() as connection:
+                    receiver = celery.events.Receiver(
+                        connection, handlers={"*": self.store.handle})
+                    receiver.capture(limit=None, timeout=None, wakeup=True)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.app.logger.warning(
+                    "Lost the connection for the task events: {0}".format(exc))
+                self.stopped.wait(5)
+
+    def flush(self):
+        """ Write the changed states periodically. """
+        interval = self.app.config["TASK_EVENTS_FLUSH_INTERVAL"]
+        while not self.stopped.wait(interval):
+            try:
+                with self.app.app_context():
+                    self.store.flush()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.app.logger.error(
+                    "Can't store the state of the tasks: {0}".format(exc))
+
+
+def init_task_events(app):
+    """
+    Provide the state store of the tasks for the app. The events of the
+    workers are followed after `start_task_events`.
+    """
+    consumer = TaskEventConsumer(
+        app, TaskStateStore(log_lines=app.config["TASK_LOG_LINES"]))
+    app.extensions["task_events"] = consumer.store
+    app.extensions["task_event_consumer"] = consumer
+    return consumer
+
+
+def start_task_events(app):
+    """ Follow the events of the workers if `TASK_EVENTS` is set. """
+    if not app.config.get("TASK_EVENTS"):
+        return None
+    consumer = app.extensions["task_event_consumer"]
+    consumer.start()
+    return consumer
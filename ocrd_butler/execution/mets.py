@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Update METS documents in place instead of going through `OcrdMets.add_file`.
+
+`add_file` searches the whole document for the file ID and the page of
+every file it adds, so merging the output of a processor file by file
+grows quadratically with the size of the METS. The functions here work on
+the lxml tree and index the pages once.
+"""
+
+from copy import deepcopy
+
+from ocrd_models.constants import (
+    NAMESPACES as NS,
+    TAG_METS_FPTR,
+)
+
+
+def _root(mets):
+    return mets._tree.getroot()  # pylint: disable=protected-access
+
+
+def page_divs(mets):
+    """ Map the IDs of the physical pages to their `mets:div`. """
+    return {div.get("ID"): div for div in _root(mets).iterfind(
+        'mets:structMap[@TYPE="PHYSICAL"]/mets:div[@TYPE="physSequence"]'
+        '/mets:div[@TYPE="page"]', NS)}
+
+
+def file_pages(mets):
+    """ Map the IDs of the files to the ID of their physical page. """
+    pages = {}
+    for page_id, div in page_divs(mets).items():
+        for fptr in div.iterfind("mets:fptr", NS):
+            pages[fptr.get("FILEID")] = page_id
+    return pages
+
+
+def prune_pages(mets, page_ids):
+    """
+    Remove all files and physical pages but those of the given pages.
+    Files which don't belong to a page are kept.
+    """
+    page_ids = set(page_ids)
+    pages = file_pages(mets)
+    for el_file in list(_root(mets).iterfind(
+            "mets:fileSec/mets:fileGrp/mets:file", NS)):
+        page_id = pages.get(el_file.get("ID"))
+        if page_id is not None and page_id not in page_ids:
+            el_file.getparent().remove(el_file)
+    for page_id, div in page_divs(mets).items():
+        if page_id not in page_ids:
+            div.getparent().remove(div)
+
+
+def merge_file_groups(mets, source, file_grps):
+    """
+    Copy the files of the given file groups from the `source` METS into
+    `mets`, replacing files with the same ID, and link them to their pages.
+    Returns the number of copied files.
+    """
+    divs = page_divs(mets)
+    source_pages = file_pages(source)
+    fptrs = {}
+    for div in divs.values():
+        for fptr in div.iterfind("mets:fptr", NS):
+            fptrs[fptr.get("FILEID")] = fptr
+    files = {el_file.get("ID"): el_file for el_file in _root(mets).iterfind(
+        "mets:fileSec/mets:fileGrp/mets:file", NS)}
+
+    count = 0
+    for file_grp in file_grps:
+        el_source_grp = _root(source).find(
+            'mets:fileSec/mets:fileGrp[@USE="{0}"]'.format(file_grp), NS)
+        if el_source_grp is None:
+            continue
+        el_file_grp = mets.add_file_group(file_grp)
+        for el_source_file in el_source_grp.iterfind("mets:file", NS):
+            file_id = el_source_file.get("ID")
+            if file_id in files:
+                files[file_id].getparent().remove(files[file_id])
+            if file_id in fptrs:
+                fptrs[file_id].getparent().remove(fptrs[file_id])
+
+            el_file = deepcopy(el_source_file)
+            el_file_grp.append(el_file)
+            files[file_id] = el_file
+            count += 1
+
+            page_id = source_pages.get(file_id)
+            if page_id is None:
+                continue
+            if page_id not in divs:
+                # Let ocrd create the page, it's done once per page.
+                mets.set_physical_page_for_file(
+                    page_id, mets.find_files(ID=file_id)[0])
+                divs = page_divs(mets)
+                continue
+            fptr = divs[page_id].makeelement(TAG_METS_FPTR, FILEID=file_id)
+            divs[page_id].append(fptr)
+            fptrs[file_id] = fptr
+    return count
+
+
+def merge_agents(mets, source, start=None):
+    """
+    Copy the agents of `source` from the `start` one on, by default the
+    ones `mets` doesn't have yet.
+    """
+    agents = _root(mets).findall("mets:metsHdr/mets:agent", NS)
+    source_agents = _root(source).findall("mets:metsHdr/mets:agent", NS)
+    if start is None:
+        start = len(agents)
+    if len(source_agents) <= start:
+        return
+    el_mets_hdr = _root(mets).find("mets:metsHdr", NS)
+    if el_mets_hdr is None:
+        # The first agent creates the header.
+        mets.add_agent()
+        el_mets_hdr = _root(mets).find("mets:metsHdr", NS)
+        el_mets_hdr.remove(el_mets_hdr.find("mets:agent", NS))
+    for el_agent in source_agents[start:]:
+        el_mets_hdr.append(deepcopy(el_agent))
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Execution plans of the chains.
+
+A chain is compiled once into a plan with the executable, the file groups
+and the default parameters of the processor merged with the ones of the
+chain for every step. The plan is stored with the chain and compiled again
+if the chain or the installed processors change, every compilation gets a
+new `plan_version`. A task only applies its own file group and parameters
+on top of the plan.
+
+A chain is a line of processors or a graph of nodes with parallel
+branches, see `compile_plan`.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import (
+    urlsplit,
+    urlunsplit
+)
+
+from ocrd_validators import ParameterValidator
+
+from ocrd_butler.api.processors import (
+    PROCESSORS_ACTION,
+    PROCESSORS_CONFIG
+)
+
+# Bump if the content of the plans changes.
+PLAN_FORMAT = 2
+
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
+
+
+def processor_validator(processor):
+    """ The parameter validator of the processor, created once. """
+    validator = _VALIDATORS.get(processor)
+    if validator is None:
+        with _VALIDATORS_LOCK:
+            if processor not in _VALIDATORS:
+                # The validator removes `required` from the parameters.
+                _VALIDATORS[processor] = ParameterValidator(
+                    copy.deepcopy(PROCESSORS_CONFIG[processor]))
+            validator = _VALIDATORS[processor]
+    return validator
+
+
+def processor_version(processor):
+    """ The version of the installed package of the processor. """
+    return PROCESSORS_CONFIG.get(processor, {}).get("package", {}).get("version")
+
+
+def file_grps(value):
+    """ The file groups as comma separated string, None if not given. """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    return ",".join(file_grp.strip() for file_grp in value)
+
+
+def graph_levels(needs):
+    """
+    The level of every node of the graph given as the nodes each node
+    needs, 0 for the nodes without any. Nodes of the same level don't
+    depend on each other. Raises a ValueError if there is a cycle.
+    """
+    levels = {}
+    visiting = set()
+
+    def level(node):
+        if node in levels:
+            return levels[node]
+        if node in visiting:
+            raise ValueError("The nodes form a cycle.")
+        visiting.add(node)
+        levels[node] = max((level(need) + 1 for need in needs[node]), default=0)
+        visiting.discard(node)
+        return levels[node]
+
+    for node in range(len(needs)):
+        level(node)
+    return [levels[node] for node in range(len(needs))]
+
+
+def compile_plan(processors, parameters=None, nodes=None):
+    """
+    Compile the processors of a chain with the parameters of the chain.
+
+    Without `nodes` every processor reads the output of the one before, the
+    first one the file group of the task. The `nodes` make the chain a
+    graph, each node has a `processor` and optionally `input_file_grp`,
+    `output_file_grp` and `parameters`. A node needs the nodes writing its
+    input file groups, nodes without input file groups read the one of the
+    task.
+
+    The steps are ordered by their `level`, steps of the same level run in
+    parallel and are marked as `branch`. The input file group is None for
+    the file group of the task.
+    Raises a KeyError for an unknown processor and a ValueError for a
+    wrong graph.
+    """
+    parameters = parameters or {}
+    line = nodes is None
+    if line:
+        nodes = [{"processor": name} for name in processors]
+    steps = []
+    for index, node in enumerate(nodes):
+        processor = PROCESSORS_ACTION[node["processor"]]
+        parameter = copy.deepcopy(processor.get("parameters", {}))
+        parameter.update(parameters.get(node["processor"], {}))
+        parameter.update(node.get("parameters") or {})
+        steps.append({
+            "index": index,
+            "processor": node["processor"],
+            "executable": processor["executable"],
+            "version": processor_version(node["processor"]),
+            "input_file_grp": file_grps(node.get("input_file_grp")),
+            "output_file_grp": node.get("output_file_grp")
+                               or processor["output_file_grp"],
+            "parameter": parameter,
+        })
+
+    if line:
+        needs = [[index - 1] if index else [] for index in range(len(steps))]
+        for step in steps[1:]:
+            step["input_file_grp"] = steps[step["index"] - 1]["output_file_grp"]
+    else:
+        writers = {}
+        for step in steps:
+            if step["output_file_grp"] in writers:
+                raise ValueError(
+                    "The output file group {0} is written by more than one "
+                    "node.".format(step["output_file_grp"]))
+            writers[step["output_file_grp"]] = step["index"]
+        needs = [sorted({writers[file_grp]
+                         for file_grp in (step["input_file_grp"] or "").split(",")
+                         if file_grp in writers})
+                 for step in steps]
+
+    levels = graph_levels(needs)
+    for step in steps:
+        step["needs"] = needs[step["index"]]
+        step["level"] = levels[step["index"]]
+        step["branch"] = levels.count(step["level"]) > 1
+    steps.sort(key=lambda step: (step["level"], step["index"]))
+    return {"format": PLAN_FORMAT, "steps": steps}
+
+
+def plan_levels(plan_steps):
+    """ The steps grouped by their level, in order. """
+    levels = []
+    for step in plan_steps:
+        if levels and levels[-1][0]["level"] == step["level"]:
+            levels[-1].append(step)
+        else:
+            levels.append([step])
+    return levels
+
+
+def plan_is_current(plan, processors):
+    """ Whether the plan is compiled for the processors as installed now. """
+    if not plan or plan.get("format") != PLAN_FORMAT \
+            or len(plan["steps"]) != len(processors):
+        return False
+    return all(processors[step["index"]] == step["processor"]
+               and step["version"] == processor_version(step["processor"])
+               for step in plan["steps"])
+
+
+def chain_plan(chain):
+    """
+    The plan of the chain, compiled again if it's missing or outdated.
+    The caller commits the chain.
+    """
+    if not plan_is_current(chain.plan, chain.processors):
+        chain.plan = compile_plan(chain.processors, chain.parameters,
+                                  chain.nodes)
+        chain.plan_version = (chain.plan_version or 0) + 1
+    return chain.plan
+
+
+def task_steps(task):
+    """ The processor calls for the task from the plan of its chain. """
+    chain = task["chain"]
+    plan = chain.get("plan")
+    if not plan_is_current(plan, chain["processors"]):
+        plan = compile_plan(chain["processors"], chain["parameters"],
+                            chain.get("nodes"))
+
+    steps = []
+    for step in plan["steps"]:
+        step = dict(step)
+        if step["input_file_grp"] is None:
+            step["input_file_grp"] = task["default_file_grp"]
+        parameter = dict(step["parameter"])
+        parameter.update(task["parameters"].get(step["processor"], {}))
+        step["parameter"] = json.dumps(parameter)
+        steps.append(step)
+    return steps
+
+
+def final_output_file_grp(task):
+    """
+    The output file group of the last step of the task. For a graph the
+    one of the sink node, the node no other one needs, of the last level.
+    """
+    steps = task_steps(task)
+    needed = {need for step in steps for need in step.get("needs", [])}
+    sinks = [step for step in steps if step["index"] not in needed]
+    return max(sinks, key=lambda step: (step["level"], step["index"]))["output_file_grp"]
+
+
+def normalized_src(src):
+    """
+    The source without differences that don't change the work: the case
+    of scheme and host, default ports, fragments and relative paths.
+    """
+    src = (src or "").strip()
+    parts = urlsplit(src)
+    scheme = parts.scheme.lower()
+    if scheme in ("http", "https"):
+        netloc = parts.netloc.lower()
+        default_port = ":80" if scheme == "http" else ":443"
+        if netloc.endswith(default_port):
+            netloc = netloc[:-len(default_port)]
+        return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+    if scheme == "file":
+        src = parts.path
+    return os.path.normpath(os.path.abspath(src)) if src else ""
+
+
+def task_fingerprint(task):
+    """
+    The same for tasks running the same steps with the same parameters on
+    the same source, see `task_steps`.
+    """
+    steps = [{
+        "processor": step["processor"],
+        "executable": step["executable"],
+        "version": step["version"],
+        "input_file_grp": step["input_file_grp"],
+        "output_file_grp": step["output_file_grp"],
+        "parameter": json.loads(step["parameter"]),
+    } for step in sorted(task_steps(task), key=lambda step: step["index"])]
+    fingerprint = json.dumps([normalized_src(task["src"]), steps], sort_keys=True)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
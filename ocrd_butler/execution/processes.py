@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+The processes the steps of a task run in this worker process.
+
+Stopping a task terminates the worker process with SIGTERM, the handler
+installed here kills the processors first, otherwise they would go on as
+orphans.
+"""
+
+import os
+import signal
+import threading
+import time
+
+# Reentrant, the signal handler may interrupt the thread holding it.
+_LOCK = threading.RLock()
+# The pids of the running processes, True if the pid is a process group.
+_RUNNING = {}
+
+
+def started(pid, group=False):
+    """ Register a running process, or process group. """
+    with _LOCK:
+        _RUNNING[pid] = group
+
+
+def finished(pid):
+    """ Forget a process which is done. """
+    with _LOCK:
+        _RUNNING.pop(pid, None)
+
+
+def _signal(pid, group, signum):
+    try:
+        if group:
+            os.killpg(pid, signum)
+        else:
+            os.kill(pid, signum)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+def _alive(pid, group):
+    try:
+        # Reap our own child, a zombie would look alive.
+        if os.waitpid(pid, os.WNOHANG)[0] == pid and not group:
+            return False
+    except ChildProcessError:
+        pass
+    return _signal(pid, group, 0)
+
+
+def kill_all(grace=5):
+    """
+    Terminate all running processes, kill the ones still alive after
+    `grace` seconds.
+    """
+    with _LOCK:
+        running = dict(_RUNNING)
+    running = {pid: group for pid, group in running.items()
+               if _signal(pid, group, signal.SIGTERM)}
+
+    deadline = time.monotonic() + grace
+    while running and time.monotonic() < deadline:
+        time.sleep(0.1)
+        running = {pid: group for pid, group in running.items()
+                   if _alive(pid, group)}
+    for pid, group in running.items():
+        _signal(pid, group, signal.SIGKILL)
+
+
+def _terminate(signum, frame):
+    kill_all()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def install_handler():
+    """ Kill the running processes before this process terminates. """
+    signal.signal(signal.SIGTERM, _terminate)
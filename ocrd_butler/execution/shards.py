@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+Split a workspace into page shards and merge the results back.
+
+The parallel branches of a chain run on branch workspaces the same way,
+with all pages.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import os
+import shutil
+
+from ocrd.resolver import Resolver
+from ocrd.workspace import Workspace
+from ocrd_models.ocrd_mets import OcrdMets
+
+from ocrd_butler.execution.mets import (
+    file_pages,
+    merge_agents,
+    merge_file_groups,
+    prune_pages
+)
+
+
+SHARDS_DIR = "shards"
+BRANCHES_DIR = "branches"
+
+
+def file_group_size(workspace, file_grp):
+    """ The bytes of the local files of the file group in the workspace. """
+    size = 0
+    for ocrd_file in workspace.mets.find_files(fileGrp=file_grp):
+        if not ocrd_file.local_filename:
+            continue
+        path = os.path.join(workspace.directory, ocrd_file.local_filename)
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def page_shards(workspace, file_grp, shard_size):
+    """
+    Split the pages of the given file group into lists of at most
+    `shard_size` page ids, in the order of the METS.
+    """
+    pages = file_pages(workspace.mets)
+    page_ids = []
+    for ocrd_file in workspace.mets.find_files(fileGrp=file_grp):
+        page_id = pages.get(ocrd_file.ID)
+        if page_id and page_id not in page_ids:
+            page_ids.append(page_id)
+
+    if not shard_size or shard_size <= 0:
+        return [page_ids]
+
+    return [page_ids[start:start + shard_size]
+            for start in range(0, len(page_ids), shard_size)]
+
+
+def _link_or_copy(src, dst):
+    """ Hardlink the file if possible, copy it otherwise. """
+    if not os.path.exists(src) or os.path.exists(dst):
+        return
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def create_shard_workspace(workspace, index, page_ids):
+    """
+    Create a workspace for one shard below the given workspace.
+
+    The shard gets its own mets.xml with only the files of its pages and
+    links to the local files, so every shard can run the chain without
+    touching the METS of the others and the processors don't have to parse
+    the files of all pages after every step. The processors are restricted
+    to the pages of the shard via `page_id` while running.
+    """
+    shard_dir = os.path.join(workspace.directory, SHARDS_DIR, str(index))
+    os.makedirs(shard_dir, exist_ok=True)
+    mets = OcrdMets(content=workspace.mets.to_xml())
+    prune_pages(mets, page_ids)
+    with open(os.path.join(shard_dir, "mets.xml"), "wb") as fh:
+        fh.write(mets.to_xml())
+
+    pages = file_pages(workspace.mets)
+    for ocrd_file in workspace.mets.find_files():
+        if pages.get(ocrd_file.ID) not in page_ids or not ocrd_file.local_filename:
+            continue
+        _link_or_copy(
+            os.path.join(workspace.directory, ocrd_file.local_filename),
+            os.path.join(shard_dir, ocrd_file.local_filename))
+
+    return Workspace(workspace.resolver, shard_dir)
+
+
+def merge_shard_workspace(workspace, shard_workspace, file_grps,
+                          agents=False):
+    """
+    Move the files of the given file groups from the shard into the
+    workspace and register them in its METS. With `agents` the agents the
+    processors added to the shard are copied as well, this is only needed
+    for one of the shards.
+    """
+    for file_grp in file_grps:
+        for ocrd_file in shard_workspace.mets.find_files(fileGrp=file_grp):
+            if ocrd_file.local_filename:
+                src = os.path.join(shard_workspace.directory,
+                                   ocrd_file.local_filename)
+                dst = os.path.join(workspace.directory,
+                                   ocrd_file.local_filename)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if os.path.exists(src):
+                    os.replace(src, dst)
+    merge_file_groups(workspace.mets, shard_workspace.mets, file_grps)
+    if agents:
+        merge_agents(workspace.mets, shard_workspace.mets)
+
+
+def remove_shard_workspaces(workspace):
+    """ Clean up the shard directories of the workspace. """
+    shutil.rmtree(os.path.join(workspace.directory, SHARDS_DIR),
+                  ignore_errors=True)
+
+
+@contextmanager
+def locked_workspace(directory, mets_basename="mets.xml"):
+    """
+    Load the workspace while holding the lock of its METS, the parallel
+    branches of a chain update it from different workers.
+    """
+    with open(os.path.join(directory, mets_basename + ".lock"), "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield Workspace(Resolver(), directory, mets_basename=mets_basename)
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def create_branch_workspace(workspace, index):
+    """
+    Create a workspace for the step with the given index running next to
+    other steps, with a copy of the METS and links to all local files.
+    """
+    branch_dir = os.path.join(workspace.directory, BRANCHES_DIR, str(index))
+    shutil.rmtree(branch_dir, ignore_errors=True)
+    os.makedirs(branch_dir)
+    with open(os.path.join(branch_dir, "mets.xml"), "wb") as fh:
+        fh.write(workspace.mets.to_xml())
+    for ocrd_file in workspace.mets.find_files():
+        if ocrd_file.local_filename:
+            _link_or_copy(
+                os.path.join(workspace.directory, ocrd_file.local_filename),
+                os.path.join(branch_dir, ocrd_file.local_filename))
+    return Workspace(workspace.resolver, branch_dir)
+
+
+def merge_branch_workspace(workspace, branch_workspace, file_grps, agents=0):
+    """
+    Move the output of the branch into the workspace, with the agents
+    the branch added after its first `agents` ones, and remove the branch.
+    Returns the bytes of the moved output.
+    """
+    merge_shard_workspace(workspace, branch_workspace, file_grps)
+    merge_agents(workspace.mets, branch_workspace.mets, start=agents)
+    shutil.rmtree(branch_workspace.directory, ignore_errors=True)
+    return sum(file_group_size(workspace, file_grp) for file_grp in file_grps)
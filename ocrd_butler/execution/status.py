@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+The state of the worker tasks, stored with the tasks in the database.
+
+The tasks page and the API read the state from here instead of asking
+Flower for every task. The Celery tasks of a chain get ids which contain
+the id of our task, so every Celery event can be related to its task
+without a lookup.
+"""
+
+from collections import deque
+from datetime import datetime
+import threading
+import time
+
+from flask import current_app
+
+from ocrd_butler.database import db
+from ocrd_butler.database.models import Task as db_model_Task
+
+
+IN_FLIGHT = ("PENDING", "STARTED", "RETRY")
+DONE = ("SUCCESS", "FAILURE", "REVOKED")
+# The same new task is attached to a task in these states.
+ATTACHABLE = ("SUCCESS",) + IN_FLIGHT
+
+
+def worker_task_id(task_id, run, role):
+    """
+    The Celery task id for the `role` ("prepare", "step<index>" or
+    "finish") of the task in the given run.
+    """
+    return "{0}-{1}-{2}".format(task_id, run, role)
+
+
+def parse_worker_task_id(uuid):
+    """ Get task id, run and role from a Celery task id, None if foreign. """
+    parts = (uuid or "").split("-")
+    if len(parts) != 3 or not parts[0].isdigit():
+        return None
+    return int(parts[0]), parts[1], parts[2]
+
+
+def update_task_status(task_id, status, **values):
+    """
+    Store the status of the task and the given values, e.g. the
+    timestamps `received`, `started` or `finished`.
+    """
+    task = db_model_Task.query.filter_by(id=task_id).first()
+    if task is None:
+        return None
+    task.status = status
+    for name, value in values.items():
+        setattr(task, name, value)
+    db.session.commit()
+    return task
+
+
+def existing_task(fingerprint, exclude=None, statuses=ATTACHABLE):
+    """
+    The newest task with the fingerprint in one of the `statuses`, other
+    than `exclude`. None if `TASK_DEDUPLICATE` is off.
+    """
+    if not current_app.config["TASK_DEDUPLICATE"]:
+        return None
+    query = db_model_Task.query.filter(
+        db_model_Task.fingerprint == fingerprint,
+        db_model_Task.status.in_(statuses))
+    if exclude is not None:
+        query = query.filter(db_model_Task.id != exclude)
+    return query.order_by(db_model_Task.id.desc()).first()
+
+
+def state_json(state):
+    """ The state for the API, with the timestamps as ISO strings. """
+    state = dict(state)
+    state.pop("run", None)
+    for name in ("received", "started", "finished", "updated"):
+        if state.get(name) is not None:
+            state[name] = state[name].isoformat()
+    return state
+
+
+class TaskStateStore():
+    """
+    In-memory snapshot of the state of the tasks, fed by Celery events.
+
+    Changed states are written to the database in batches by `flush`.
+    Every change is numbered and kept for a while, `changes` waits for the
+    next ones, e.g. to stream them to the browser.
+    """
+
+    def __init__(self, log_lines=200, changes=1000):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.states = {}
+        self.dirty = set()
+        self.logs = {}
+        self.log_lines = log_lines
+        self.sequence = 0
+        self.recent = deque(maxlen=changes)
+
+    def get(self, task_id):
+        """ The current state of the task, None if there was no event yet. """
+        with self.lock:
+            state = self.states.get(task_id)
+            return dict(state) if state is not None else None
+
+    def log(self, task_id):
+        """ The last log lines of the task. """
+        with self.lock:
+            return list(self.logs.get(task_id, ()))
+
+    def notify(self, task_id, kind, data):
+        """ Number and keep a change, wake up the waiting readers. """
+        self.sequence += 1
+        self.recent.append((self.sequence, task_id, kind, data))
+        self.changed.notify_all()
+
+    def changes(self, since, task_ids=None, timeout=None):
+        """
+        The changes after the number `since` for the given tasks (all if
+        None), wait up to `timeout` seconds for one if there is none yet.
+        Returns the changes as tuples of number, task id, kind and data,
+        and the number of the last change.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self.lock:
+            while True:
+                changes = [change for change in self.recent if change[0] > since
+                           and (task_ids is None or change[1] in task_ids)]
+                remaining = deadline - time.monotonic() if deadline else 0
+                if changes or remaining <= 0:
+                    return changes, self.sequence
+                self.changed.wait(remaining)
+
+    def handle(self, event):
+        """ Update the snapshot with a Celery task event. """
+        parsed = parse_worker_task_id(event.get("uuid"))
+        if parsed is None or not event.get("type", "").startswith("task-"):
+            return
+        task_id, run, role = parsed
+        timestamp = datetime.fromtimestamp(event.get("timestamp") or 0) \
+            if event.get("timestamp") else datetime.now()
+
+        with self.lock:
+            state = self.states.get(task_id)
+            if state is None or (state["run"] != run and role == "prepare"
+                                 and event["type"] == "task-received"):
+                state = self.states[task_id] = {
+                    "run": run, "status": None, "received": None,
+                    "started": None, "finished": None, "step": None,
+                    "progress": None, "exception": None}
+                self.logs.pop(task_id, None)
+            elif state["run"] != run:
+                # An event of a former run of the task.
+                return
+
+            if event["type"] == "task-received" and role == "prepare":
+                state.update(status="PENDING", received=timestamp)
+            elif event["type"] == "task-started":
+                state["status"] = "STARTED"
+                if role == "prepare":
+                    state["started"] = timestamp
+                elif role.startswith("step"):
+                    state["step"] = int(role[4:])
+            elif event["type"] == "task-succeeded" and role == "finish":
+                state.update(status="SUCCESS", finished=timestamp, step=None)
+            elif event["type"] == "task-failed" and state["status"] != "REVOKED":
+                state.update(status="FAILURE", finished=timestamp,
+                             exception=event.get("exception"))
+            elif event["type"] == "task-retried":
+                state["status"] = "RETRY"
+            elif event["type"] == "task-revoked":
+                state.update(status="REVOKED", finished=timestamp)
+            elif event["type"] == "task-progress":
+                state["progress"] = event.get("progress")
+                self.notify(task_id, "progress", state["progress"])
+                return
+            elif event["type"] == "task-log":
+                lines = self.logs.setdefault(task_id, deque(maxlen=self.log_lines))
+                lines.extend(event.get("lines", []))
+                self.notify(task_id, "log", {"lines": event.get("lines", [])})
+                return
+            else:
+                return
+            state["updated"] = timestamp
+            self.dirty.add(task_id)
+            self.notify(task_id, "status", state_json(state))
+
+    def flush(self):
+        """ Write the changed states to the database in one transaction. """
+        with self.lock:
+            states = {task_id: dict(self.states[task_id]) for task_id in self.dirty}
+            self.dirty = set()
+        if not states:
+            return 0
+
+        for task in db_model_Task.query.filter(db_model_Task.id.in_(states)):
+            state = states[task.id]
+            if state["status"] == "FAILURE" and task.status == "REVOKED":
+                # A stopped task fails on its termination, which may come
+                # before its revoked event, see `task_failure_handler`.
+                state["status"] = None
+                with self.lock:
+                    current = self.states.get(task.id)
+                    if current is not None and current["status"] == "FAILURE":
+                        current["status"] = "REVOKED"
+            if state["status"] is not None:
+                task.status = state["status"]
+            # The time of the dispatch is kept, not the one of the worker.
+            if state["received"] is not None and task.received is None:
+                task.received = state["received"]
+            for name in ("started", "finished"):
+                if state[name] is not None:
+                    setattr(task, name, state[name])
+        db.session.commit()
+        return len(states)
+
+
+def task_state(task, store=None):
+    """
+    The state of the task from the snapshot of the events if there is one,
+    otherwise from the database.
+    """
+    state = store.get(task.id) if store is not None else None
+    if state is None:
+        state = {
+            "status": task.status,
+            "received": task.received,
+            "started": task.started,
+            "finished": task.finished,
+            "step": None,
+            "progress": None,
+            "exception": None,
+        }
+    return state_json(state)
+
+
+def wait_for_tasks(store, tasks, until=None, timeout=60):
+    """
+    Wait until one of the tasks gets a status in `until`, or if `until` is
+    not given another or a final status, but at most `timeout` seconds.
+    The store wakes up the waiting request, there is no polling.
+
+    Returns the states of the tasks by id and the ids of the tasks which
+    reached the status.
+    """
+    since = store.sequence
+    states = {task.id: task_state(task, store) for task in tasks}
+    done = [task_id for task_id, state in states.items()
+            if until and state["status"] in until]
+    deadline = time.monotonic() + timeout
+    while not done:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        changes, since = store.changes(since, set(states), timeout=remaining)
+        for _, task_id, kind, data in changes:
+            if kind != "status":
+                continue
+            if until is not None:
+                reached = data["status"] in until
+            else:
+                # Not the start of the next step of a running task.
+                reached = (data["status"] != states[task_id]["status"] or
+                           data["status"] in DONE)
+            states[task_id] = data
+            if reached and task_id not in done:
+                done.append(task_id)
+    return states, done
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""Cache for the output file groups of processor calls."""
+
+import hashlib
+import json
+import os
+import time
+
+from ocrd_butler.execution.blob_cache import BlobCache
+from ocrd_butler.execution.mets import file_pages
+
+
+def step_key(step, workspace, page_ids=None):
+    """
+    Compute the cache key of a step from the contents of its input file
+    group, the processor executable and version and its parameters.
+    """
+    key = hashlib.sha256()
+    key.update(json.dumps({
+        "executable": step["executable"],
+        "version": step.get("version"),
+        "input_file_grp": step["input_file_grp"],
+        "output_file_grp": step["output_file_grp"],
+        "parameter": json.loads(step["parameter"]),
+    }, sort_keys=True).encode("utf-8"))
+
+    pages = file_pages(workspace.mets)
+    for ocrd_file in workspace.mets.find_files(fileGrp=step["input_file_grp"]):
+        page_id = pages.get(ocrd_file.ID)
+        if page_ids is not None and page_id not in page_ids:
+            continue
+        key.update("{0}|{1}|{2}".format(
+            ocrd_file.ID, page_id, ocrd_file.local_filename).encode("utf-8"))
+        if ocrd_file.local_filename:
+            with open(os.path.join(workspace.directory,
+                                   ocrd_file.local_filename), "rb") as fh:
+                for chunk in iter(lambda: fh.read(65536), b""):
+                    key.update(chunk)
+
+    return key.hexdigest()
+
+
+class StepCache(BlobCache):
+    """
+    Keep the output file groups of processor calls to reuse them for
+    tasks with the same input, processor and parameters.
+
+    The files are stored as blobs, a manifest per key lists the files of
+    the output file group. Entries are evicted by size (least recently
+    used blobs first) and by age.
+    """
+
+    def __init__(self, directory, max_size, max_age=30 * 86400):
+        super().__init__(directory, max_size, max_age=max_age)
+        with self._index() as index:
+            index.execute("""
+                CREATE TABLE IF NOT EXISTS steps (
+                    key TEXT PRIMARY KEY,
+                    manifest TEXT NOT NULL,
+                    created REAL NOT NULL)""")
+
+    @classmethod
+    def from_config(cls, config):
+        """ Create the cache from the app config, None if it is disabled. """
+        if not config.get("STEP_CACHE_DIR"):
+            return None
+        return cls(config["STEP_CACHE_DIR"],
+                   max_size=config["STEP_CACHE_MAX_SIZE"],
+                   max_age=config["STEP_CACHE_MAX_AGE"])
+
+    def lookup_step(self, key):
+        """ Get the manifest for the key or None for a miss. """
+        with self._index() as index:
+            row = index.execute(
+                "SELECT manifest, created FROM steps WHERE key = ?",
+                (key,)).fetchone()
+            manifest = row and json.loads(row[0])
+            if manifest is not None and (
+                    time.time() - row[1] > self.max_age or
+                    not all(os.path.exists(self.blob_path(f["sha256"]))
+                            for f in manifest)):
+                index.execute("DELETE FROM steps WHERE key = ?", (key,))
+                manifest = None
+            self._count(index, "step_misses" if manifest is None else "step_hits")
+        return manifest
+
+    def store_step(self, key, workspace, file_grp, page_ids=None):
+        """ Store the files of the output file group for the key. """
+        manifest = []
+        pages = file_pages(workspace.mets)
+        for ocrd_file in workspace.mets.find_files(fileGrp=file_grp):
+            page_id = pages.get(ocrd_file.ID)
+            if page_ids is not None and page_id not in page_ids:
+                continue
+            if not ocrd_file.local_filename:
+                continue
+            with open(os.path.join(workspace.directory,
+                                   ocrd_file.local_filename), "rb") as fh:
+                entry = self.store(
+                    "step:{0}/{1}".format(key, ocrd_file.ID),
+                    iter(lambda: fh.read(65536), b""))
+            manifest.append({
+                "ID": ocrd_file.ID,
+                "mimetype": ocrd_file.mimetype,
+                "pageId": page_id,
+                "local_filename": ocrd_file.local_filename,
+                "sha256": entry["sha256"],
+            })
+
+        with self._index() as index:
+            index.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?)",
+                          (key, json.dumps(manifest), time.time()))
+
+    def restore_step(self, manifest, workspace, file_grp):
+        """ Link the cached files into the workspace and add them to its METS. """
+        now = time.time()
+        with self._index() as index:
+            for ocrd_file in manifest:
+                index.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?",
+                              (now, ocrd_file["sha256"]))
+        for ocrd_file in manifest:
+            self.link(ocrd_file["sha256"],
+                      os.path.join(workspace.directory, ocrd_file["local_filename"]))
+            workspace.mets.add_file(
+                file_grp,
+                ID=ocrd_file["ID"],
+                mimetype=ocrd_file["mimetype"],
+                url=ocrd_file["local_filename"],
+                pageId=ocrd_file["pageId"],
+                local_filename=ocrd_file["local_filename"],
+                force=True)
+
+    def stats(self):
+        """ Counters and size of the cache with the hit rate of the steps. """
+        stats = super().stats()
+        stats.setdefault("step_hits", 0)
+        stats.setdefault("step_misses", 0)
+        lookups = stats["step_hits"] + stats["step_misses"]
+        stats["step_hit_rate"] = lookups and stats["step_hits"] / lookups or 0.0
+        return stats
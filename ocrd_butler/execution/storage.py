@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Placement of the workspaces of the tasks on the storage roots.
+
+Before the images of a task are downloaded, the footprint of its workspace
+is estimated from its pages: the images at the average size of the images
+of former tasks and the bytes per page each step of the chain wrote
+before. A step without any history counts as one more image per page if
+it does image preprocessing, else as nothing.
+
+The workspace goes to the root of `OCRD_BUTLER_STORAGE_ROOTS` with the most
+space left: its free disk without `STORAGE_HEADROOM` and the footprints of
+the other tasks in flight placed there. That's on the safe side, the parts
+of their workspaces which are written already count twice.
+
+With `OCRD_BUTLER_SCRATCH` the steps run in a local directory, if the
+footprint fits there as well, and the workspace is moved to its root when
+the task is finished.
+"""
+
+import os
+import shutil
+
+from sqlalchemy import func
+
+from ocrd_butler.api.processors import PROCESSORS_CONFIG
+from ocrd_butler.database import db
+from ocrd_butler.database.models import ProcessorCost as db_model_ProcessorCost
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.status import IN_FLIGHT
+
+# Number of former tasks for the average size of the images.
+IMAGE_HISTORY = 100
+
+
+def storage_roots(config):
+    """ The roots for the workspaces, `OCRD_BUTLER_RESULTS` if none are given. """
+    return config.get("OCRD_BUTLER_STORAGE_ROOTS") or [config["OCRD_BUTLER_RESULTS"]]
+
+
+def free_disk(path):
+    """
+    Free bytes on the file system of the path, which may not exist yet.
+    None if it's unknown.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+
+def most_free_disk(roots):
+    """ The free bytes of the root with the most, None if unknown. """
+    free = [space for space in map(free_disk, roots) if space is not None]
+    return max(free) if free else None
+
+
+def average_image_size(default):
+    """ The average bytes of an image of the last prepared tasks. """
+    tasks = db.session.query(db_model_Task.pages, db_model_Task.image_bytes).filter(
+        db_model_Task.image_bytes.isnot(None),
+        db_model_Task.pages > 0).order_by(
+            db_model_Task.id.desc()).limit(IMAGE_HISTORY).all()
+    pages = sum(task.pages for task in tasks)
+    if not pages:
+        return default
+    return sum(task.image_bytes for task in tasks) / float(pages)
+
+
+def image_step(processor):
+    """ Whether the processor writes images, after its `ocrd-tool.json`. """
+    return "Image preprocessing" in PROCESSORS_CONFIG.get(
+        processor, {}).get("categories", [])
+
+
+def estimate_footprint(processors, pages, image_size):
+    """
+    Estimate the bytes of a workspace with `pages` images of `image_size`
+    bytes and the output of the processors.
+    """
+    costs = {cost.processor: cost for cost in db_model_ProcessorCost.query.filter(
+        db_model_ProcessorCost.processor.in_(processors))}
+    footprint = pages * image_size
+    for processor in processors:
+        cost = costs.get(processor)
+        if cost is not None and cost.output_pages:
+            footprint += pages * cost.output_bytes / float(cost.output_pages)
+        elif image_step(processor):
+            footprint += pages * image_size
+    return int(footprint)
+
+
+def reserved_space(root=None, scratch=False, exclude=None):
+    """
+    The footprints of the tasks in flight placed on the root, or running
+    in the scratch directory, other than the task `exclude`.
+    """
+    query = db.session.query(func.sum(db_model_Task.footprint)).filter(
+        db_model_Task.status.in_(IN_FLIGHT))
+    if scratch:
+        query = query.filter(db_model_Task.scratch.is_(True))
+    else:
+        query = query.filter(db_model_Task.storage_root == root)
+    if exclude is not None:
+        query = query.filter(db_model_Task.id != exclude)
+    return query.scalar() or 0
+
+
+def available_space(path, reserved, headroom):
+    """ The bytes left for another workspace on the disk of the path. """
+    free = free_disk(path)
+    if free is None:
+        return None
+    return free - reserved - headroom
+
+
+def place_workspace(task_id, footprint, config):
+    """
+    The root for the workspace of the task with the given footprint and
+    whether its steps run in the scratch directory. The root is None if
+    the workspace fits nowhere now. A root with unknown free disk is only
+    used if no other one fits.
+    """
+    headroom = config["STORAGE_HEADROOM"]
+    root = None
+    left = None
+    for candidate in storage_roots(config):
+        space = available_space(
+            candidate, reserved_space(candidate, exclude=task_id), headroom)
+        if space is None:
+            space = footprint
+        if space >= footprint and (left is None or space > left):
+            root = candidate
+            left = space
+
+    scratch = False
+    if root is not None and config["OCRD_BUTLER_SCRATCH"]:
+        space = available_space(
+            config["OCRD_BUTLER_SCRATCH"],
+            reserved_space(scratch=True, exclude=task_id), headroom)
+        scratch = space is not None and space >= footprint
+    return root, scratch
+
+
+def workspace_directories(task, config):
+    """ Where the workspace of the task may be, the scratch directory first. """
+    roots = []
+    if config["OCRD_BUTLER_SCRATCH"]:
+        roots.append(config["OCRD_BUTLER_SCRATCH"])
+    if task.get("storage_root"):
+        roots.append(task["storage_root"])
+    roots.extend(storage_roots(config))
+
+    directories = []
+    for root in roots:
+        directory = os.path.abspath(os.path.join(root, task["uid"]))
+        if directory not in directories:
+            directories.append(directory)
+    return directories
+
+
+def existing_workspace(task, config, mets_basename):
+    """ The directory of the workspace of a former run, None if there's none. """
+    for directory in workspace_directories(task, config):
+        if os.path.exists(os.path.join(directory, mets_basename)):
+            return directory
+    return None
+
+
+def move_workspace(source, destination):
+    """ Move the workspace, an old one at the destination is replaced. """
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return destination
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    shutil.move(source, destination)
+    return destination
@@ -2,30 +2,89 @@
 
 """Celery tasks definitions."""
 
-import json
+from concurrent.futures import (
+    as_completed,
+    ThreadPoolExecutor
+)
+from datetime import datetime
+from functools import partial
 import os
-import subprocess
+import shutil
+import threading
+import time
 import uuid
 
 from flask import current_app
 
-from celery import shared_task
+from celery import (
+    chain,
+    group
+)
 
 from celery.signals import (
     task_failure,
     task_postrun,
     task_prerun,
     task_success,
+    worker_process_init,
 )
 
 from ocrd.resolver import Resolver
-from ocrd.processor.base import run_cli
+from ocrd.workspace import Workspace
+from ocrd_utils import is_local_filename
 
 from ocrd_butler import celery
-from ocrd_butler.api.processors import PROCESSORS_ACTION
+from ocrd_butler.api.processors import PROCESSORS_CONFIG
 from ocrd_butler.database import db
-from ocrd_butler.database.models import Chain as db_model_Chain
 from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.accounting import (
+    combine_parallel,
+    run_processor_cli,
+    usage
+)
+from ocrd_butler.execution.checkpoints import (
+    finish_step,
+    start_step,
+    valid_steps
+)
+from ocrd_butler.execution import (
+    plans,
+    processes
+)
+from ocrd_butler.execution.costs import (
+    image_megapixels,
+    parallel_shards,
+    record_step_cost
+)
+from ocrd_butler.execution.daemons import daemon_pool
+from ocrd_butler.execution.download import WorkspaceDownloader
+from ocrd_butler.execution.shards import (
+    create_branch_workspace,
+    create_shard_workspace,
+    file_group_size,
+    locked_workspace,
+    merge_branch_workspace,
+    merge_shard_workspace,
+    page_shards,
+    remove_shard_workspaces
+)
+from ocrd_butler.execution.status import (
+    parse_worker_task_id,
+    update_task_status,
+    worker_task_id
+)
+from ocrd_butler.execution.step_cache import (
+    StepCache,
+    step_key
+)
+from ocrd_butler.execution.storage import (
+    average_image_size,
+    estimate_footprint,
+    existing_workspace,
+    move_workspace,
+    place_workspace,
+    storage_roots
+)
 
 
 
@@ -39,89 +98,579 @@ def task_postrun_handler(task_id, task, *args, **kwargs):
 
 @task_success.connect
 def task_success_handler(sender, result, **kwargs):
-    task = db_model_Task.query.filter_by(id=result["task_id"]).first()
-    task.status = "SUCCESS"
-    task.results = result
-    db.session.commit()
-    current_app.logger.info("Success on task id: '{0}', worker task id: {1}.",
-                            task.id, task.worker_task_id)
+    # Only the last task of the chain has the results.
+    if sender.name != finish_task.name:
+        return
+    with sender.app_context():
+        task = db_model_Task.query.filter_by(id=result["task_id"]).first()
+        task.status = "SUCCESS"
+        task.results = result
+        task.finished = datetime.now()
+        db.session.commit()
+        current_app.logger.info(
+            "Success on task id: '{0}', worker task id: {1}.".format(
+                task.id, task.worker_task_id))
 
 @task_failure.connect
-def task_failure_handler(sender, result, **kwargs):
-    task = db_model_Task.query.filter_by(id=result["task_id"]).first()
-    task.status = "FAILURE"
-    db.session.commit()
-    current_app.logger.info("Failure on task id: '{0}', worker task id: {1}.",
-                            task.id, task.worker_task_id)
+def task_failure_handler(sender, task_id, exception, *args, **kwargs):
+    # Any task of the chain can fail, its id contains the id of our task.
+    parsed = parse_worker_task_id(task_id)
+    if parsed is None:
+        return
+    with sender.app_context():
+        task = db_model_Task.query.filter_by(id=parsed[0]).first()
+        if task is None or task.status == "REVOKED":
+            # A stopped task fails on its termination.
+            return
+        update_task_status(parsed[0], "FAILURE", finished=datetime.now())
+        current_app.logger.info(
+            "Failure on task id: '{0}', worker task id: {1}: {2}".format(
+                parsed[0], task_id, exception))
+
+
+@worker_process_init.connect
+def worker_process_init_handler(**kwargs):
+    # Stopping a task terminates the worker process, kill its processors.
+    processes.install_handler()
+
+
+def report_progress(worker_task, stage, **info):
+    """
+    Store the progress of the running stage on the worker task and send it
+    as event to the app.
+    """
+    if worker_task.request.id is None or worker_task.request.is_eager:
+        return
+    meta = {"stage": stage}
+    meta.update(info)
+    worker_task.update_state(state="PROGRESS", meta=meta)
+    worker_task.send_event("task-progress", progress=meta)
+
+
+class LogSender():
+    """
+    Send the output lines of the processors as `task-log` events, collected
+    for `interval` seconds. The lines may come from parallel shards.
+    """
+
+    def __init__(self, worker_task, interval):
+        self.worker_task = worker_task
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.lines = []
+        self.sent = time.time()
+
+    def __call__(self, line):
+        with self.lock:
+            self.lines.append(line)
+            if time.time() - self.sent >= self.interval:
+                self._send()
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        lines, self.lines = self.lines, []
+        self.sent = time.time()
+        if not lines or self.worker_task.request.id is None \
+                or self.worker_task.request.is_eager:
+            return
+        try:
+            self.worker_task.send_event("task-log", lines=lines)
+        except Exception as exc:  # pylint: disable=broad-except
+            current_app.logger.warning(
+                "Can't send the log lines: {0}".format(exc))
+
+
+def task_shard_size(task):
+    """
+    Get the shard size of the task, the chain or the default one. 0 runs
+    the chain on all pages at once.
+    """
+    if task.get("shard_size") is not None:
+        return task["shard_size"]
+    if task["chain"].get("shard_size") is not None:
+        return task["chain"]["shard_size"]
+    return current_app.config["TASK_SHARD_SIZE"]
+
+
+def step_result(step, cached=False, step_usage=None):
+    """ The result of a step with the resources its processor used. """
+    result = {
+        "index": step["index"],
+        "processor": step["processor"],
+        "cached": cached,
+    }
+    result.update(step_usage or usage())
+    return result
+
+
+def run_steps(steps, workspace, page_id=None, task_id=None,
+              step_cache=None, daemons=None, log=None):
+    """
+    Run the given steps one after another on the workspace.
+    The steps are recorded for the task if a `task_id` is given.
+    With a `step_cache` the output of a step is reused if the same
+    processor already ran with the same input and parameters.
+    Processors served by the `daemons` pool are not started as CLI,
+    the output lines of the others are passed to `log`.
+    Returns the results of the steps, see `step_result`.
+    """
+    page_ids = page_id.split(",") if page_id else None
+    results = []
+
+    for step in steps:
+        if task_id is not None:
+            task_step = start_step(task_id, step)
+
+        if step_cache is not None:
+            started = time.time()
+            key = step_key(step, workspace, page_ids)
+            manifest = step_cache.lookup_step(key)
+            if manifest is not None:
+                step_cache.restore_step(manifest, workspace, step["output_file_grp"])
+                workspace.save_mets()
+                step_usage = usage(wall_time=time.time() - started)
+                results.append(step_result(step, True, step_usage))
+                if task_id is not None:
+                    finish_step(task_step, cached=True, step_usage=step_usage)
+                continue
+
+        if daemons is not None and daemons.supports(step["executable"]):
+            run = daemons.run
+        else:
+            run = partial(run_processor_cli, log=log)
+        returncode, step_usage = run(
+            step["executable"],
+            mets_url=workspace.mets_target,
+            working_dir=workspace.directory,
+            page_id=page_id,
+            log_level="DEBUG",
+            input_file_grp=step["input_file_grp"],
+            output_file_grp=step["output_file_grp"],
+            parameter=step["parameter"])
+
+        if returncode != 0:
+            if task_id is not None:
+                finish_step(task_step, status="FAILURE", step_usage=step_usage)
+            raise Exception("Processor {0} failed with exit code {1}.".format(
+                step["processor"], returncode))
+
+        # reload mets
+        workspace.reload_mets()
+
+        if step_cache is not None:
+            step_cache.store_step(key, workspace, step["output_file_grp"],
+                                  page_ids)
+
+        results.append(step_result(step, False, step_usage))
+        if task_id is not None:
+            finish_step(task_step, step_usage=step_usage)
+
+    return results
+
+
+def run_sharded_steps(steps, workspace, file_grp, shard_size,
+                      task_id=None, step_cache=None, daemons=None, log=None,
+                      progress=None):
+    """
+    Run the steps on page shards of the workspace in parallel and merge
+    the results back into the METS of the workspace.
+    `progress` is called with the number of finished and of all shards.
+    The steps are recorded for the task as a whole if a `task_id` is given.
+    Returns the results of the steps with the resources of all shards
+    (the wall time is the one of the slowest shard), a step counts as
+    cached if it was cached for all shards.
+    """
+    shards = page_shards(workspace, file_grp, shard_size)
+    shard_workspaces = [
+        create_shard_workspace(workspace, index, page_ids)
+        for index, page_ids in enumerate(shards)]
+
+    task_steps = []
+    if task_id is not None:
+        task_steps = [start_step(task_id, step) for step in steps]
+
+    max_workers = max(1, min(len(shards),
+                             current_app.config["TASK_SHARD_WORKERS"]))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(run_steps, steps, shard_workspace,
+                                ",".join(page_ids), step_cache=step_cache,
+                                daemons=daemons, log=log)
+                for shard_workspace, page_ids in zip(shard_workspaces, shards)]
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress is not None:
+                    progress(done, len(futures))
+            shard_results = [future.result() for future in futures]
+    except Exception:
+        for task_step in task_steps:
+            finish_step(task_step, status="FAILURE")
+        raise
+
+    output_file_grps = [step["output_file_grp"] for step in steps]
+    for index, shard_workspace in enumerate(shard_workspaces):
+        merge_shard_workspace(workspace, shard_workspace, output_file_grps,
+                              agents=index == 0)
+    workspace.save_mets()
+    remove_shard_workspaces(workspace)
+
+    results = []
+    for position, step in enumerate(steps):
+        step_results = [shard[position] for shard in shard_results]
+        step_usage = combine_parallel(step_results)
+        cached = bool(step_results) and all(r["cached"] for r in step_results)
+        results.append(step_result(step, cached, step_usage))
+        if task_steps:
+            finish_step(task_steps[position], cached=cached,
+                        step_usage=step_usage)
+
+    return results
+
+
+def step_queue(step):
+    """
+    Get the queue for the step from `PROCESSOR_QUEUES`, looked up by the
+    processor name, its package and its categories, or the default queue.
+    """
+    queues = current_app.config["PROCESSOR_QUEUES"]
+    processor = PROCESSORS_CONFIG.get(step["processor"], {})
+    keys = [step["processor"], processor.get("package", {}).get("name")]
+    keys.extend(processor.get("categories", []))
+    for key in keys:
+        if key in queues:
+            return queues[key]
+    return current_app.config["PROCESSOR_DEFAULT_QUEUE"]
+
+
+def celery_priority(priority):
+    """
+    The priority of the Celery messages for the priority of a task. With
+    Redis as broker 0 is the highest one, for our tasks it's 9.
+    """
+    if priority is None:
+        priority = current_app.config["TASK_DEFAULT_PRIORITY"]
+    return 9 - priority
+
+
+def task_chain(task, resume=False):
+    """
+    Build the Celery chain for the task: the preparation of the workspace,
+    one task per step routed to the queue of its processor and the final
+    task with the results. The steps of the same level of a graph run as
+    group, the next step waits for all of them.
+
+    The Celery task ids contain the id of the task, a new one for every
+    run, and the role of the Celery task, see `worker_task_id`.
+    """
+    run = uuid.uuid4().hex[:8]
+    priority = celery_priority(task.get("priority"))
+    signatures = [prepare_task.s(task, resume=resume).set(
+        queue=current_app.config["PROCESSOR_DEFAULT_QUEUE"],
+        task_id=worker_task_id(task["id"], run, "prepare"),
+        priority=priority)]
+    for level in plans.plan_levels(plans.task_steps(task)):
+        # The steps of a level are parallel branches.
+        level_signatures = [run_step.s(step["index"]).set(
+            queue=step_queue(step),
+            task_id=worker_task_id(task["id"], run, "step{0}".format(step["index"])),
+            priority=priority) for step in level]
+        if len(level_signatures) == 1:
+            signatures.extend(level_signatures)
+        else:
+            signatures.append(group(level_signatures))
+    signatures.append(finish_task.s().set(
+        queue=current_app.config["PROCESSOR_DEFAULT_QUEUE"],
+        task_id=worker_task_id(task["id"], run, "finish"),
+        priority=priority))
+    return chain(*signatures)
+
+
+def run_task(task, resume=False):
+    """
+    Run the chain of the task, every step as its own Celery task.
+    Returns the result of the last task of the chain.
+
+    With `resume` an existing workspace of the task is reused and the
+    steps that are already done are skipped.
+    """
+    return task_chain(task, resume=resume).apply_async()
+
+
+def run_tasks(tasks, resume=False):
+    """
+    Run the chains of many tasks with one Celery group.
+    Returns the results of the last tasks of the chains, in order.
+    """
+    return group(task_chain(task, resume=resume) for task in tasks).apply_async().results
+
+
+def stop_task(task):
+    """
+    Revoke the Celery tasks of the current run of the task, the running
+    one is terminated with its processors.
+    Returns the ids of the revoked Celery tasks.
+    """
+    parsed = parse_worker_task_id(task["worker_task_id"])
+    if parsed is None:
+        return []
+    roles = ["prepare"]
+    roles.extend("step{0}".format(index)
+                 for index in range(len(task["chain"]["processors"])))
+    roles.append("finish")
+    worker_task_ids = [worker_task_id(task["id"], parsed[1], role)
+                       for role in roles]
+    celery.control.revoke(worker_task_ids, terminate=True, signal="SIGTERM")
+    return worker_task_ids
+
+
+def merge_contexts(context):
+    """
+    A step after parallel branches gets the list of their contexts, merge
+    the results of their steps into one context.
+    """
+    if isinstance(context, dict):
+        return context
+    merged = context[0]
+    stage = merged["stages"]["steps"]
+    indexes = {result["index"] for result in stage["processors"]}
+    for other in context[1:]:
+        for result in other["stages"]["steps"]["processors"]:
+            if result["index"] not in indexes:
+                stage["processors"].append(result)
+                indexes.add(result["index"])
+    stage["cache_hits"] = len([result for result in stage["processors"]
+                               if result["cached"]])
+    return merged
+
 
 @celery.task(bind=True)
-def run_task(self, task):
-    """ Create a task an run the given chain. """
+def prepare_task(self, task, resume=False):
+    """
+    Create the workspace of the task and download its images. A new
+    workspace is placed on a storage root where its estimated footprint
+    fits, if there's none the task is retried later, see `storage`.
+
+    Returns the context for the steps: the task, the directory of the
+    workspace for the steps and the one it's stored in at the end, and
+    the steps which still have to run.
+    """
+    config = current_app.config
+    update_task_status(task["id"], "STARTED", started=datetime.now())
+
     # TODO: Check if there is the active problem in olena_binarize with
     #       other basenames than mets.xml.
     # mets_basename = "{}.xml".format(task["id"])
     mets_basename = "mets.xml"
 
-    # Create workspace
-    dst_dir = "{}/{}".format(current_app.config["OCRD_BUTLER_RESULTS"],
-                             task["uid"])
-
+    downloader = WorkspaceDownloader.from_config(config)
     resolver = Resolver()
-    workspace = resolver.workspace_from_url(
-        task["src"],
-        dst_dir=dst_dir,
-        mets_basename=mets_basename,
-        clobber_mets=True
-    )
 
-    for file_name in workspace.mets.find_files(fileGrp=task["default_file_grp"]):
-        if not file_name.local_filename:
-            workspace.download_file(file_name)
+    dst_dir = existing_workspace(task, config, mets_basename) if resume else None
+    resume = dst_dir is not None
+    if resume:
+        # The workspace stays where it is.
+        storage_dir = dst_dir
+        scratch = config["OCRD_BUTLER_SCRATCH"]
+        if scratch and os.path.dirname(dst_dir) == os.path.abspath(scratch):
+            storage_dir = os.path.join(
+                task.get("storage_root") or storage_roots(config)[0],
+                task["uid"])
+        workspace = Workspace(resolver, dst_dir, mets_basename=mets_basename)
+    else:
+        # Only the METS until the workspace is placed.
+        dst_dir = os.path.join(storage_roots(config)[0], task["uid"])
+        clobber_mets = True
+        if downloader.cache is not None and not is_local_filename(task["src"]):
+            # Get the METS through the cache, the resolver keeps an existing file.
+            downloader.fetch(task["src"], os.path.join(dst_dir, mets_basename),
+                             copy=True)
+            clobber_mets = False
+
+        workspace = resolver.workspace_from_url(
+            task["src"],
+            dst_dir=dst_dir,
+            mets_basename=mets_basename,
+            clobber_mets=clobber_mets
+        )
+
+        footprint = estimate_footprint(
+            task["chain"]["processors"],
+            len(workspace.mets.find_files(fileGrp=task["default_file_grp"])),
+            average_image_size(config["STORAGE_DEFAULT_IMAGE_SIZE"]))
+        root, scratch = place_workspace(task["id"], footprint, config)
+        if root is None:
+            shutil.rmtree(dst_dir, ignore_errors=True)
+            current_app.logger.info(
+                "No space for the {0} bytes of task '{1}', queued again.".format(
+                    footprint, task["id"]))
+            update_task_status(task["id"], "RETRY", footprint=footprint,
+                               storage_root=None, scratch=False)
+            raise self.retry(countdown=config["STORAGE_RETRY_INTERVAL"],
+                             max_retries=None)
+        update_task_status(task["id"], "STARTED", footprint=footprint,
+                           storage_root=root, scratch=scratch)
+
+        storage_dir = os.path.join(root, task["uid"])
+        work_dir = storage_dir
+        if scratch:
+            work_dir = os.path.join(config["OCRD_BUTLER_SCRATCH"], task["uid"])
+        if work_dir != dst_dir:
+            dst_dir = move_workspace(dst_dir, work_dir)
+            workspace = Workspace(resolver, dst_dir, mets_basename=mets_basename)
+
+    files = [file_name for file_name in
+             workspace.mets.find_files(fileGrp=task["default_file_grp"])
+             if not file_name.local_filename]
 
+    def download_progress(pages, pages_total, size):
+        report_progress(self, "download", pages=pages,
+                        pages_total=pages_total, bytes=size)
+
+    download_stats = downloader.download(
+        workspace, files, progress=download_progress)
     workspace.save_mets()
+    current_app.logger.info(
+        "Downloaded {0} files ({1} bytes) for task '{2}' in {3}s.".format(
+            download_stats["pages"], download_stats["bytes"], task["id"],
+            download_stats["seconds"]))
 
-    # TODO: Steps could be saved along the other task information to get a
-    # more informational task.
-    for index, processor_name in enumerate(task["chain"]["processors"]):
-        if index == 0:
-            input_file_grp = task["default_file_grp"]
-        else:
-            previous_processor = PROCESSORS_ACTION[task["chain"]["processors"][index-1]]
-            input_file_grp = previous_processor["output_file_grp"]
-
-        processor = PROCESSORS_ACTION[processor_name]
-
-        # Its possible to override the default parameters of the processor
-        # via chain or task.
-        kwargs = {"parameter": {}}
-        if "parameters" in processor:
-            kwargs["parameter"] = processor["parameters"]
-        if processor_name in task["chain"]["parameters"]:
-            kwargs["parameter"].update(task["chain"]["parameters"][processor_name])
-        if processor_name in task["parameters"]:
-            kwargs["parameter"].update(task["parameters"][processor_name])
-        parameter = json.dumps(kwargs["parameter"])
-
-        # TODO: Add validation of the parameters.
-
-        mets_url = "{}/mets.xml".format(dst_dir)
-        run_cli(
-            processor["executable"],
-            mets_url=mets_url,
-            resolver=resolver,
-            workspace=workspace,
-            log_level="DEBUG",
-            input_file_grp=input_file_grp,
-            output_file_grp=processor["output_file_grp"],
-            parameter=parameter)
+    images = workspace.mets.find_files(fileGrp=task["default_file_grp"])
+    pages = len(images)
+    megapixels = image_megapixels(workspace, images)
+    update_task_status(task["id"], "STARTED", pages=pages, megapixels=megapixels,
+                       image_bytes=file_group_size(workspace, task["default_file_grp"]))
 
-        # reload mets
-        workspace.reload_mets()
+    steps = plans.task_steps(task)
+
+    if resume:
+        done = valid_steps(task["id"], steps, workspace)
+        current_app.logger.info(
+            "Resume task '{0}', skipping {1} of {2} steps.".format(
+                task["id"], done, len(steps)))
+        steps = steps[done:]
 
-        current_app.logger.info("Finished processing task '{0}'.", task["id"])
+    # Clean up output of former runs of the remaining steps.
+    for step in steps:
+        if step["output_file_grp"] in workspace.mets.file_groups:
+            workspace.remove_file_group(
+                step["output_file_grp"], recursive=True, force=True)
+    workspace.save_mets()
 
     return {
-        "task_id": task["id"],
+        "task": task,
         "result_dir": dst_dir,
-        "status": "SUCCESS"
+        "storage_dir": storage_dir,
+        "mets_basename": mets_basename,
+        "pages": pages,
+        "megapixels": megapixels,
+        "steps": steps,
+        "stages": {
+            "download": download_stats,
+            "steps": {
+                "steps": len(steps),
+                "cache_hits": 0,
+                "processors": [],
+            },
+        },
+    }
+
+
+@celery.task(bind=True)
+def run_step(self, context, index):
+    """
+    Run the step with the given index of the chain on the workspace
+    prepared by `prepare_task`. Steps which are already done are skipped.
+    A branch runs on its own copy of the workspace, its output is merged
+    into the workspace afterwards.
+    """
+    context = merge_contexts(context)
+    steps = [step for step in context["steps"] if step["index"] == index]
+    if not steps:
+        return context
+
+    task = context["task"]
+    report_progress(self, "step", index=index, processor=steps[0]["processor"])
+
+    branch = steps[0].get("branch")
+    if branch:
+        with locked_workspace(context["result_dir"],
+                              context["mets_basename"]) as main_workspace:
+            workspace = create_branch_workspace(main_workspace, index)
+        agents = len(workspace.mets.agents)
+    else:
+        workspace = Workspace(Resolver(), context["result_dir"],
+                              mets_basename=context["mets_basename"])
+    step_cache = StepCache.from_config(current_app.config)
+    daemons = daemon_pool(current_app.config)
+    log = LogSender(self, current_app.config["TASK_LOG_INTERVAL"])
+
+    def shard_progress(shards, shards_total):
+        report_progress(self, "step", index=index,
+                        processor=steps[0]["processor"],
+                        shards=shards, shards_total=shards_total)
+
+    shard_size = task_shard_size(task)
+    try:
+        if shard_size:
+            results = run_sharded_steps(
+                steps, workspace, task["default_file_grp"], shard_size,
+                task_id=task["id"], step_cache=step_cache, daemons=daemons,
+                log=log, progress=shard_progress)
+        else:
+            results = run_steps(steps, workspace, task_id=task["id"],
+                                step_cache=step_cache, daemons=daemons, log=log)
+    finally:
+        log.flush()
+
+    if branch:
+        # The branch workspace is gone afterwards.
+        with locked_workspace(context["result_dir"],
+                              context["mets_basename"]) as main_workspace:
+            output_bytes = merge_branch_workspace(
+                main_workspace, workspace, [steps[0]["output_file_grp"]], agents)
+            main_workspace.save_mets()
+    else:
+        output_bytes = file_group_size(workspace, steps[0]["output_file_grp"])
+
+    parallel = parallel_shards(context["pages"], shard_size)
+    for result in results:
+        if result["cached"]:
+            continue
+        try:
+            record_step_cost(result["processor"], result["wall_time"],
+                             context["pages"], context["megapixels"], parallel,
+                             output_bytes=output_bytes)
+        except Exception as exc:  # pylint: disable=broad-except
+            db.session.rollback()
+            current_app.logger.warning(
+                "Can't record the cost of {0}: {1}".format(
+                    result["processor"], exc))
+
+    stage = context["stages"]["steps"]
+    stage["cache_hits"] += len([result for result in results if result["cached"]])
+    stage["processors"].extend(results)
+    return context
+
+
+@celery.task(bind=True)
+def finish_task(self, context):
+    """
+    Collect the results of the task, a workspace in the scratch directory
+    is moved to its storage root.
+    """
+    context = merge_contexts(context)
+    result_dir = context.get("storage_dir", context["result_dir"])
+    move_workspace(context["result_dir"], result_dir)
+    current_app.logger.info("Finished processing task '{0}'.",
+                            context["task"]["id"])
+
+    return {
+        "task_id": context["task"]["id"],
+        "result_dir": result_dir,
+        "status": "SUCCESS",
+        "stages": context["stages"],
     }
@@ -9,16 +9,24 @@ from flask import Blueprint
 from flask_bootstrap import Bootstrap
 
 from ocrd_butler.api.chains import chain_namespace
+from ocrd_butler.api.collections import collection_namespace
 from ocrd_butler.api.tasks import task_namespace
 from ocrd_butler.api.restx import api
 from ocrd_butler.celery_utils import init_celery
 from ocrd_butler.database import db
+from ocrd_butler.execution.dispatcher import start_dispatcher
+from ocrd_butler.execution.events import (
+    init_task_events,
+    start_task_events
+)
+from ocrd_butler.execution.storage import storage_roots
 from ocrd_butler.frontend import frontend_blueprint
 from ocrd_butler.frontend.processors import processors_blueprint
 from ocrd_butler.frontend.chains import chains_blueprint
 from ocrd_butler.frontend.tasks import tasks_blueprint
 from ocrd_butler.frontend.compare import compare_blueprint
 from ocrd_butler.frontend.nav import nav
+from ocrd_butler.metrics import init_metrics
 
 PKG_NAME = os.path.dirname(os.path.realpath(__file__)).split("/")[-1]
 
@@ -65,6 +73,7 @@ def initialize_app(app):
 
     api.add_namespace(task_namespace)
     api.add_namespace(chain_namespace)
+    api.add_namespace(collection_namespace)
 
     Bootstrap(app)
     nav.init_app(app)
@@ -77,5 +86,19 @@ def initialize_app(app):
     db.init_app(app)
     db.create_all(app=app)
 
-    if not os.path.exists(app.config["OCRD_BUTLER_RESULTS"]):
-        os.makedirs(app.config["OCRD_BUTLER_RESULTS"])
+    init_metrics(app)
+    init_task_events(app)
+
+    for root in storage_roots(app.config):
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+
+def start_background(app):
+    """
+    Start the threads following the task events and dispatching the
+    collections. Only the process serving the app runs them, the workers
+    build the app as well.
+    """
+    start_task_events(app)
+    start_dispatcher(app)
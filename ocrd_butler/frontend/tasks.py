@@ -2,10 +2,6 @@
 Routes for the tasks.
 """
 
-from datetime import (
-    datetime,
-    timedelta
-)
 import io
 import glob
 import json
@@ -18,7 +14,6 @@ import requests
 
 from flask import (
     Blueprint,
-    current_app,
     flash,
     redirect,
     render_template,
@@ -40,17 +35,24 @@ from wtforms.validators import (
     URL
 )
 
+from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager
+
 from ocrd.processor.base import run_cli
 from ocrd.resolver import Resolver
 
-from ocrd_butler.api.processors import PROCESSORS_ACTION
 from ocrd_butler.database.models import Chain as db_model_Chain
 from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.execution.admission import queue_pressure
+from ocrd_butler.execution.plans import final_output_file_grp
 from ocrd_butler.util import host_url
 
 
 tasks_blueprint = Blueprint("tasks_blueprint", __name__)
 
+# Most tasks on one page of the tasks, each one is rendered with its steps.
+MAX_PER_PAGE = 200
+
 
 @tasks_blueprint.app_template_filter('format_date')
 def _jinja2_filter_format_date(date, fmt="%d.%m.%Y, %H:%M"):
@@ -60,42 +62,68 @@ def _jinja2_filter_format_date(date, fmt="%d.%m.%Y, %H:%M"):
 def _jinja2_filter_format_delta(delta):
     return delta.__str__()
 
+@tasks_blueprint.app_template_filter('format_size')
+def _jinja2_filter_format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "{0:.0f} {1}".format(size, unit)
+        size /= 1024
+    return "{0:.1f} GiB".format(size)
 
-def task_information(uid):
+
+def task_step_results(task):
     """
-    Get information for the task based on its uid.
+    Get the time and memory used by the steps of the task.
     """
-    if uid is None:
-        return None
+    results = task.results or {}
+    return results.get("stages", {}).get("steps", {}).get("processors", [])
 
-    response = requests.get("http://localhost:5555/api/task/info/{0}".format(uid))
-    if response.status_code == 404:
-        current_app.logger.warning("Can't find task '{0}'".format(uid))
-        return None
-    try:
-        task_info = json.loads(response.content)
-    except json.decoder.JSONDecodeError as exc:
-        current_app.logger.error("Can't read response for task '{0}'. ({1})".format(
-            uid, exc.__str__()))
-        return None
 
-    task_info["ready"] = task_info["state"] == "SUCCESS"
-    if task_info["result"] is not None:
-        task_info["result"] = json.loads(task_info["result"].replace("'", '"'))
+TASK_SORT_COLUMNS = {
+    "id": db_model_Task.id,
+    "description": db_model_Task.description,
+    "status": db_model_Task.status,
+    "chain": db_model_Chain.name,
+    "received": db_model_Task.received,
+    "started": db_model_Task.started,
+    "finished": db_model_Task.finished,
+}
 
-    return task_info
 
+def task_query(args):
+    """
+    Query the tasks with their chains in one go, filtered by `status`
+    and a search term `q` in description, uid and source and sorted by
+    `sort` in `order`.
+    """
+    query = db_model_Task.query.outerjoin(db_model_Task.chain).options(
+        contains_eager(db_model_Task.chain))
 
-def current_tasks():
+    if args.get("status"):
+        query = query.filter(db_model_Task.status == args["status"])
+    if args.get("q"):
+        term = "%{0}%".format(args["q"])
+        query = query.filter(or_(
+            db_model_Task.description.ilike(term),
+            db_model_Task.uid.ilike(term),
+            db_model_Task.src.ilike(term)))
+
+    column = TASK_SORT_COLUMNS.get(args.get("sort"), db_model_Task.id)
+    if args.get("order") == "asc":
+        return query.order_by(column.asc(), db_model_Task.id.asc())
+    return query.order_by(column.desc(), db_model_Task.id.desc())
+
+
+def current_tasks(page=1, per_page=50, args=None):
     """
-    Collect and prepare the current tasks.
+    Collect and prepare one page of the tasks.
     """
-    results = db_model_Task.query.all()
+    pagination = task_query(args or {}).paginate(
+        page=page, per_page=per_page, error_out=False)
 
     cur_tasks = []
 
-    for result in results:
-        chain = db_model_Chain.query.filter_by(id=result.chain_id).first()
+    for result in pagination.items:
         task = {
             "repr": result.__str__(),
             "description": result.description,
@@ -103,46 +131,32 @@ def current_tasks():
             "uid": result.uid,
             "src": result.src,
             "default_file_grp": result.default_file_grp,
-            "chain": chain,
+            "chain": result.chain,
             "parameters": result.parameters,
             "worker_task_id": result.worker_task_id,
+            "steps": task_step_results(result),
             "result": {
-                "status": "",
-                "ready": False,
+                "status": result.status,
+                "ready": result.status == "SUCCESS",
                 "page": "",
                 "alto": "",
                 "text": "",
-                "received": "",
-                "started": "",
+                "received": result.received or "",
+                "started": result.started or "",
                 "succeeded": "",
                 "runtime": ""
             }
         }
 
-        task_info = task_information(result.worker_task_id)
-
-        if task_info is not None and task_info["ready"]:
+        if task["result"]["ready"]:
             task["result"].update({
                 "page": "/download/page/{}".format(result.worker_task_id),
                 "alto": "/download/alto/{}".format(result.worker_task_id),
                 "txt": "/download/txt/{}".format(result.worker_task_id),
+                "succeeded": result.finished or "",
             })
-
-            if task_info["received"] is not None:
-                task["result"].update({
-                    "received": datetime.fromtimestamp(task_info["received"])
-                })
-
-            if task_info["started"] is not None:
-                task["result"].update({
-                    "started": datetime.fromtimestamp(task_info["started"])
-                })
-
-            if task_info["succeeded"] is not None:
-                task["result"].update({
-                    "succeeded": datetime.fromtimestamp(task_info["succeeded"]),
-                    "runtime": timedelta(seconds=task_info["runtime"])
-                })
+            if result.started and result.finished:
+                task["result"]["runtime"] = result.finished - result.started
 
         task["flower_url"] = "{0}{1}task/{2}".format(
             request.host_url.replace("5000", "5555"), # A bit hacky, but for devs on localhost.
@@ -152,7 +166,15 @@ def current_tasks():
 
         cur_tasks.append(task)
 
-    return cur_tasks
+    return cur_tasks, pagination
+
+
+def worker_task_results(worker_task_id):
+    """
+    Get the task for the worker task id and its results.
+    """
+    task = db_model_Task.query.filter_by(worker_task_id=worker_task_id).first()
+    return task, task.results
 
 
 class NewTaskForm(FlaskForm):
@@ -198,6 +220,12 @@ def new_task():
 
     if response.status_code == 201:
         flash("New task created.")
+    elif response.status_code == 200:
+        flash("The same task {0} exists already ({1}).".format(
+            response.json()["id"], response.json()["status"]))
+    elif response.status_code == 429:
+        flash("Can't create new task now: {0} Please try again in {1} seconds.".format(
+            response.json()["status"], response.headers.get("Retry-After")))
     else:
         try:
             result = response.json()
@@ -218,9 +246,18 @@ def tasks():
     chains = db_model_Chain.query.all()
     new_task_form.chain_id.choices = [(chain.id, chain.name) for chain in chains]
 
+    args = {name: request.args.get(name) for name in ("status", "q", "sort", "order")}
+    page_tasks, pagination = current_tasks(
+        page=request.args.get("page", 1, type=int),
+        per_page=max(1, min(MAX_PER_PAGE, request.args.get("per_page", 50, type=int))),
+        args=args)
+
     return render_template(
         "tasks.html",
-        tasks=current_tasks(),
+        tasks=page_tasks,
+        pagination=pagination,
+        args=args,
+        pressure=queue_pressure(),
         form=new_task_form)
 
 
@@ -248,6 +285,9 @@ def task_run(task_id):
         task_id))
     if response.status_code in (200, 201):
         flash("Task {0} started.".format(task_id))
+    elif response.status_code == 429:
+        flash("Can't start task {0} now: {1} Please try again in {2} seconds.".format(
+            task_id, response.json()["status"], response.headers.get("Retry-After")))
     else:
         try:
             result = json.loads(response.content)
@@ -261,15 +301,12 @@ def task_run(task_id):
 @tasks_blueprint.route("/download/txt/<string:worker_task_id>")
 def download_txt(worker_task_id):
     """Define route to download the results as text."""
-    task_info = task_information(worker_task_id)
+    task, results = worker_task_results(worker_task_id)
 
     # Get the output group of the last step in the chain of the task.
-    task = db_model_Task.query.filter_by(worker_task_id=worker_task_id).first()
-    chain = db_model_Chain.query.filter_by(id=task.chain_id).first()
-    last_step = chain.processors[-1]
-    last_output = PROCESSORS_ACTION[last_step]["output_file_grp"]
+    last_output = final_output_file_grp(task.to_json())
 
-    page_xml_dir = os.path.join(task_info["result"]["result_dir"], last_output)
+    page_xml_dir = os.path.join(results["result_dir"], last_output)
     fulltext = ""
 
     namespace = {
@@ -302,7 +339,7 @@ def download_txt(worker_task_id):
         mimetype="text/txt",
         headers={
             "Content-Disposition":
-            "attachment;filename=fulltext_%s.txt" % task_info["result"]["task_id"]
+            "attachment;filename=fulltext_%s.txt" % results["task_id"]
         }
     )
 
@@ -310,15 +347,12 @@ def download_txt(worker_task_id):
 @tasks_blueprint.route("/download/page/<string:worker_task_id>")
 def download_page_zip(worker_task_id):
     """Define route to download the page xml results as zip file."""
-    task_info = task_information(worker_task_id)
+    task, results = worker_task_results(worker_task_id)
 
     # Get the output group of the last step in the chain of the task.
-    task = db_model_Task.query.filter_by(worker_task_id=worker_task_id).first()
-    chain = db_model_Chain.query.filter_by(id=task.chain_id).first()
-    last_step = chain.processors[-1]
-    last_output = PROCESSORS_ACTION[last_step]["output_file_grp"]
+    last_output = final_output_file_grp(task.to_json())
 
-    page_xml_dir = os.path.join(task_info["result"]["result_dir"], last_output)
+    page_xml_dir = os.path.join(results["result_dir"], last_output)
     base_path = pathlib.Path(page_xml_dir)
 
     data = io.BytesIO()
@@ -332,28 +366,25 @@ def download_page_zip(worker_task_id):
         data,
         mimetype="application/zip",
         as_attachment=True,
-        attachment_filename="ocr_page_xml_%s.zip" % task_info["result"]["task_id"]
+        attachment_filename="ocr_page_xml_%s.zip" % results["task_id"]
     )
 
 @tasks_blueprint.route("/download/alto/<string:worker_task_id>")
 def download_alto_zip(worker_task_id):
     """Define route to download the alto xml results as zip file."""
-    task_info = task_information(worker_task_id)
+    task, results = worker_task_results(worker_task_id)
 
     # Get the output group of the last step in the chain of the task.
-    task = db_model_Task.query.filter_by(worker_task_id=worker_task_id).first()
-    chain = db_model_Chain.query.filter_by(id=task.chain_id).first()
-    last_step = chain.processors[-1]
-    last_output = PROCESSORS_ACTION[last_step]["output_file_grp"]
+    last_output = final_output_file_grp(task.to_json())
 
     # BUG?: java.lang.IllegalArgumentException:
     # Variable value 'TextTypeSimpleType.CAPTION' is not in the list of valid values.
     # possible reason: https://github.com/OCR-D/core/issues/451 ??
-    alto_xml_dir = os.path.join(task_info["result"]["result_dir"], "OCR-D-OCR-ALTO")
+    alto_xml_dir = os.path.join(results["result_dir"], "OCR-D-OCR-ALTO")
     alto_path = pathlib.Path(alto_xml_dir)
 
     if not os.path.exists(alto_path):
-        mets_url = "{}/mets.xml".format(task_info["result"]["result_dir"])
+        mets_url = "{}/mets.xml".format(results["result_dir"])
         run_cli(
             "ocrd-fileformat-transform",
             mets_url=mets_url,
@@ -375,5 +406,5 @@ def download_alto_zip(worker_task_id):
         data,
         mimetype="application/zip",
         as_attachment=True,
-        attachment_filename="ocr_alto_xml_%s.zip" % task_info["result"]["task_id"]
+        attachment_filename="ocr_alto_xml_%s.zip" % results["task_id"]
     )
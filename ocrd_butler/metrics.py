@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus metrics of the butler, served at /metrics.
+
+The API latency is measured in the app process. Everything else comes
+from the database and the broker while scraping: the steps run in the
+Celery workers and are recorded in the `task_steps` table, which is read
+incrementally, so a scrape only looks at the steps finished since the last
+one.
+"""
+
+from datetime import (
+    datetime,
+    timedelta
+)
+import os
+import threading
+import time
+
+from flask import (
+    Blueprint,
+    current_app,
+    g,
+    request,
+    Response
+)
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    Histogram
+)
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily
+)
+from prometheus_client.utils import floatToGoString
+from sqlalchemy import func
+
+from ocrd_butler import celery
+from ocrd_butler.database import db
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
+from ocrd_butler.execution.blob_cache import BlobCache
+from ocrd_butler.execution.step_cache import StepCache
+
+
+metrics_blueprint = Blueprint("metrics_blueprint", __name__)
+
+STEP_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600,
+                         7200, 14400, float("inf"))
+QUEUE_WAIT_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 43200,
+                      86400, float("inf"))
+
+
+class HistogramCounts():
+    """ Counts of a histogram with one label, filled incrementally. """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = {}
+        self.sums = {}
+
+    def observe(self, label, value):
+        buckets = self.buckets.setdefault(label, [0] * len(self.bounds))
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                buckets[index] += 1
+        self.sums[label] = self.sums.get(label, 0.0) + value
+
+    def metric(self, name, documentation, label):
+        metric = HistogramMetricFamily(name, documentation, labels=[label])
+        for value, buckets in sorted(self.buckets.items()):
+            metric.add_metric(
+                [value],
+                [(floatToGoString(bound), count) for bound, count
+                 in zip(self.bounds, buckets)],
+                self.sums[value])
+        return metric
+
+
+class ButlerCollector():
+    """ Collect the metrics of the queues, tasks and steps. """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        # Steps with an id up to this one are counted, above it the ones
+        # in `counted_steps`.
+        self.last_step_id = 0
+        self.counted_steps = set()
+        self.step_durations_counts = HistogramCounts(STEP_DURATION_BUCKETS)
+        # Tasks started at this time or later are not counted yet, except
+        # the ones in `counted_waits`.
+        self.last_started = None
+        self.counted_waits = set()
+        self.queue_waits_counts = HistogramCounts(QUEUE_WAIT_BUCKETS)
+
+    def describe(self):
+        """ Don't collect on registration, the database may not exist yet. """
+        return []
+
+    def collect(self):
+        with self.app.app_context():
+            yield self.queue_depth()
+            yield self.tasks_by_status()
+            yield self.pages_per_minute()
+            yield self.step_durations()
+            yield self.queue_waits()
+            yield from self.cache_lookups()
+
+    def queues(self):
+        """ All queues the steps can be routed to. """
+        queues = set(self.app.config["PROCESSOR_QUEUES"].values())
+        queues.add(self.app.config["PROCESSOR_DEFAULT_QUEUE"])
+        return sorted(queues)
+
+    def queue_depth(self):
+        """ Messages waiting in the broker per queue. """
+        metric = GaugeMetricFamily(
+            "ocrd_butler_queue_depth", "Tasks waiting in the Celery queue.",
+            labels=["queue"])
+        try:
+            with celery.connection_for_read() as connection:
+                connection.ensure_connection(
+                    max_retries=1, interval_start=0, timeout=2)
+                channel = connection.default_channel
+                for queue in self.queues():
+                    try:
+                        _, count, _ = channel.queue_declare(queue=queue, passive=True)
+                    except Exception:  # pylint: disable=broad-except
+                        # The queue doesn't exist yet.
+                        count = 0
+                    metric.add_metric([queue], count)
+        except Exception as exc:  # pylint: disable=broad-except
+            current_app.logger.warning(
+                "Can't get the queue depth from the broker: {0}".format(exc))
+        return metric
+
+    def tasks_by_status(self):
+        """ Number of tasks per status. """
+        metric = GaugeMetricFamily(
+            "ocrd_butler_tasks", "Tasks by status.", labels=["status"])
+        for status, count in db.session.query(
+                db_model_Task.status, func.count(db_model_Task.id)).group_by(
+                    db_model_Task.status):
+            metric.add_metric([status or "UNKNOWN"], count)
+        return metric
+
+    def pages_per_minute(self):
+        """ Pages of the tasks succeeded within the configured window. """
+        window = self.app.config["METRICS_PAGES_WINDOW"]
+        since = datetime.now() - timedelta(seconds=window)
+        pages = db.session.query(func.sum(db_model_Task.pages)).filter(
+            db_model_Task.status == "SUCCESS",
+            db_model_Task.finished >= since).scalar() or 0
+        return GaugeMetricFamily(
+            "ocrd_butler_pages_per_minute",
+            "Pages processed per minute in the last {0} seconds.".format(window),
+            value=pages * 60.0 / window)
+
+    def step_durations(self):
+        """ Histogram of the wall time of the steps per processor. """
+        abandoned = datetime.now() - timedelta(
+            seconds=self.app.config["METRICS_STEP_ABANDONED"])
+        with self.lock:
+            steps = db_model_TaskStep.query.filter(
+                db_model_TaskStep.id > self.last_step_id).order_by(
+                    db_model_TaskStep.id).all()
+            running = None
+            for step in steps:
+                if step.status == "RUNNING":
+                    if step.started is None or step.started > abandoned:
+                        running = running or step.id
+                    continue
+                if step.id in self.counted_steps:
+                    continue
+                self.counted_steps.add(step.id)
+                if step.cached or step.wall_time is None:
+                    continue
+                self.step_durations_counts.observe(step.processor, step.wall_time)
+
+            # Move on until the first step which is still running, the
+            # abandoned ones are not counted anymore.
+            if steps:
+                self.last_step_id = running - 1 if running else steps[-1].id
+                self.counted_steps = {
+                    step_id for step_id in self.counted_steps
+                    if step_id > self.last_step_id}
+
+            return self.step_durations_counts.metric(
+                "ocrd_butler_step_duration_seconds",
+                "Wall time of the chain steps, without cached ones.",
+                "processor")
+
+    def queue_waits(self):
+        """
+        Histogram of the time the tasks waited in the queues, from the
+        dispatch to the start, per priority.
+        """
+        with self.lock:
+            query = db_model_Task.query.filter(
+                db_model_Task.received.isnot(None),
+                db_model_Task.started.isnot(None))
+            if self.last_started is not None:
+                query = query.filter(db_model_Task.started >= self.last_started)
+            for task in query.order_by(db_model_Task.started):
+                if (task.id, task.started) in self.counted_waits:
+                    continue
+                if task.started != self.last_started:
+                    self.last_started = task.started
+                    self.counted_waits = set()
+                self.counted_waits.add((task.id, task.started))
+                self.queue_waits_counts.observe(
+                    "none" if task.priority is None else str(task.priority),
+                    max(0.0, (task.started - task.received).total_seconds()))
+
+            return self.queue_waits_counts.metric(
+                "ocrd_butler_queue_wait_seconds",
+                "Time the tasks waited in the queues per priority.",
+                "priority")
+
+    def cache_lookups(self):
+        """
+        Hits and lookups of the blob cache of the downloads and of the step
+        cache, counted by the workers in the index of the caches.
+        """
+        caches = (
+            ("blob", BlobCache, "BLOB_CACHE_DIR", "hits", "misses"),
+            ("step", StepCache, "STEP_CACHE_DIR", "step_hits", "step_misses"),
+        )
+        for name, cache_class, directory, hits, misses in caches:
+            # Don't create a cache which isn't used yet.
+            directory = self.app.config.get(directory)
+            if not directory or not os.path.exists(
+                    os.path.join(directory, "index.sqlite")):
+                continue
+            stats = cache_class.from_config(self.app.config).stats()
+            stats.setdefault(hits, 0)
+            stats.setdefault(misses, 0)
+            yield CounterMetricFamily(
+                "ocrd_butler_{0}_cache_hits".format(name),
+                "Lookups found in the {0} cache.".format(name),
+                value=stats[hits])
+            yield CounterMetricFamily(
+                "ocrd_butler_{0}_cache_lookups".format(name),
+                "Lookups in the {0} cache.".format(name),
+                value=stats[hits] + stats[misses])
+
+
+def init_metrics(app):
+    """
+    Register the metrics for the app. Every app gets its own registry.
+    """
+    registry = CollectorRegistry()
+    registry.register(ButlerCollector(app))
+    latency = Histogram(
+        "ocrd_butler_request_duration_seconds",
+        "Latency of the requests per route.",
+        labelnames=["method", "route"],
+        registry=registry)
+    app.extensions["metrics"] = registry
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_latency(response):
+        if "request_started" in g:
+            route = request.url_rule.rule if request.url_rule else "unknown"
+            latency.labels(request.method, route).observe(
+                time.perf_counter() - g.request_started)
+        return response
+
+    app.register_blueprint(metrics_blueprint)
+
+
+@metrics_blueprint.route("/metrics")
+def metrics():
+    """ The metrics in the Prometheus text format. """
+    return Response(generate_latest(current_app.extensions["metrics"]),
+                    content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Find the `ocrd-tool.json` of the processor packages without importing
+them, most of them pull in TensorFlow or Keras on import.
+
+The packages are located with `importlib.util.find_spec`, which doesn't
+run the package, and the distribution metadata. The merged configuration
+is cached in a JSON file, valid as long as the versions of the packages
+and the `ocrd-tool.json` files don't change.
+"""
+
+import copy
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+from collections.abc import (
+    Mapping,
+    Sequence
+)
+
+try:
+    from importlib import metadata
+except ImportError:  # Python < 3.8
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+
+# Bump if the content of the cache changes.
+CACHE_FORMAT = 1
+
+
+def package_version(package):
+    """ The installed version of the package, None if unknown. """
+    if metadata is None:
+        return None
+    for name in (package, package.replace("_", "-")):
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return None
+
+
+def _distribution_tool_file(package):
+    """ The `ocrd-tool.json` listed in the files of the distribution. """
+    if metadata is None:
+        return None
+    for name in (package, package.replace("_", "-")):
+        try:
+            files = metadata.files(name) or []
+        except metadata.PackageNotFoundError:
+            continue
+        for path in files:
+            if path.name == "ocrd-tool.json":
+                return os.path.abspath(str(path.locate()))
+    return None
+
+
+def package_tool_file(package):
+    """ Locate the `ocrd-tool.json` of an installed package. """
+    spec = importlib.util.find_spec(package)
+    if spec is None or not spec.submodule_search_locations:
+        raise ModuleNotFoundError(
+            "No processor package named {0}.".format(package))
+    m_path = list(spec.submodule_search_locations)[0]
+
+    for candidate in (
+            (m_path, "ocrd-tool.json"),
+            (m_path, "..", "ocrd-tool.json"),
+            # ocrd_keraslm
+            (m_path, "wrapper", "ocrd-tool.json")):
+        ocrd_tool_file = os.path.abspath(os.path.join(*candidate))
+        if os.path.exists(ocrd_tool_file):
+            return ocrd_tool_file
+
+    ocrd_tool_file = _distribution_tool_file(package)
+    if ocrd_tool_file is None or not os.path.exists(ocrd_tool_file):
+        raise ImportError(
+            "Can't find ocrd-tools.json for {0}, giving up.".format(package))
+    return ocrd_tool_file
+
+
+def script_tool_file(directory):
+    """ The `ocrd-tool.json` of processor scripts in the directory. """
+    ocrd_tool_file = os.path.abspath(os.path.join(directory, "ocrd-tool.json"))
+    if not os.path.exists(ocrd_tool_file):
+        raise ImportError(
+            "Can't find ocrd-tools.json {0}, giving up.".format(ocrd_tool_file))
+    return ocrd_tool_file
+
+
+def tool_files(scripts, packages):
+    """
+    The `ocrd-tool.json` files as (package name, version, path), the
+    scripts first, like they are merged.
+    """
+    files = [(os.path.basename(directory), None, script_tool_file(directory))
+             for directory in scripts]
+    files.extend((package, package_version(package), package_tool_file(package))
+                 for package in packages)
+    return files
+
+
+def cache_key(files):
+    """ Changes with the version and content of the `ocrd-tool.json` files. """
+    key = [CACHE_FORMAT]
+    for package, version, path in files:
+        stat = os.stat(path)
+        key.append([package, version, path, stat.st_mtime_ns, stat.st_size])
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def load_config(files):
+    """ Merge the tools of the `ocrd-tool.json` files. """
+    processors = {}
+    for package, _, path in files:
+        with open(path) as fh:
+            ocrd_tool = json.load(fh)
+
+        package_information = {"package": {"name": package}}
+        for name, value in ocrd_tool.items():
+            if name == "tools":
+                continue
+            package_information["package"][name] = value
+
+        for name, config in ocrd_tool["tools"].items():
+            processors[name] = config
+            processors[name].update(package_information)
+    return processors
+
+
+def action_config(processors):
+    """ An usable action configuration from the processor config. """
+    actions = copy.deepcopy(processors)
+    for name, config in actions.items():
+
+        # TODO: check why not every processor has the package information
+        if "package" in config:
+            del config["package"]
+
+        parameters = {}
+        if "parameters" in config:
+            for p_name, p_values in config["parameters"].items():
+                if "default" in p_values:
+                    parameters[p_name] = p_values["default"]
+        config["parameters"] = parameters
+
+        # Just take the first in-/output file group for now.
+        # TODO: This is also connected to the chosen parameters.
+        try:
+            config["input_file_grp"] = config["input_file_grp"][0]
+        except KeyError:
+            pass
+
+        # TODO: Move this fixed setting to a configuration like place. (tbi)
+        if name == "ocrd-olena-binarize":
+            config["output_file_grp"] = "OCR-D-IMG-BINPAGE"
+        else:
+            try:
+                config["output_file_grp"] = config["output_file_grp"][0]
+            except KeyError:
+                pass
+    return actions
+
+
+def view_config(processors):
+    """ The processor config as list for the views. """
+    view = []
+    for name, config in processors.items():
+        processor = {"name": name}
+        processor.update(copy.deepcopy(config))
+        view.append(processor)
+    return view
+
+
+class ProcessorRegistry():
+    """
+    The processors of the scripts and packages, found on first access.
+    A `cache` file of None disables the cache.
+    """
+
+    def __init__(self, scripts, packages, cache=None):
+        self.scripts = scripts
+        self.packages = packages
+        self.cache = cache
+        # Reentrant, the action and view are built from the config.
+        self.lock = threading.RLock()
+        self._config = None
+        self._action = None
+        self._view = None
+
+    def read_cache(self, key):
+        try:
+            with open(self.cache) as fh:
+                cached = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or cached.get("key") != key:
+            return None
+        return cached.get("processors")
+
+    def write_cache(self, key, processors):
+        part = "{0}.{1}".format(self.cache, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache)),
+                        exist_ok=True)
+            with open(part, "w") as fh:
+                json.dump({"key": key, "processors": processors}, fh)
+            os.replace(part, self.cache)
+        except OSError:
+            # Only a cache, the next start tries again.
+            if os.path.exists(part):
+                os.unlink(part)
+
+    def load(self):
+        files = tool_files(self.scripts, self.packages)
+        if self.cache is None:
+            return load_config(files)
+        key = cache_key(files)
+        processors = self.read_cache(key)
+        if processors is None:
+            processors = load_config(files)
+            self.write_cache(key, processors)
+        return processors
+
+    def config(self):
+        """ The configuration of the processors by name. """
+        if self._config is None:
+            with self.lock:
+                if self._config is None:
+                    self._config = self.load()
+        return self._config
+
+    def action(self):
+        """ The action configuration with the default parameters. """
+        if self._action is None:
+            with self.lock:
+                if self._action is None:
+                    self._action = action_config(self.config())
+        return self._action
+
+    def view(self):
+        """ The processors as list for the views. """
+        if self._view is None:
+            with self.lock:
+                if self._view is None:
+                    self._view = view_config(self.config())
+        return self._view
+
+
+class LazyMapping(Mapping):
+    """ A read only mapping built by `load` on first access. """
+
+    def __init__(self, load):
+        self._load = load
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+class LazySequence(Sequence):
+    """ A read only sequence built by `load` on first access. """
+
+    def __init__(self, load):
+        self._load = load
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
@@ -18,3 +18,99 @@ $(document).ready(function() {
         });
     }
 });
+
+// Update the states of the listed tasks in place.
+$(document).ready(function() {
+
+    let task_rows = $("tr[data-task-id]");
+    if (task_rows.length == 0 || !window.EventSource) {
+        return;
+    }
+    let task_ids = task_rows.map((index, row) => $(row).data("task-id")).get();
+    let stream = new EventSource("/api/tasks/stream?ids=" + task_ids.join(","));
+    let task_row = (data) => $('tr[data-task-id="' + data.task_id + '"]');
+
+    // The state of every step, the steps of a graph run in parallel.
+    let update_nodes = (task_id) => {
+        $.getJSON("/api/tasks/" + task_id + "/nodes", (nodes) => {
+            let text = nodes.map((node) => node.processor + ": " + node.status);
+            task_row({task_id: task_id}).find(".task-nodes").html(
+                text.map((line) => $("<span>").text(line).html()).join("<br />"));
+        });
+    };
+
+    stream.addEventListener("status", (event) => {
+        let data = JSON.parse(event.data);
+        let row = task_row(data);
+        let previous = row.find(".task-status").text();
+        row.find(".task-status").text(data.status ? "(" + data.status + ")" : "");
+        if (data.status == "SUCCESS" && previous != "(SUCCESS)") {
+            // Get the row with the links to the results.
+            $.get(window.location.href, (html) => {
+                let updated = $(html).find('tr[data-task-id="' + data.task_id + '"]');
+                row.children("td").slice(7, 9).replaceWith(
+                    updated.children("td").slice(7, 9));
+            });
+        }
+        if (data.status != "STARTED") {
+            row.find(".task-progress").text("");
+        }
+        if (data.status == "SUCCESS" || data.status == "FAILURE") {
+            update_nodes(data.task_id);
+        }
+    });
+
+    stream.addEventListener("progress", (event) => {
+        let data = JSON.parse(event.data);
+        let text = data.stage;
+        if (data.stage == "download") {
+            text += " " + data.pages + "/" + data.pages_total + " pages";
+        } else if (data.stage == "step") {
+            text += " " + (data.index + 1) + ": " + data.processor;
+            if (data.shards_total) {
+                text += " (" + data.shards + "/" + data.shards_total + " shards)";
+            }
+            if (!data.shards) {
+                update_nodes(data.task_id);
+            }
+        }
+        task_row(data).find(".task-progress").text(text);
+    });
+
+    stream.addEventListener("log", (event) => {
+        let data = JSON.parse(event.data);
+        let log = task_row(data).find(".task-log");
+        let lines = log.text().split("\n").filter((line) => line.length > 0);
+        lines = lines.concat(data.lines).slice(-50);
+        log.text(lines.join("\n")).prop("hidden", false);
+        log.scrollTop(log.prop("scrollHeight"));
+    });
+});
+
+// Keep the pressure on the queues up to date.
+$(document).ready(function() {
+
+    let pressure = $(".queue-pressure");
+    if (pressure.length == 0) {
+        return;
+    }
+    let update_pressure = () => {
+        $.getJSON("/api/tasks/pressure", (data) => {
+            pressure.find(".queue-in-flight").text(data.in_flight);
+            pressure.find(".queue-throughput").text(data.throughput.toFixed(1));
+            if (data.free_disk !== null) {
+                pressure.find(".queue-free-disk").text(
+                    (data.free_disk / Math.pow(1024, 3)).toFixed(1) + " GiB");
+            }
+            if (data.pressure !== null) {
+                let level = data.pressure >= 1 ? "label-danger"
+                    : data.pressure >= 0.8 ? "label-warning" : "label-success";
+                pressure.find(".queue-pressure-level")
+                    .removeClass("label-danger label-warning label-success")
+                    .addClass(level)
+                    .text(Math.round(data.pressure * 100) + "%");
+            }
+        });
+    };
+    setInterval(update_pressure, 15000);
+});
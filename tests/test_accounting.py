@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the resource accounting of `ocrd_butler` package."""
+
+from ocrd_butler.execution.accounting import (
+    combine_parallel,
+    run_processor_cli,
+    usage
+)
+
+
+def test_run_processor_cli(tmpdir):
+    """ The exit code and the resources of the process are returned. """
+    returncode, step_usage = run_processor_cli(
+        "true", mets_url="mets.xml", working_dir=str(tmpdir))
+    assert returncode == 0
+    assert step_usage["wall_time"] > 0
+    assert step_usage["max_rss"] > 0
+
+    returncode, _ = run_processor_cli(
+        "false", mets_url="mets.xml", working_dir=str(tmpdir))
+    assert returncode == 1
+
+
+def test_run_processor_cli_log(tmpdir):
+    """ The output lines of the process are passed to the log callback. """
+    lines = []
+    returncode, _ = run_processor_cli(
+        "echo", mets_url="mets.xml", working_dir=str(tmpdir), log=lines.append)
+    assert returncode == 0
+    assert lines == ["--working-dir {0} --mets mets.xml".format(tmpdir)]
+
+
+def test_combine_parallel():
+    """ CPU times add up, wall time and memory are the maximum. """
+    combined = combine_parallel([
+        usage(wall_time=2.0, user_time=1.5, system_time=0.5, max_rss=100),
+        usage(wall_time=3.0, user_time=2.5, system_time=0.5, max_rss=50),
+    ])
+    assert combined == usage(wall_time=3.0, user_time=4.0, system_time=1.0,
+                             max_rss=100)
+    assert combine_parallel([]) == usage()
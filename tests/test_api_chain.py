@@ -11,6 +11,7 @@ from ocrd_butler.config import TestingConfig
 from ocrd_butler.factory import create_app, db
 from ocrd_butler.api.models import chain_model
 from ocrd_butler.api.models import ChainParametersField
+from ocrd_butler.execution.costs import record_step_cost
 
 
 class ApiTests(TestCase):
@@ -208,3 +209,101 @@ class ApiTests(TestCase):
                 assert type(chain_model[field]) == fields.String
 
 
+
+    def test_estimate_chain(self):
+        """Check the estimate of the runtime from the processor costs."""
+        response = self.client.post("/api/chains", json=dict(
+            name="New Chain",
+            description="Some foobar chain.",
+            processors=["ocrd-olena-binarize", "ocrd-tesserocr-recognize"],
+        ))
+        chain_id = response.json["id"]
+
+        response = self.client.get("/api/chains/{0}/estimate?pages=10".format(chain_id))
+        assert response.status_code == 200
+        assert response.json["seconds"] is None
+        assert response.json["unknown"] == [
+            "ocrd-olena-binarize", "ocrd-tesserocr-recognize"]
+
+        record_step_cost("ocrd-olena-binarize", 20.0, 10)
+        record_step_cost("ocrd-olena-binarize", 40.0, 10)
+        record_step_cost("ocrd-tesserocr-recognize", 30.0, 5, megapixels=10.0)
+        response = self.client.get("/api/chains/{0}/estimate?pages=5".format(chain_id))
+        assert response.json["unknown"] == []
+        assert response.json["seconds"] == 15.0 + 30.0
+        response = self.client.get(
+            "/api/chains/{0}/estimate?pages=5&megapixels=5".format(chain_id))
+        assert response.json["processors"][1]["seconds"] == 15.0
+
+        response = self.client.get("/api/chains/{0}/estimate".format(chain_id))
+        assert response.status_code == 400
+
+    def test_chain_plan(self):
+        """Check if the chain is compiled into a versioned plan."""
+        response = self.client.post("/api/chains", json=dict(
+            name="New Chain",
+            description="Some foobar chain.",
+            processors=["ocrd-olena-binarize", "ocrd-tesserocr-recognize"],
+            parameters={"ocrd-tesserocr-recognize": {"textequiv_level": "line"}},
+        ))
+        chain_id = response.json["id"]
+
+        chain = self.client.get("/api/chains/{0}".format(chain_id)).json
+        assert chain["plan_version"] == 1
+        steps = chain["plan"]["steps"]
+        assert steps[0]["input_file_grp"] is None
+        assert steps[0]["output_file_grp"] == "OCR-D-IMG-BINPAGE"
+        assert steps[1]["input_file_grp"] == "OCR-D-IMG-BINPAGE"
+        assert steps[1]["executable"] == "ocrd-tesserocr-recognize"
+        assert steps[1]["parameter"]["textequiv_level"] == "line"
+        assert steps[1]["parameter"]["overwrite_words"] is False
+
+        response = self.client.put("/api/chains/{0}".format(chain_id), json=dict(
+            processors=["ocrd-tesserocr-recognize"]))
+        assert response.status_code == 200
+        chain = self.client.get("/api/chains/{0}".format(chain_id)).json
+        assert chain["plan_version"] == 2
+        assert chain["plan"]["steps"][0]["processor"] == "ocrd-tesserocr-recognize"
+
+        response = self.client.put("/api/chains/{0}".format(chain_id), json=dict(
+            processors=["foobar"]))
+        assert response.status_code == 400
+
+    def test_chain_graph(self):
+        """Check if a chain with parallel branches is validated and compiled."""
+        nodes = [
+            {"processor": "ocrd-olena-binarize"},
+            {"processor": "ocrd-tesserocr-segment-region",
+             "input_file_grp": ["OCR-D-IMG-BINPAGE"], "output_file_grp": "OCR-D-SEG"},
+            {"processor": "ocrd-tesserocr-recognize",
+             "input_file_grp": ["OCR-D-SEG"], "output_file_grp": "OCR-D-OCR-TESS"},
+            {"processor": "ocrd-calamari-recognize",
+             "input_file_grp": ["OCR-D-SEG"], "output_file_grp": "OCR-D-OCR-CALA"},
+            {"processor": "ocrd-dinglehopper",
+             "input_file_grp": ["OCR-D-OCR-TESS", "OCR-D-OCR-CALA"],
+             "output_file_grp": "OCR-D-EVAL"},
+        ]
+        response = self.client.post("/api/chains", json=dict(
+            name="Graph Chain", description="Compare two recognitions.",
+            nodes=nodes))
+        assert response.status_code == 201
+
+        chain = self.client.get("/api/chains/{0}".format(response.json["id"])).json
+        assert chain["processors"][3] == "ocrd-calamari-recognize"
+        steps = {step["index"]: step for step in chain["plan"]["steps"]}
+        assert steps[0]["input_file_grp"] is None
+        assert steps[2]["needs"] == [1] and steps[3]["needs"] == [1]
+        assert steps[2]["level"] == steps[3]["level"] == 2
+        assert steps[2]["branch"] and not steps[1]["branch"]
+        assert steps[4]["input_file_grp"] == "OCR-D-OCR-TESS,OCR-D-OCR-CALA"
+        assert steps[4]["needs"] == [2, 3]
+
+        nodes[1]["input_file_grp"] = ["OCR-D-EVAL"]
+        response = self.client.post("/api/chains", json=dict(
+            name="Cycle", description="Foobar.", nodes=nodes))
+        assert response.status_code == 400
+        assert response.json["status"] == "The nodes form a cycle."
+
+        response = self.client.post("/api/chains", json=dict(
+            name="No processor", description="Foobar.", nodes=[{}]))
+        assert response.status_code == 400
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the collection api for `ocrd_butler` package."""
+
+from unittest import mock
+
+from flask_testing import TestCase
+
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.factory import create_app, db
+from ocrd_butler.database.models import Task as db_model_Task
+
+
+class ApiTests(TestCase):
+    """Test our api."""
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def collection(self, **kwargs):
+        chain_response = self.client.post("/api/chains", json=dict(
+            name="New Chain",
+            description="Some foobar chain.",
+            processors=["ocrd-tesserocr-recognize"]
+        ))
+        data = dict(
+            name="Collection",
+            chain_id=chain_response.json["id"],
+            sources=["https://foobar.tdl/{0}.xml".format(index)
+                     for index in range(5)],
+        )
+        data.update(kwargs)
+        return self.client.post("/api/collections", json=data)
+
+    def test_create_collection(self):
+        """Check if a collection with a task per source is created."""
+        response = self.collection(max_in_flight=2)
+        assert response.status_code == 201
+        assert response.json["message"] == "Collection created."
+
+        response = self.client.get("/api/collections/1")
+        assert response.status_code == 200
+        assert response.json["status"] == "CREATED"
+        assert response.json["max_in_flight"] == 2
+        assert response.json["cursor"] == 0
+        assert response.json["progress"]["total"] == 5
+        assert response.json["progress"]["waiting"] == 5
+
+        tasks = db_model_Task.query.filter_by(collection_id=1).all()
+        assert [task.src for task in tasks][0] == "https://foobar.tdl/0.xml"
+
+    @mock.patch("ocrd_butler.execution.dispatcher.run_tasks")
+    def test_collection_attaches_finished_tasks(self, mock_run_tasks):
+        """Check if a source processed before isn't processed again."""
+        self.collection(max_in_flight=1)
+        response = self.client.post("/api/tasks", json=dict(
+            chain_id=1, src="HTTPS://foobar.tdl/0.xml"))
+        finished = db_model_Task.query.get(response.json["id"])
+        finished.status = "SUCCESS"
+        finished.results = {"stages": {}}
+        db.session.commit()
+
+        task = db_model_Task.query.filter_by(collection_id=1).first()
+        assert task.fingerprint == finished.fingerprint
+
+        response = self.client.post("/api/collections/1/start")
+        assert response.json["dispatched"] == 1
+        assert not mock_run_tasks.called
+        task = db_model_Task.query.get(task.id)
+        assert task.status == "SUCCESS"
+        assert task.uid == finished.uid
+        assert task.results == {"stages": {}}
+        assert self.client.get("/api/collections/1").json["cursor"] == task.id
+
+    def test_collection_without_sources(self):
+        """Check if a collection needs sources."""
+        response = self.collection(sources=[])
+        assert response.status_code == 400
+
+    def test_pause_collection(self):
+        """Check the actions of a collection."""
+        self.collection()
+        response = self.client.post("/api/collections/1/pause")
+        assert response.status_code == 200
+        assert self.client.get("/api/collections/1").json["status"] == "PAUSED"
+
+        response = self.client.post("/api/collections/1/foobar")
+        assert response.status_code == 400
+        response = self.client.post("/api/collections/2/pause")
+        assert response.status_code == 404
@@ -2,7 +2,10 @@
 
 """Testing the api for `ocrd_butler` package."""
 
+from datetime import datetime
+import json
 import pytest
+from unittest import mock
 
 from flask_restx import fields
 from flask_testing import TestCase
@@ -10,6 +13,9 @@ from flask_testing import TestCase
 from ocrd_butler.config import TestingConfig
 from ocrd_butler.factory import create_app, db
 from ocrd_butler.api.models import task_model
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
+from ocrd_butler.execution.status import worker_task_id
 
 class ApiTests(TestCase):
     """Test our api."""
@@ -101,5 +107,209 @@ class ApiTests(TestCase):
         assert "status" in task_model
         assert "results" in task_model
 
+        # Numbers are integers, as in the models of chains and collections.
+        assert type(task_model["shard_size"]) == fields.Integer
+        assert type(task_model["priority"]) == fields.Integer
         for field in task_model:
-            assert type(task_model[field]) == fields.String
+            if field not in ("shard_size", "priority"):
+                assert type(task_model[field]) == fields.String
+
+    def test_task_shard_size(self):
+        """Check if the shard size is a number not below 0."""
+        task = dict(chain_id=self.chain(), src="https://foobar.tdl/themets.xml")
+        response = self.client.post("/api/tasks", json=dict(task, shard_size="10"))
+        assert response.status_code == 201
+        assert self.client.get("/api/tasks/1").json["shard_size"] == 10
+
+        response = self.client.post("/api/tasks", json=dict(task, shard_size=-1))
+        assert response.status_code == 400
+        assert response.json["status"] == "Shard size \"-1\" is negative."
+        response = self.client.post("/api/tasks", json=dict(task, shard_size="many"))
+        assert response.status_code == 400
+
+    def test_task_steps(self):
+        """Check the recorded steps of a task."""
+        self.client.post("/api/tasks", json=dict(
+            chain_id=self.chain(),
+            src="https://foobar.tdl/themets.xml",
+            description="Just a task."
+        ))
+
+        response = self.client.get("/api/tasks/1/steps")
+        assert response.status_code == 200
+        assert response.json == []
+
+    def test_create_tasks_bulk(self):
+        """Check if many tasks are created at once."""
+        chain_id = self.chain()
+        tasks = [dict(chain_id=chain_id,
+                      src="https://foobar.tdl/{0}.xml".format(index))
+                 for index in range(3)]
+
+        response = self.client.post("/api/tasks/bulk", data="\n".join(
+            json.dumps(task) for task in tasks))
+        assert response.status_code == 201
+        created = [json.loads(line) for line in
+                   response.get_data(as_text=True).splitlines()]
+        assert [task["id"] for task in created] == [1, 2, 3]
+
+        response = self.client.post("/api/tasks/bulk", json=tasks[:1])
+        assert response.status_code == 201
+        assert json.loads(response.get_data(as_text=True))["id"] == 4
+        assert self.client.get("/api/tasks/4").json["src"] == tasks[0]["src"]
+
+        response = self.client.post("/api/tasks/bulk", json=[
+            tasks[0], dict(src="https://foobar.tdl/mets.xml")])
+        assert response.status_code == 400
+        assert response.json["message"] == "Wrong parameter in task 2."
+
+    def test_task_priority(self):
+        """Check if the priority is a number from 0 to 9."""
+        task = dict(chain_id=self.chain(), src="https://foobar.tdl/themets.xml")
+        response = self.client.post("/api/tasks", json=dict(task, priority=7))
+        assert response.status_code == 201
+        assert self.client.get("/api/tasks/1").json["priority"] == 7
+
+        for priority in (-1, 10):
+            response = self.client.post("/api/tasks", json=dict(task, priority=priority))
+            assert response.status_code == 400
+            assert response.json["status"] == \
+                "Priority \"{0}\" is not a number from 0 to 9.".format(priority)
+        response = self.client.post("/api/tasks", json=dict(task, priority="high"))
+        assert response.status_code == 400
+
+    def test_deduplicate_tasks(self):
+        """Check if the same task is attached to the finished one."""
+        chain_id = self.chain()
+        task = dict(chain_id=chain_id, src="https://foobar.tdl/mets.xml")
+        assert self.client.post("/api/tasks", json=task).status_code == 201
+        # Only finished and running tasks are reused.
+        assert self.client.post("/api/tasks", json=task).json["id"] == 2
+        db_model_Task.query.filter_by(id=1).update({"status": "SUCCESS"})
+        db.session.commit()
+
+        response = self.client.post("/api/tasks", json=dict(
+            task, src="HTTPS://FOOBAR.tdl:443/mets.xml#page"))
+        assert response.status_code == 200
+        assert response.json["message"] == "Task exists."
+        assert response.json["id"] == 1
+        response = self.client.post("/api/tasks", json=dict(
+            task, parameters={"ocrd-tesserocr-recognize": {"textequiv_level": "line"}}))
+        assert response.status_code == 201
+        response = self.client.post("/api/tasks", json=dict(task, force="true"))
+        assert response.status_code == 201
+        assert response.json["id"] == 4
+
+        response = self.client.post("/api/tasks/2/run")
+        assert response.json["existing"] == 1
+
+    def test_idempotency_key(self):
+        """Check if a retried request doesn't create another task."""
+        chain_id = self.chain()
+        task = dict(chain_id=chain_id, src="https://foobar.tdl/mets.xml")
+        headers = {"Idempotency-Key": "foobar-1"}
+        response = self.client.post("/api/tasks", json=task, headers=headers)
+        assert response.status_code == 201
+        response = self.client.post("/api/tasks", json=task, headers=headers)
+        assert response.status_code == 201
+        assert response.json["id"] == 1
+        assert db_model_Task.query.count() == 1
+
+        response = self.client.post("/api/tasks", headers=headers, json=dict(
+            task, src="https://foobar.tdl/other.xml"))
+        assert response.status_code == 422
+
+    def test_admission_control(self):
+        """Check if tasks are refused with Retry-After if the queues are full."""
+        self.app.config["ADMISSION_MAX_IN_FLIGHT"] = 3
+        self.app.config["ADMISSION_MAX_IN_FLIGHT_PER_SUBMITTER"] = 1
+        chain_id = self.chain()
+        for number in range(12):
+            self.client.post("/api/tasks", json=dict(
+                chain_id=chain_id, submitter="foo" if number < 2 else None,
+                src="https://foobar.tdl/{0}.xml".format(number)))
+        tasks = db_model_Task.query.order_by(db_model_Task.id).all()
+        tasks[0].status = "STARTED"
+        for task in tasks[2:]:
+            task.status = "SUCCESS"
+            task.finished = datetime.now()
+        db.session.commit()
+
+        response = self.client.post("/api/tasks/2/run")
+        assert response.status_code == 429
+        assert response.json["status"] == "At most 1 tasks of submitter \"foo\" in the queues."
+        # No task of the submitter finished yet.
+        assert response.headers["Retry-After"] == "900"
+
+        tasks[1].status = "PENDING"
+        tasks[2].status = "RETRY"
+        db.session.commit()
+        response = self.client.post("/api/tasks", json=dict(
+            chain_id=chain_id, src="https://foobar.tdl/new.xml"))
+        assert response.status_code == 429
+        # 9 tasks finished in the last 900 seconds, one has to.
+        assert response.headers["Retry-After"] == "100"
+
+        pressure = self.client.get("/api/tasks/pressure").json
+        assert pressure["in_flight"] == 3
+        assert pressure["pressure"] == 1.0
+        assert pressure["throughput"] == 36.0
+
+        # The tasks of all submitters count for the queues.
+        self.app.config["ADMISSION_MAX_IN_FLIGHT"] = 6
+        self.app.config["ADMISSION_MAX_IN_FLIGHT_PER_SUBMITTER"] = 2
+        response = self.client.post("/api/tasks/bulk", json=[
+            dict(chain_id=chain_id, submitter=submitter,
+                 src="https://foobar.tdl/{0}-{1}.xml".format(submitter, number))
+            for submitter in ("bar", "baz") for number in range(2)])
+        assert response.status_code == 429
+        assert response.json["status"] == "At most 6 tasks in the queues."
+
+    @mock.patch("ocrd_butler.api.tasks.stop_task")
+    def test_stop_task(self, mock_stop_task):
+        """Check if a running task is stopped and its steps are marked."""
+        self.client.post("/api/tasks", json=dict(
+            chain_id=self.chain(),
+            src="https://foobar.tdl/themets.xml"
+        ))
+        response = self.client.post("/api/tasks/1/stop")
+        assert response.status_code == 400
+
+        task = db_model_Task.query.get(1)
+        task.status = "STARTED"
+        db.session.add(db_model_TaskStep(
+            task_id=1, index=0, processor="ocrd-tesserocr-recognize",
+            input_file_grp="DEFAULT", output_file_grp="OCR-D-OCR"))
+        db.session.commit()
+        mock_stop_task.return_value = ["1-abcd1234-prepare"]
+
+        response = self.client.post("/api/tasks/1/stop")
+        assert response.status_code == 200
+        assert response.json["status"] == "REVOKED"
+        assert response.json["revoked"] == ["1-abcd1234-prepare"]
+        steps = self.client.get("/api/tasks/1/steps").json
+        assert steps[0]["status"] == "STOPPED"
+
+    def test_stopped_task_stays_revoked(self):
+        """Check if the failure on the termination doesn't overwrite REVOKED."""
+        self.client.post("/api/tasks", json=dict(
+            chain_id=self.chain(),
+            src="https://foobar.tdl/themets.xml"
+        ))
+        store = self.app.extensions["task_events"]
+        for type_, role in (("task-received", "prepare"),
+                            ("task-started", "prepare"),
+                            ("task-started", "step0")):
+            store.handle({"type": type_, "uuid": worker_task_id(1, "abcd1234", role)})
+        store.flush()
+        assert db_model_Task.query.get(1).status == "STARTED"
+
+        # The stop stores REVOKED, the terminated step fails.
+        db_model_Task.query.get(1).status = "REVOKED"
+        db.session.commit()
+        store.handle({"type": "task-failed", "exception": "Terminated",
+                      "uuid": worker_task_id(1, "abcd1234", "step0")})
+        store.flush()
+        db.session.expire_all()
+        assert db_model_Task.query.get(1).status == "REVOKED"
+        assert store.get(1)["status"] == "REVOKED"
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the blob cache of `ocrd_butler` package."""
+
+import os
+
+from ocrd_butler.execution import blob_cache
+from ocrd_butler.execution.blob_cache import BlobCache
+
+
+def test_store_and_hit(tmpdir):
+    """ A stored url is served from the cache. """
+    cache = BlobCache(str(tmpdir.join("cache")), max_size=1024)
+    assert cache.lookup("http://foo.bar/1.jpg") is None
+
+    entry = cache.store("http://foo.bar/1.jpg", [b"foo", b"bar"], etag='"abc"')
+    assert entry["size"] == 6
+
+    entry = cache.lookup("http://foo.bar/1.jpg")
+    assert entry["fresh"]
+    assert BlobCache.conditional_headers(entry) == {"If-None-Match": '"abc"'}
+
+    target = str(tmpdir.join("workspace", "DEFAULT", "1.jpg"))
+    cache.hit(entry, target)
+    with open(target, "rb") as fh:
+        assert fh.read() == b"foobar"
+    assert os.stat(target).st_ino == os.stat(cache.blob_path(entry["sha256"])).st_ino
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["blobs"] == 1
+
+
+def test_same_content_stored_once(tmpdir):
+    """ Equal files of different urls share one blob. """
+    cache = BlobCache(str(tmpdir), max_size=1024)
+    first = cache.store("http://foo.bar/1.jpg", [b"foobar"])
+    second = cache.store("http://foo.bar/2.jpg", [b"foobar"])
+    assert first["sha256"] == second["sha256"]
+    assert cache.stats()["size"] == 6
+
+
+def test_evict_least_recently_used(tmpdir):
+    """ The oldest blobs are removed if the cache grows too big. """
+    cache = BlobCache(str(tmpdir), max_size=10)
+    cache.store("http://foo.bar/1.jpg", [b"11111"])
+    cache.store("http://foo.bar/2.jpg", [b"22222"])
+    cache.hit(cache.lookup("http://foo.bar/1.jpg"), str(tmpdir.join("1.jpg")))
+    cache.store("http://foo.bar/3.jpg", [b"33333"])
+
+    assert cache.lookup("http://foo.bar/1.jpg") is not None
+    assert cache.lookup("http://foo.bar/2.jpg") is None
+    assert cache.lookup("http://foo.bar/3.jpg") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_hits_expire(tmpdir, monkeypatch):
+    """ Only a revalidation makes an entry fresh again, not a hit. """
+    now = [1600000000.0]
+    monkeypatch.setattr(blob_cache.time, "time", lambda: now[0])
+    cache = BlobCache(str(tmpdir), max_size=1024, max_age=60)
+    cache.store("http://foo.bar/1.jpg", [b"foobar"])
+
+    for _ in range(3):
+        now[0] += 25
+        entry = cache.lookup("http://foo.bar/1.jpg")
+        if entry["fresh"]:
+            cache.hit(entry, str(tmpdir.join("1.jpg")))
+    assert not entry["fresh"]
+
+    cache.hit(entry, str(tmpdir.join("1.jpg")), revalidated=True)
+    assert cache.lookup("http://foo.bar/1.jpg")["fresh"]
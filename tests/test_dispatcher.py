@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the dispatching of collections."""
+
+from ocrd_butler.execution.dispatcher import fair_shares
+
+
+def collection(id_, submitter=None, priority=5, in_flight=0, capacity=10):
+    return {"id": id_, "submitter": submitter, "priority": priority,
+            "in_flight": in_flight, "capacity": capacity}
+
+
+def test_fair_shares_between_submitters():
+    """ The submitter with fewer tasks in flight gets more places. """
+    shares = fair_shares([
+        collection(1, "alice", in_flight=4),
+        collection(2, "alice", in_flight=0),
+        collection(3, "bob", in_flight=0),
+    ], free=6)
+    assert shares == {1: 0, 2: 1, 3: 5}
+
+
+def test_fair_shares_priority_and_capacity():
+    """ A higher priority comes first, but only up to its capacity. """
+    shares = fair_shares([
+        collection(1, priority=5),
+        collection(2, priority=9, capacity=2),
+    ], free=5)
+    assert shares == {1: 3, 2: 2}
+    assert fair_shares([collection(1, capacity=3)]) == {1: 3}
+    assert fair_shares([collection(1)], free=-2) == {1: 0}
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the download of the workspaces of `ocrd_butler` package."""
+
+import os
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import requests
+
+from ocrd_butler.execution.download import WorkspaceDownloader
+
+
+def test_failed_download_leaves_no_part(tmpdir):
+    """ A download failing in the middle removes its temporary file. """
+    def chunks(chunk_size):
+        yield b"foo"
+        raise requests.exceptions.ConnectionError("Connection reset.")
+
+    response = mock.Mock(status_code=200, headers={})
+    response.iter_content.side_effect = chunks
+    downloader = WorkspaceDownloader(retries=0)
+    target = str(tmpdir.join("workspace", "DEFAULT", "1.jpg"))
+    with mock.patch.object(downloader, "_session") as session:
+        session.return_value.get.return_value = response
+        with pytest.raises(requests.exceptions.ConnectionError):
+            downloader.fetch("http://foo.bar/1.jpg", target)
+
+    assert os.listdir(os.path.dirname(target)) == []
+
+
+def test_failed_download_cancels_the_others(tmpdir):
+    """ The files not started yet aren't downloaded after a failure. """
+    fetched = []
+    release = threading.Event()
+
+    def fetch(url, path, copy=False):
+        fetched.append(url)
+        if url.endswith("1.jpg"):
+            raise requests.exceptions.ConnectionError("Connection reset.")
+        # Still running while the download fails.
+        release.wait(0.2)
+        return 3, False
+
+    files = [SimpleNamespace(ID="FILE_{0}".format(number), mimetype="image/jpeg",
+                             fileGrp="DEFAULT",
+                             url="http://foo.bar/{0}.jpg".format(number))
+             for number in range(1, 4)]
+    downloader = WorkspaceDownloader(workers=1)
+    with mock.patch.object(downloader, "fetch", side_effect=fetch):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            downloader.download(SimpleNamespace(directory=str(tmpdir)), files)
+
+    # The second one may have been started already.
+    assert fetched[0] == "http://foo.bar/1.jpg"
+    assert "http://foo.bar/3.jpg" not in fetched
@@ -3,7 +3,12 @@
 Testing the frontend of `ocrd_butler` package.
 """
 
+import io
 import json
+import os
+import tempfile
+import zipfile
+
 import responses
 from requests_html import HTML
 
@@ -80,6 +85,37 @@ class FrontendTests(TestCase):
         assert len(html.find('table > tr > th')) == 10
         assert len(html.find('table > tr > td')) == 0
 
+    def test_task_page_filter(self):
+        """Check if tasks are filtered and paginated."""
+        for index, status in enumerate(["CREATED", "SUCCESS", "SUCCESS"]):
+            db.session.add(db_model_Task(
+                uid="id-{0}".format(index),
+                src="mets_url",
+                chain_id=None,
+                description="Task {0}".format(index),
+                status=status))
+        db.session.commit()
+
+        response = self.client.get("/tasks?status=CREATED")
+        html = HTML(html=response.data)
+        assert len(html.find('table > tr > td')) == 10
+
+        response = self.client.get("/tasks?per_page=2&sort=id&order=asc")
+        html = HTML(html=response.data)
+        assert len(html.find('table > tr > td')) == 20
+        assert "ID: 1" in html.find('table > tr > td')[0].text
+        assert len(html.find('ul.pagination > li')) == 2
+
+        # At least one task on a page.
+        response = self.client.get("/tasks?per_page=0")
+        html = HTML(html=response.data)
+        assert len(html.find('ul.pagination > li')) == 3
+        assert html.find('option[value="REVOKED"]')
+
+        response = self.client.get("/tasks?q=Task 2")
+        html = HTML(html=response.data)
+        assert len(html.find('table > tr > td')) == 10
+
     def get_chain_id(self):
         chain_response = self.client.post("/api/chains", json=dict(
             name="TC Chain",
@@ -132,3 +168,34 @@ class FrontendTests(TestCase):
         html = HTML(html=response.data)
         assert len(html.find('table > tr > td')) == 0
 
+
+    def test_download_page_of_graph_chain(self):
+        """Check if the results are taken from the output of the sink node."""
+        response = self.client.post("/api/chains", json=dict(
+            name="Graph Chain", description="Compare two recognitions.",
+            nodes=[
+                {"processor": "ocrd-olena-binarize"},
+                {"processor": "ocrd-tesserocr-segment-region",
+                 "input_file_grp": ["OCR-D-IMG-BINPAGE"], "output_file_grp": "OCR-D-SEG"},
+                {"processor": "ocrd-tesserocr-recognize",
+                 "input_file_grp": ["OCR-D-SEG"], "output_file_grp": "OCR-D-OCR-TESS"},
+                {"processor": "ocrd-calamari-recognize",
+                 "input_file_grp": ["OCR-D-SEG"], "output_file_grp": "OCR-D-OCR-CALA"},
+                {"processor": "ocrd-dinglehopper",
+                 "input_file_grp": ["OCR-D-OCR-TESS", "OCR-D-OCR-CALA"],
+                 "output_file_grp": "OCR-D-EVAL"},
+            ]))
+        result_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(result_dir, "OCR-D-EVAL"))
+        with open(os.path.join(result_dir, "OCR-D-EVAL", "eval.xml"), "w") as fh:
+            fh.write("<xml/>")
+        db.session.add(db_model_Task(
+            uid="id", src="mets_url", chain_id=response.json["id"],
+            worker_task_id="worker-graph", status="SUCCESS",
+            results={"result_dir": result_dir, "task_id": 1}))
+        db.session.commit()
+
+        response = self.client.get("/download/page/worker-graph")
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+            assert zip_file.namelist() == ["OCR-D-EVAL/eval.xml"]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the metrics of `ocrd_butler` package."""
+
+from datetime import datetime
+import os
+import shutil
+
+from flask_testing import TestCase
+
+from ocrd_butler.config import TestingConfig
+from ocrd_butler.database.models import Task as db_model_Task
+from ocrd_butler.database.models import TaskStep as db_model_TaskStep
+from ocrd_butler.execution.blob_cache import BlobCache
+from ocrd_butler.execution.step_cache import StepCache
+from ocrd_butler.factory import create_app, db
+
+
+class MetricsTests(TestCase):
+    """Test the /metrics endpoint."""
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def create_app(self):
+        return create_app(config=TestingConfig)
+
+    def add_step(self, status, wall_time, cached=False, started=None):
+        step = db_model_TaskStep(
+            task_id=1, index=0, processor="ocrd-olena-binarize",
+            input_file_grp="DEFAULT", output_file_grp="OCR-D-IMG-BIN",
+            status=status, cached=cached, wall_time=wall_time,
+            started=started or datetime.now())
+        db.session.add(step)
+        db.session.commit()
+        return step
+
+    def test_metrics(self):
+        """ Tasks, steps and request latencies are exposed. """
+        response = self.client.post("/api/chains", json=dict(
+            name="New Chain",
+            description="Some foobar chain.",
+            processors=["ocrd-olena-binarize"]
+        ))
+        self.client.post("/api/tasks", json=dict(
+            chain_id=response.json["id"],
+            src="https://foobar.tdl/themets.xml",
+            description="Just a task."))
+
+        self.add_step("SUCCESS", 10.0)
+        running = self.add_step("RUNNING", None)
+        self.add_step("SUCCESS", 0.1, cached=True)
+
+        response = self.client.get("/metrics")
+        assert response.status_code == 200
+        text = response.data.decode("utf-8")
+        assert 'ocrd_butler_tasks{status="CREATED"} 1.0' in text
+        assert ('ocrd_butler_step_duration_seconds_count'
+                '{processor="ocrd-olena-binarize"} 1.0') in text
+        assert 'ocrd_butler_request_duration_seconds_count{method="POST",route="/api/tasks"} 1.0' in text
+
+        # The running step is counted once it's finished.
+        running.status = "SUCCESS"
+        running.wall_time = 20.0
+        db.session.commit()
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert ('ocrd_butler_step_duration_seconds_count'
+                '{processor="ocrd-olena-binarize"} 2.0') in text
+        assert ('ocrd_butler_step_duration_seconds_sum'
+                '{processor="ocrd-olena-binarize"} 30.0') in text
+
+        # The time from the dispatch to the start per priority.
+        task = db_model_Task.query.first()
+        task.received = datetime(2020, 1, 1, 12, 0, 0)
+        task.started = datetime(2020, 1, 1, 12, 1, 0)
+        db.session.commit()
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert 'ocrd_butler_queue_wait_seconds_sum{priority="5"} 60.0' in text
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert 'ocrd_butler_queue_wait_seconds_count{priority="5"} 1.0' in text
+
+        # The pages of the tasks succeeded within the last 15 minutes,
+        # not the ones of failed tasks.
+        task.status = "SUCCESS"
+        task.pages = 30
+        task.finished = datetime.now()
+        self.client.post("/api/tasks", json=dict(
+            chain_id=task.chain_id,
+            src="https://foobar.tdl/failed.xml",
+            description="A failed task."))
+        failed = db_model_Task.query.filter_by(
+            src="https://foobar.tdl/failed.xml").first()
+        failed.status = "FAILURE"
+        failed.pages = 60
+        failed.finished = datetime.now()
+        db.session.commit()
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert "ocrd_butler_pages_per_minute 2.0" in text
+
+    def test_abandoned_steps(self):
+        """ A step running for too long doesn't hold back the histogram. """
+        abandoned = self.add_step("RUNNING", None, started=datetime(2020, 1, 1))
+        self.add_step("SUCCESS", 10.0)
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert ('ocrd_butler_step_duration_seconds_count'
+                '{processor="ocrd-olena-binarize"} 1.0') in text
+
+        abandoned.status = "SUCCESS"
+        abandoned.wall_time = 20.0
+        self.add_step("SUCCESS", 10.0)
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert ('ocrd_butler_step_duration_seconds_count'
+                '{processor="ocrd-olena-binarize"} 2.0') in text
+        assert ('ocrd_butler_step_duration_seconds_sum'
+                '{processor="ocrd-olena-binarize"} 20.0') in text
+
+    def test_cache_metrics(self):
+        """ Hits and lookups of the caches are exposed once they exist. """
+        for directory in ("BLOB_CACHE_DIR", "STEP_CACHE_DIR"):
+            shutil.rmtree(self.app.config[directory], ignore_errors=True)
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert "ocrd_butler_blob_cache_lookups" not in text
+
+        blob_cache = BlobCache.from_config(self.app.config)
+        entry = blob_cache.store("https://foobar.tdl/image.tif", [b"image"])
+        blob_cache.hit(entry, os.path.join(
+            self.app.config["BLOB_CACHE_DIR"], "image.tif"))
+        step_cache = StepCache.from_config(self.app.config)
+        assert step_cache.lookup_step("unknown") is None
+
+        text = self.client.get("/metrics").data.decode("utf-8")
+        assert "ocrd_butler_blob_cache_hits_total 1.0" in text
+        assert "ocrd_butler_blob_cache_lookups_total 2.0" in text
+        assert "ocrd_butler_step_cache_hits_total 0.0" in text
+        assert "ocrd_butler_step_cache_lookups_total 1.0" in text
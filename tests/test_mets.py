@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the METS updates of `ocrd_butler` package."""
+
+import os
+
+from ocrd_models.ocrd_mets import OcrdMets
+
+from ocrd_butler.execution.mets import (
+    file_pages,
+    merge_agents,
+    merge_file_groups,
+    prune_pages
+)
+
+
+METS_FILE = os.path.join(os.path.dirname(__file__), "files",
+                         "sbb-mets-PPN821929127.xml")
+
+
+def test_prune_pages():
+    """ Only the files of the given pages are kept. """
+    mets = OcrdMets(filename=METS_FILE)
+    prune_pages(mets, ["PHYS_0002"])
+
+    assert [f.ID for f in mets.find_files(fileGrp="DEFAULT")] == [
+        "FILE_0002_DEFAULT"]
+    assert set(file_pages(mets).values()) == {"PHYS_0002"}
+
+
+def test_merge_file_groups():
+    """ Files of a group are copied with their pages. """
+    mets = OcrdMets(filename=METS_FILE)
+    source = OcrdMets(filename=METS_FILE)
+    prune_pages(source, ["PHYS_0001"])
+    source.add_file("OCR-D-OCR", ID="OCR_0001", mimetype="application/vnd.prima.page+xml",
+                    url="OCR-D-OCR/OCR_0001.xml", pageId="PHYS_0001")
+    source.add_file("OCR-D-OCR", ID="OCR_0004", mimetype="application/vnd.prima.page+xml",
+                    url="OCR-D-OCR/OCR_0004.xml", pageId="PHYS_0004")
+    source.add_agent(name="ocrd-dummy", _type="OTHER")
+
+    assert merge_file_groups(mets, source, ["OCR-D-OCR", "UNKNOWN"]) == 2
+    merge_agents(mets, source)
+
+    files = mets.find_files(fileGrp="OCR-D-OCR")
+    assert [(f.ID, f.pageId, f.local_filename) for f in files] == [
+        ("OCR_0001", "PHYS_0001", "OCR-D-OCR/OCR_0001.xml"),
+        ("OCR_0004", "PHYS_0004", "OCR-D-OCR/OCR_0004.xml")]
+    assert [a.name for a in mets.agents][-1] == "ocrd-dummy"
+
+    # Merging again replaces the files.
+    merge_file_groups(mets, source, ["OCR-D-OCR"])
+    assert len(mets.find_files(fileGrp="OCR-D-OCR")) == 2
+    assert len(mets.find_files(pageId="PHYS_0001", fileGrp="OCR-D-OCR")) == 1
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the termination of the processor processes."""
+
+import subprocess
+
+from ocrd_butler.execution import processes
+
+
+def test_kill_all():
+    """ The registered process groups are terminated with all children. """
+    process = subprocess.Popen(["sh", "-c", "sleep 60 & sleep 60"],
+                               start_new_session=True)
+    processes.started(process.pid, group=True)
+    processes.kill_all(grace=2)
+    processes.finished(process.pid)
+
+    # Reaped already, the background sleep was in the same group.
+    assert subprocess.run(["pgrep", "-g", str(process.pid)]).returncode == 1
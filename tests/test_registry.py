@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the processor registry of `ocrd_butler`."""
+
+import json
+import sys
+
+from ocrd_butler.registry import (
+    LazyMapping,
+    ProcessorRegistry,
+    package_tool_file
+)
+
+
+OCRD_TOOL = {
+    "version": "0.1.0",
+    "tools": {
+        "ocrd-foobar-binarize": {
+            "executable": "ocrd-foobar-binarize",
+            "input_file_grp": ["OCR-D-IMG"],
+            "output_file_grp": ["OCR-D-BIN"],
+            "parameters": {"level": {"type": "string", "default": "page"}},
+        },
+    },
+}
+
+
+def processor_package(tmp_path, monkeypatch, name="foobar_package"):
+    """ A package which fails if it is imported. """
+    package = tmp_path / "site" / name
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("raise RuntimeError('imported')\n")
+    (package / "ocrd-tool.json").write_text(json.dumps(OCRD_TOOL))
+    monkeypatch.syspath_prepend(str(tmp_path / "site"))
+    return package
+
+
+def test_tool_file_without_import(tmp_path, monkeypatch):
+    package = processor_package(tmp_path, monkeypatch)
+    assert package_tool_file("foobar_package") == str(package / "ocrd-tool.json")
+    assert "foobar_package" not in sys.modules
+
+
+def test_registry_is_lazy_and_cached(tmp_path, monkeypatch):
+    package = processor_package(tmp_path, monkeypatch)
+    cache = tmp_path / "processors.json"
+    registry = ProcessorRegistry([], ["foobar_package"], cache=str(cache))
+    config = LazyMapping(registry.config)
+    assert not cache.exists()
+
+    assert "ocrd-foobar-binarize" in config
+    assert config["ocrd-foobar-binarize"]["package"]["name"] == "foobar_package"
+    assert registry.action()["ocrd-foobar-binarize"] == {
+        "executable": "ocrd-foobar-binarize",
+        "input_file_grp": "OCR-D-IMG",
+        "output_file_grp": "OCR-D-BIN",
+        "parameters": {"level": "page"},
+    }
+    assert registry.view()[0]["name"] == "ocrd-foobar-binarize"
+    assert cache.exists()
+
+    # A new process uses the cache until the ocrd-tool.json changes.
+    cached = json.loads(cache.read_text())
+    cached["processors"]["ocrd-foobar-binarize"]["executable"] = "cached"
+    cache.write_text(json.dumps(cached))
+    registry = ProcessorRegistry([], ["foobar_package"], cache=str(cache))
+    assert registry.config()["ocrd-foobar-binarize"]["executable"] == "cached"
+
+    tool = dict(OCRD_TOOL, version="0.2.0")
+    (package / "ocrd-tool.json").write_text(json.dumps(tool))
+    registry = ProcessorRegistry([], ["foobar_package"], cache=str(cache))
+    config = registry.config()
+    assert config["ocrd-foobar-binarize"]["executable"] == "ocrd-foobar-binarize"
+    assert config["ocrd-foobar-binarize"]["package"]["version"] == "0.2.0"
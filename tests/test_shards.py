@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the page shards of `ocrd_butler` package."""
+
+import os
+import shutil
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.shards import (
+    create_branch_workspace,
+    create_shard_workspace,
+    locked_workspace,
+    merge_branch_workspace,
+    merge_shard_workspace,
+    page_shards
+)
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+
+
+def workspace_in(directory):
+    shutil.copyfile(
+        os.path.join(CURRENT_DIR, "files", "sbb-mets-PPN821929127.xml"),
+        os.path.join(str(directory), "mets.xml"))
+    return Resolver().workspace_from_url(
+        os.path.join(str(directory), "mets.xml"))
+
+
+def test_page_shards(tmpdir):
+    """ Split the pages of a workspace into shards. """
+    workspace = workspace_in(tmpdir)
+
+    assert page_shards(workspace, "DEFAULT", 2) == [
+        ["PHYS_0001", "PHYS_0002"], ["PHYS_0003"]]
+    assert page_shards(workspace, "DEFAULT", 0) == [
+        ["PHYS_0001", "PHYS_0002", "PHYS_0003"]]
+    assert page_shards(workspace, "UNKNOWN", 2) == []
+
+
+def test_merge_shard_workspace(tmpdir):
+    """ Files of a shard end up in the workspace. """
+    workspace = workspace_in(tmpdir)
+    shard = create_shard_workspace(workspace, 0, ["PHYS_0001"])
+
+    os.makedirs(os.path.join(shard.directory, "OCR-D-OCR"))
+    with open(os.path.join(shard.directory, "OCR-D-OCR", "OCR_0001.xml"), "w") as fh:
+        fh.write("<xml/>")
+    shard.mets.add_file("OCR-D-OCR", ID="OCR_0001", mimetype="application/vnd.prima.page+xml",
+                        url="OCR-D-OCR/OCR_0001.xml", pageId="PHYS_0001",
+                        local_filename="OCR-D-OCR/OCR_0001.xml")
+
+    merge_shard_workspace(workspace, shard, ["OCR-D-OCR"])
+
+    files = workspace.mets.find_files(fileGrp="OCR-D-OCR")
+    assert len(files) == 1
+    assert files[0].pageId == "PHYS_0001"
+    assert os.path.exists(os.path.join(str(tmpdir), "OCR-D-OCR", "OCR_0001.xml"))
+
+
+def test_merge_branch_workspaces(tmpdir):
+    """ The output of parallel branches ends up in the workspace. """
+    workspace = workspace_in(tmpdir)
+    branches = [create_branch_workspace(workspace, index) for index in range(2)]
+    agents = len(workspace.mets.agents)
+
+    for index, branch in enumerate(branches):
+        file_grp = "OCR-D-OCR-{0}".format(index)
+        os.makedirs(os.path.join(branch.directory, file_grp))
+        with open(os.path.join(branch.directory, file_grp, "OCR_0001.xml"), "w") as fh:
+            fh.write("<xml/>")
+        branch.mets.add_file(file_grp, ID="OCR_{0}_0001".format(index),
+                             mimetype="application/vnd.prima.page+xml",
+                             url=file_grp + "/OCR_0001.xml", pageId="PHYS_0001",
+                             local_filename=file_grp + "/OCR_0001.xml")
+        branch.mets.add_agent(name="processor-{0}".format(index))
+
+    for index, branch in enumerate(branches):
+        with locked_workspace(str(tmpdir)) as main:
+            # The size of the output is known after the branch is removed.
+            assert merge_branch_workspace(
+                main, branch, ["OCR-D-OCR-{0}".format(index)], agents) == len("<xml/>")
+            main.save_mets()
+        assert not os.path.exists(branch.directory)
+
+    workspace.reload_mets()
+    assert len(workspace.mets.find_files(fileGrp="OCR-D-OCR-0")) == 1
+    assert len(workspace.mets.find_files(fileGrp="OCR-D-OCR-1")) == 1
+    assert os.path.exists(os.path.join(str(tmpdir), "OCR-D-OCR-1", "OCR_0001.xml"))
+    assert [agent.name for agent in workspace.mets.agents][-2:] == [
+        "processor-0", "processor-1"]
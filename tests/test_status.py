@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the state of the tasks from the Celery events."""
+
+from types import SimpleNamespace
+import threading
+
+from ocrd_butler.execution.status import (
+    parse_worker_task_id,
+    TaskStateStore,
+    wait_for_tasks,
+    worker_task_id
+)
+
+
+def event(type_, task_id, run, role, timestamp=1600000000.0, **kwargs):
+    kwargs.update({
+        "type": type_,
+        "uuid": worker_task_id(task_id, run, role),
+        "timestamp": timestamp,
+    })
+    return kwargs
+
+
+def test_worker_task_id():
+    assert worker_task_id(3, "ab12cd34", "step1") == "3-ab12cd34-step1"
+    assert parse_worker_task_id("3-ab12cd34-step1") == (3, "ab12cd34", "step1")
+    assert parse_worker_task_id("c4e3b0f6-5d31-4b7a-9b2f-0e8f0e3f3b6a") is None
+    assert parse_worker_task_id(None) is None
+
+
+def test_store_follows_the_chain():
+    store = TaskStateStore()
+    store.handle(event("task-received", 1, "run1", "prepare"))
+    assert store.get(1)["status"] == "PENDING"
+    store.handle(event("task-started", 1, "run1", "prepare", 1600000001.0))
+    store.handle(event("task-started", 1, "run1", "step2", 1600000010.0))
+    state = store.get(1)
+    assert state["status"] == "STARTED"
+    assert state["step"] == 2
+    assert state["started"].timestamp() == 1600000001.0
+    # Only the last task of the chain finishes the task.
+    store.handle(event("task-succeeded", 1, "run1", "step2"))
+    assert store.get(1)["status"] == "STARTED"
+    store.handle(event("task-succeeded", 1, "run1", "finish", 1600000020.0))
+    assert store.get(1)["status"] == "SUCCESS"
+    assert store.dirty == {1}
+
+
+def test_store_ignores_former_runs():
+    store = TaskStateStore()
+    store.handle(event("task-received", 1, "run1", "prepare"))
+    store.handle(event("task-received", 1, "run2", "prepare"))
+    store.handle(event("task-failed", 1, "run1", "step0", exception="boom"))
+    assert store.get(1)["status"] == "PENDING"
+    store.handle(event("task-failed", 1, "run2", "step0", exception="boom"))
+    assert store.get(1)["status"] == "FAILURE"
+    assert store.get(1)["exception"] == "boom"
+    store.handle({"type": "worker-heartbeat"})
+    assert store.get(2) is None
+
+
+def test_store_changes():
+    store = TaskStateStore(log_lines=2)
+    store.handle(event("task-received", 1, "run1", "prepare"))
+    store.handle(event("task-received", 2, "run1", "prepare"))
+    store.handle(event("task-progress", 1, "run1", "prepare",
+                       progress={"stage": "download", "pages": 1}))
+    store.handle(event("task-log", 1, "run1", "step0", lines=["a", "b", "c"]))
+
+    changes, last = store.changes(0, {1})
+    assert last == 4
+    assert [(number, kind) for number, _, kind, _ in changes] == [
+        (1, "status"), (3, "progress"), (4, "log")]
+    assert changes[1][3] == {"stage": "download", "pages": 1}
+    assert store.log(1) == ["b", "c"]
+    # Nothing new, wait for the timeout.
+    assert store.changes(last, timeout=0.01) == ([], 4)
+
+
+def test_wait_for_tasks():
+    store = TaskStateStore()
+    task = SimpleNamespace(id=1, status="PENDING", received=None,
+                           started=None, finished=None)
+    states, done = wait_for_tasks(store, [task], until={"PENDING"})
+    assert done == [1]
+    assert states[1]["status"] == "PENDING"
+
+    store.handle(event("task-received", 1, "run1", "prepare"))
+    timer = threading.Timer(0.05, store.handle, [
+        event("task-succeeded", 1, "run1", "finish")])
+    timer.start()
+    states, done = wait_for_tasks(store, [task], until={"SUCCESS"}, timeout=5)
+    assert done == [1]
+    assert states[1]["status"] == "SUCCESS"
+
+    states, done = wait_for_tasks(store, [task], timeout=0.01)
+    assert done == []
+
+    # Without `until` only another status counts, not the next step.
+    store.handle(event("task-received", 2, "run1", "prepare"))
+    store.handle(event("task-started", 2, "run1", "prepare"))
+    task = SimpleNamespace(id=2, status="STARTED", received=None,
+                           started=None, finished=None)
+    threading.Timer(0.02, store.handle, [
+        event("task-started", 2, "run1", "step1")]).start()
+    states, done = wait_for_tasks(store, [task], timeout=0.1)
+    assert done == []
+    assert states[2]["step"] == 1
+
+    threading.Timer(0.02, store.handle, [
+        event("task-failed", 2, "run1", "step1")]).start()
+    states, done = wait_for_tasks(store, [task], timeout=5)
+    assert done == [2]
+    assert states[2]["status"] == "FAILURE"
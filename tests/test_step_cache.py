@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""Testing the step cache of `ocrd_butler` package."""
+
+import json
+import os
+
+from ocrd.resolver import Resolver
+
+from ocrd_butler.execution.step_cache import (
+    StepCache,
+    step_key
+)
+
+
+STEP = {
+    "executable": "ocrd-olena-binarize",
+    "version": "1.0.0",
+    "input_file_grp": "OCR-D-IMG",
+    "output_file_grp": "OCR-D-IMG-BIN",
+    "parameter": json.dumps({"impl": "sauvola"}),
+}
+
+
+def add_file(workspace, file_grp, file_id, page_id, content):
+    local_filename = os.path.join(file_grp, "{0}.xml".format(file_id))
+    os.makedirs(os.path.join(workspace.directory, file_grp), exist_ok=True)
+    with open(os.path.join(workspace.directory, local_filename), "w") as fh:
+        fh.write(content)
+    workspace.mets.add_file(file_grp, ID=file_id, mimetype="text/xml",
+                            url=local_filename, pageId=page_id,
+                            local_filename=local_filename)
+
+
+def workspace_in(directory, content="foo"):
+    workspace = Resolver().workspace_from_nothing(str(directory))
+    add_file(workspace, "OCR-D-IMG", "IMG_0001", "PHYS_0001", content)
+    add_file(workspace, "OCR-D-IMG", "IMG_0002", "PHYS_0002", content)
+    return workspace
+
+
+def test_step_key(tmpdir):
+    """ The key depends on the input files and the parameters. """
+    workspace = workspace_in(tmpdir.mkdir("one"))
+    key = step_key(STEP, workspace)
+
+    assert step_key(STEP, workspace_in(tmpdir.mkdir("two"))) == key
+    assert step_key(STEP, workspace_in(tmpdir.mkdir("three"), "bar")) != key
+    assert step_key(dict(STEP, parameter=json.dumps({"impl": "otsu"})),
+                    workspace) != key
+    assert step_key(dict(STEP, version="1.0.1"), workspace) != key
+    assert step_key(STEP, workspace, page_ids=["PHYS_0001"]) != key
+
+
+def test_store_and_restore(tmpdir):
+    """ The output of a step is restored into another workspace. """
+    cache = StepCache(str(tmpdir.mkdir("cache")), max_size=1024)
+    workspace = workspace_in(tmpdir.mkdir("one"))
+    key = step_key(STEP, workspace)
+    assert cache.lookup_step(key) is None
+
+    add_file(workspace, "OCR-D-IMG-BIN", "BIN_0001", "PHYS_0001", "binarized")
+    cache.store_step(key, workspace, "OCR-D-IMG-BIN")
+
+    other = workspace_in(tmpdir.mkdir("two"))
+    manifest = cache.lookup_step(step_key(STEP, other))
+    assert manifest is not None
+    cache.restore_step(manifest, other, "OCR-D-IMG-BIN")
+
+    files = other.mets.find_files(fileGrp="OCR-D-IMG-BIN")
+    assert [f.ID for f in files] == ["BIN_0001"]
+    assert files[0].pageId == "PHYS_0001"
+    with open(os.path.join(other.directory, files[0].local_filename)) as fh:
+        assert fh.read() == "binarized"
+
+    stats = cache.stats()
+    assert stats["step_hits"] == 1
+    assert stats["step_misses"] == 1
+    assert stats["step_hit_rate"] == 0.5
@@ -5,6 +5,7 @@
 import glob
 import os
 import shutil
+from unittest import mock
 
 import pytest
 from pytest import raises
@@ -59,6 +60,52 @@ class TasksTestExecution(TestCase):
         for field in task_model:
             assert isinstance(task_model[field], fields.String)
 
+    def test_step_queue(self):
+        """ Steps are routed by processor, package or the default queue. """
+        from ocrd_butler.execution.tasks import step_queue
+
+        self.app.config["PROCESSOR_QUEUES"] = {
+            "ocrd_calamari": "recognition",
+            "ocrd-olena-binarize": "light",
+        }
+        assert step_queue({"processor": "ocrd-calamari-recognize"}) == "recognition"
+        assert step_queue({"processor": "ocrd-olena-binarize"}) == "light"
+        assert step_queue({"processor": "ocrd-tesserocr-segment-line"}) == "celery"
+
+    def test_place_workspace(self):
+        """ Workspaces go to the root with the most space left, if it fits. """
+        from ocrd_butler.database.models import Task as db_model_Task
+        from ocrd_butler.execution.costs import record_step_cost
+        from ocrd_butler.execution.storage import (
+            estimate_footprint,
+            place_workspace
+        )
+
+        record_step_cost("ocrd-tesserocr-recognize", 10.0, 10, output_bytes=1000)
+        # Binarization writes an image per page, recognition 100 bytes.
+        assert estimate_footprint(
+            ["ocrd-olena-binarize", "ocrd-tesserocr-recognize"], 10, 500) == \
+            10 * 500 + 10 * 500 + 10 * 100
+
+        task = db_model_Task("uid", "https://foobar.tdl/mets.xml", None,
+                             status="STARTED")
+        task.storage_root = "/roots/b"
+        task.footprint = 15000
+        db.session.add(task)
+        db.session.commit()
+
+        free = {"/roots/a": 10000, "/roots/b": 20000, "/scratch": 100000}
+        self.app.config.update({
+            "OCRD_BUTLER_STORAGE_ROOTS": ["/roots/a", "/roots/b"],
+            "STORAGE_HEADROOM": 1000,
+            "OCRD_BUTLER_SCRATCH": "/scratch",
+        })
+        with mock.patch("ocrd_butler.execution.storage.free_disk", free.get):
+            assert place_workspace(2, 5000, self.app.config) == ("/roots/a", True)
+            assert place_workspace(2, 9500, self.app.config) == (None, False)
+            # The task itself doesn't count.
+            assert place_workspace(1, 9500, self.app.config) == ("/roots/b", True)
+
     # @pytest.mark.celery(result_backend='redis://')
     # def test_run_task(self):
     #     """ Test our run_task task.